@@ -0,0 +1,251 @@
+#! /usr/local/bin/python3
+
+"""
+Benchmarks the marker detection on synthetic scenes for different ArUco dictionaries, detector parameter
+presets and scene properties (resolution, marker count, marker size, blur and noise).
+
+For every combination, the detection throughput (frames per second) and recall (share of the placed markers
+that were detected) are measured and written to a JSON report. A previous report can be passed with --compare
+to detect performance regressions.
+
+Example:
+python3 benchmark_detector.py -d DICT_4X4_50 DICT_6X6_250 -r 1280x720 1920x1080 -c 4 10 -p default fast
+"""
+
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+import cv2
+import numpy as np
+
+from classes.camera import ArucoDetector, CameraParams, ARUCO_DICTS, DETECTOR_PRESETS, create_detector_parameters
+
+
+def dictionary_size(aruco_dict_type: int) -> int:
+    return cv2.aruco.getPredefinedDictionary(aruco_dict_type).bytesList.shape[0]
+
+
+def load_tag(aruco_dict_name: str, marker_id: int, size: int, tags_dir: str | None) -> np.ndarray:
+    """
+    Loads a marker image from the tags directory if available, otherwise generates it.
+    """
+    if tags_dir is not None:
+        path = os.path.join(tags_dir, f"{aruco_dict_name}_ID{marker_id}.png")
+        if os.path.exists(path):
+            tag = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+            return cv2.resize(tag, (size, size), interpolation=cv2.INTER_AREA)
+
+    tag = np.zeros((size, size, 1), dtype="uint8")
+    cv2.aruco.generateImageMarker(cv2.aruco.getPredefinedDictionary(ARUCO_DICTS[aruco_dict_name]), marker_id, size, tag, 1)
+    return tag.reshape(size, size)
+
+
+def generate_scene(
+    aruco_dict_name: str,
+    resolution: tuple[int, int],
+    marker_count: int,
+    marker_size: int,
+    blur: float,
+    noise: float,
+    rng: np.random.Generator,
+    tags_dir: str | None
+) -> tuple[np.ndarray, set[int]]:
+    """
+    Generates a grayscale scene with randomly placed, rotated markers.
+
+    @returns the scene and the set of marker IDs placed on it
+    """
+    width, height = resolution
+    scene = np.full((height, width), 255, dtype=np.uint8)
+
+    # every marker gets its own cell of a grid, so markers never overlap. The cells are large enough
+    # for any rotation of the marker plus a white border around it.
+    cell_size = int(marker_size * 1.6)
+    columns, rows = width // cell_size, height // cell_size
+    if columns * rows < marker_count:
+        raise ValueError(f"{marker_count} markers of size {marker_size} don't fit into {width}x{height}")
+
+    marker_ids = rng.choice(dictionary_size(ARUCO_DICTS[aruco_dict_name]), marker_count, replace=False)
+    cells = rng.choice(columns * rows, marker_count, replace=False)
+
+    for marker_id, cell in zip(marker_ids, cells):
+        tag = load_tag(aruco_dict_name, int(marker_id), marker_size, tags_dir)
+        # place the marker in the middle of a white patch and rotate it randomly
+        patch = np.full((cell_size, cell_size), 255, dtype=np.uint8)
+        offset = (cell_size - marker_size) // 2
+        patch[offset:offset + marker_size, offset:offset + marker_size] = tag
+        rotation = cv2.getRotationMatrix2D((cell_size / 2, cell_size / 2), rng.uniform(-180, 180), 1)
+        patch = cv2.warpAffine(patch, rotation, (cell_size, cell_size), borderValue=255)
+
+        x, y = (cell % columns) * cell_size, (cell // columns) * cell_size
+        scene[y:y + cell_size, x:x + cell_size] = patch
+
+    if blur > 0:
+        scene = cv2.GaussianBlur(scene, (0, 0), blur)
+    if noise > 0:
+        scene = np.clip(scene + rng.normal(0, noise, scene.shape), 0, 255).astype(np.uint8)
+
+    return scene, set(int(i) for i in marker_ids)
+
+
+def run_benchmark(config: dict, frames: int, scene_count: int, tags_dir: str | None, seed: int) -> dict:
+    """
+    Runs the detection on a number of scenes generated from a config and measures throughput and recall.
+    """
+    rng = np.random.default_rng(seed)
+    scenes = [
+        generate_scene(
+            config["dictionary"], config["resolution"], config["marker_count"],
+            config["marker_size"], config["blur"], config["noise"], rng, tags_dir
+        )
+        for _ in range(scene_count)
+    ]
+
+    detector = ArucoDetector(
+        ARUCO_DICTS[config["dictionary"]],
+        CameraParams(),
+        detector_parameters=create_detector_parameters(config["preset"]),
+        # markers matched by the tracker were not decoded, only decoding is measured
+        track_rejected=False
+    )
+
+    found_markers = 0
+    placed_markers = 0
+    false_positives = 0
+    start = time.perf_counter()
+    for frame_index in range(frames):
+        scene, placed_ids = scenes[frame_index % scene_count]
+        detector.detect(scene)
+        detected_ids = set(detector.marker_table.visible_ids.tolist())
+        found_markers += len(detected_ids & placed_ids)
+        false_positives += len(detected_ids - placed_ids)
+        placed_markers += len(placed_ids)
+    elapsed = time.perf_counter() - start
+
+    return {
+        **config,
+        "resolution": f"{config['resolution'][0]}x{config['resolution'][1]}",
+        "frames": frames,
+        "fps": frames / elapsed,
+        "ms_per_frame": elapsed / frames * 1000,
+        "recall": found_markers / placed_markers,
+        "false_positives": false_positives
+    }
+
+
+def config_key(result: dict) -> tuple:
+    return tuple(result[k] for k in ("dictionary", "preset", "resolution", "marker_count", "marker_size", "blur", "noise"))
+
+
+def compare(results: list[dict], baseline_file: str, tolerance: float) -> list[str]:
+    """
+    Compares results to a previous report.
+
+    @returns a description of every configuration whose throughput or recall dropped by more than the tolerance
+    """
+    with open(baseline_file, "r") as f:
+        baseline = {config_key(r): r for r in json.load(f)["results"]}
+
+    regressions: list[str] = []
+    for result in results:
+        old = baseline.get(config_key(result))
+        if old is None:
+            continue
+        if result["fps"] < old["fps"] * (1 - tolerance):
+            regressions.append(f"{config_key(result)}: {old['fps']:.1f} -> {result['fps']:.1f} fps")
+        if result["recall"] < old["recall"] - tolerance:
+            regressions.append(f"{config_key(result)}: recall {old['recall']:.3f} -> {result['recall']:.3f}")
+    return regressions
+
+
+def main(args: dict[str, any]) -> int:
+    for dictionary in args["dicts"]:
+        if dictionary not in ARUCO_DICTS:
+            print(f"[ERROR] ArUco dictionary '{dictionary}' is not supported or invalid")
+            return 1
+    for preset in args["presets"]:
+        if preset not in DETECTOR_PRESETS:
+            print(f"[ERROR] Detector preset '{preset}' is invalid, use one of {DETECTOR_PRESETS}")
+            return 1
+    resolutions = [tuple(int(v) for v in r.lower().split("x")) for r in args["resolutions"]]
+
+    combinations = list(itertools.product(
+        args["dicts"], args["presets"], resolutions, args["counts"], args["sizes"], args["blur"], args["noise"]
+    ))
+
+    results: list[dict] = []
+    for index, (dictionary, preset, resolution, count, size, blur, noise) in enumerate(combinations):
+        config = {
+            "dictionary": dictionary,
+            "preset": preset,
+            "resolution": resolution,
+            "marker_count": count,
+            "marker_size": size,
+            "blur": blur,
+            "noise": noise
+        }
+        result = run_benchmark(config, args["frames"], args["scenes"], args["tags"], args["seed"])
+        results.append(result)
+        print(
+            f"[{index + 1}/{len(combinations)}] {dictionary} {preset} {result['resolution']} "
+            f"count={count} size={size} blur={blur} noise={noise}: "
+            f"{result['fps']:.1f} fps, recall={result['recall']:.3f}, false positives={result['false_positives']}"
+        )
+
+    with open(args["output"], "w") as f:
+        json.dump({
+            "opencv_version": cv2.__version__,
+            "opencv_threads": cv2.getNumThreads(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "results": results
+        }, f, indent=4)
+    print(f"[INFO] Report written to '{args['output']}'")
+
+    if args["compare"] is not None:
+        regressions = compare(results, args["compare"], args["tolerance"])
+        for regression in regressions:
+            print(f"[REGRESSION] {regression}")
+        if regressions:
+            return 2
+
+    return 0
+
+
+def get_args():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-d", "--dicts", nargs="+", default=list(ARUCO_DICTS.keys()),
+                    help="ArUco dictionaries to benchmark (default: all)")
+    ap.add_argument("-p", "--presets", nargs="+", default=["default"],
+                    help=f"detector parameter presets to benchmark {DETECTOR_PRESETS}")
+    ap.add_argument("-r", "--resolutions", nargs="+", default=["1280x720"],
+                    help="scene resolutions as WIDTHxHEIGHT")
+    ap.add_argument("-c", "--counts", nargs="+", type=int, default=[6],
+                    help="number of markers per scene")
+    ap.add_argument("-s", "--sizes", nargs="+", type=int, default=[80],
+                    help="marker side lengths in pixels")
+    ap.add_argument("-b", "--blur", nargs="+", type=float, default=[0.0],
+                    help="gaussian blur sigmas in pixels")
+    ap.add_argument("-n", "--noise", nargs="+", type=float, default=[0.0],
+                    help="gaussian noise standard deviations in gray levels")
+    ap.add_argument("-f", "--frames", type=int, default=30,
+                    help="number of frames to detect per configuration")
+    ap.add_argument("--scenes", type=int, default=5,
+                    help="number of different scenes per configuration")
+    ap.add_argument("--seed", type=int, default=0,
+                    help="random seed for scene generation")
+    ap.add_argument("--tags", default="tags",
+                    help="directory with pregenerated marker images, markers not found there are generated")
+    ap.add_argument("-o", "--output", default="benchmark_results.json",
+                    help="file to write the JSON report to")
+    ap.add_argument("--compare", required=False,
+                    help="previous JSON report to check for regressions")
+    ap.add_argument("--tolerance", type=float, default=0.1,
+                    help="relative throughput drop (and absolute recall drop) accepted before reporting a regression")
+    return vars(ap.parse_args())
+
+
+if __name__ == "__main__":
+    sys.exit(main(get_args()))
@@ -1,5 +1,14 @@
 """
 Interactive camera calibration.
+
+In live mode, calibration images are taken interactively. In folder mode, the chessboard corners of all
+[0-9][0-9][0-9].png images of a folder are detected in parallel without any GUI, and cached in a sidecar file
+next to the images, so rerunning the calibration only processes new or changed images.
+
+Example:
+python3 camera_calib.py                                                 (asks for a folder or 'live')
+python3 camera_calib.py calibration/data_046d_0825/20230529_214338      (folder mode)
+
 References:
 https://learnopencv.com/camera-calibration-using-opencv/
 https://docs.opencv.org/4.x/dc/dbb/tutorial_py_calibration.html
@@ -11,8 +20,12 @@ https://docs.opencv.org/4.x/dc/dbb/tutorial_py_calibration.html
 import numpy as np
 import cv2
 import glob
+import hashlib
+import json
+import sys
 import time as t
 import os
+from concurrent.futures import ProcessPoolExecutor
 from classes.camera import CameraParams
 
 # create output constants
@@ -28,9 +41,18 @@ CHESSBOARD = (6, 7)
 # output image counter
 image_counter: int = 0
 
+# chessboard corners detected per row and column, as passed to findChessboardCorners
+PATTERN_SIZE = (7, 6)
+FIND_FLAGS = cv2.CALIB_CB_ADAPTIVE_THRESH + cv2.CALIB_CB_FAST_CHECK + cv2.CALIB_CB_NORMALIZE_IMAGE
+
 # termination criteria
 criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.001)
 
+# sidecar file the detected corners of a folder's images are cached in
+CORNER_CACHE_FILE = "corners_cache.npz"
+# the cached corners are only valid for the same pattern, detection and refinement settings
+CORNER_CACHE_KEY = f"{PATTERN_SIZE}_{FIND_FLAGS}_{criteria}_(11, 11)"
+
 # prepare object points representing the theoretical 3D-points of the board corner points
 # on the chessboard on the chessboard plane. These should be the same for each frame
 # objp will look something like ((0,0,0), (1,0,0), (2,0,0) ..., (6,5,0))
@@ -40,6 +62,18 @@ objp[:,:2] = np.mgrid[0:7,0:6].T.reshape(-1,2)
 # Arrays to store object points and image points from all the images.
 objpoints = [] # 3d point in real world space
 imgpoints = [] # 2d points in image plane.
+view_names = [] # image file (or number) of every view, for the error report
+
+# at most this many views are passed to calibrateCamera, chosen for coverage and pose diversity
+MAX_VIEWS = 40
+# image coverage is counted in the cells of a grid of this size (x, y)
+COVERAGE_GRID = (8, 6)
+# views with a reprojection error above median + OUTLIER_MADS * (scaled) median absolute deviation are dropped,
+# but never views with an error below MIN_OUTLIER_ERROR pixels, which is within the corner detection accuracy
+OUTLIER_MADS = 3.0
+MIN_OUTLIER_ERROR = 0.5
+MAX_REFITS = 3
+MIN_VIEWS = 10
 
 # Shape of the image. This will be updated on every new processed image
 # but should always be the same. This is needed at the end for calibrating
@@ -55,7 +89,7 @@ def process_calib_image(src_frame: cv2.Mat, save: bool = False):
 
     gray = cv2.cvtColor(src_frame, cv2.COLOR_BGR2GRAY)
     # Find the chess board corners
-    ret, corners = cv2.findChessboardCorners(gray, (7,6), cv2.CALIB_CB_ADAPTIVE_THRESH + cv2.CALIB_CB_FAST_CHECK + cv2.CALIB_CB_NORMALIZE_IMAGE)
+    ret, corners = cv2.findChessboardCorners(gray, PATTERN_SIZE, FIND_FLAGS)
     print(ret)
     # If found, add object points, image points (after refining them)
     if ret == True:
@@ -64,6 +98,7 @@ def process_calib_image(src_frame: cv2.Mat, save: bool = False):
 
         # add a new entry of real-world 3D positions
         objpoints.append(objp)
+        view_names.append(str(image_counter).zfill(3) + ".png" if save else f"view {len(view_names)}")
 
         # determine accurate point position of the corners and save the 2D positions
         corners2 = cv2.cornerSubPix(gray, corners, (11,11), (-1,-1), criteria)
@@ -74,7 +109,7 @@ def process_calib_image(src_frame: cv2.Mat, save: bool = False):
             cv2.imwrite(output_folder_path + str(image_counter).zfill(3) + ".png", src_frame)
 
         # Draw and display the corners
-        cv2.drawChessboardCorners(src_frame, (7,6), corners2, ret)
+        cv2.drawChessboardCorners(src_frame, PATTERN_SIZE, corners2, ret)
         cv2.imshow('Last Capture', src_frame)
 
         if save:
@@ -84,26 +119,273 @@ def process_calib_image(src_frame: cv2.Mat, save: bool = False):
             image_counter += 1
         
 
+def view_features(corners: np.ndarray, frame_size: tuple[int, int]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    @param corners VxNx1x2 chessboard corners of V views
+    @returns (VxC boolean coverage grid cells hit by the corners of every view,
+        Vx7 pose descriptor of every view: board center, size, tilt along both axes and in-plane rotation)
+    """
+    points = corners.reshape(len(corners), -1, 2)
+    cells_x = np.clip((points[..., 0] / frame_size[0] * COVERAGE_GRID[0]).astype(int), 0, COVERAGE_GRID[0] - 1)
+    cells_y = np.clip((points[..., 1] / frame_size[1] * COVERAGE_GRID[1]).astype(int), 0, COVERAGE_GRID[1] - 1)
+    coverage = np.zeros((len(points), COVERAGE_GRID[0] * COVERAGE_GRID[1]), dtype=bool)
+    np.put_along_axis(coverage, cells_y * COVERAGE_GRID[0] + cells_x, True, axis=1)
+
+    # the outer corners of the board describe its pose without knowing the camera:
+    # perspective makes opposite edges differ in length when the board is tilted
+    grid = points.reshape(len(points), PATTERN_SIZE[1], PATTERN_SIZE[0], 2)
+    top_left, top_right, bottom_left, bottom_right = grid[:, 0, 0], grid[:, 0, -1], grid[:, -1, 0], grid[:, -1, -1]
+    top = np.linalg.norm(top_right - top_left, axis=1)
+    bottom = np.linalg.norm(bottom_right - bottom_left, axis=1)
+    left = np.linalg.norm(bottom_left - top_left, axis=1)
+    right = np.linalg.norm(bottom_right - top_right, axis=1)
+    diagonal = np.hypot(*frame_size)
+    angle = np.arctan2(*(top_right - top_left).T[::-1])
+    pose = np.column_stack((
+        points[..., 0].mean(axis=1) / frame_size[0],
+        points[..., 1].mean(axis=1) / frame_size[1],
+        (top + bottom + left + right) / (2 * diagonal),
+        np.log(top / bottom),
+        np.log(left / right),
+        # the rotation as a point on a circle, so boards rotated by -179° and 179° are close
+        0.5 * np.cos(angle),
+        0.5 * np.sin(angle)
+    ))
+    return coverage, pose
+
+
+def select_views(corners: np.ndarray, frame_size: tuple[int, int], max_views: int) -> np.ndarray:
+    """
+    Greedily selects the views that add the most image coverage and pose diversity,
+    so near-duplicate views are left out
+
+    @returns the indices of the selected views
+    """
+    if len(corners) <= max_views:
+        return np.arange(len(corners))
+
+    coverage, pose = view_features(corners, frame_size)
+    selected = [int(np.argmax(coverage.sum(axis=1)))]
+    covered = coverage[selected[0]].copy()
+    # distance of every view's pose to the closest selected one
+    pose_distance = np.linalg.norm(pose - pose[selected[0]], axis=1)
+    while len(selected) < max_views:
+        new_cells = (coverage & ~covered).sum(axis=1) / coverage.shape[1]
+        score = new_cells + pose_distance
+        score[selected] = -np.inf
+        best = int(np.argmax(score))
+        selected.append(best)
+        covered |= coverage[best]
+        pose_distance = np.minimum(pose_distance, np.linalg.norm(pose - pose[best], axis=1))
+    return np.array(sorted(selected))
+
+
+def rodrigues(rvecs: np.ndarray) -> np.ndarray:
+    """
+    @returns Vx3x3 rotation matrices of Vx3 rotation vectors
+    """
+    theta = np.linalg.norm(rvecs, axis=1)[:, None, None]
+    k = rvecs / np.maximum(theta[:, 0], 1e-12)
+    cross = np.zeros((len(rvecs), 3, 3))
+    cross[:, 0, 1], cross[:, 0, 2], cross[:, 1, 2] = -k[:, 2], k[:, 1], -k[:, 0]
+    cross -= cross.transpose(0, 2, 1)
+    return np.eye(3) + np.sin(theta) * cross + (1 - np.cos(theta)) * cross @ cross
+
+
+def view_errors(corners: np.ndarray, matrix: np.ndarray, distortion: np.ndarray, rvecs, tvecs) -> np.ndarray:
+    """
+    Projects the board corners of all views at once
+
+    @param corners VxNx1x2 detected chessboard corners of V views
+    @returns the RMS reprojection error of every view in pixels
+    """
+    rvecs = np.asarray(rvecs, dtype=np.float64).reshape(-1, 3)
+    tvecs = np.asarray(tvecs, dtype=np.float64).reshape(-1, 3)
+    distortion = np.asarray(distortion, dtype=np.float64).ravel()
+    if len(distortion) > 5:
+        # the rational/thin prism models aren't implemented here
+        projected = np.array([cv2.projectPoints(objp, r, t_, matrix, distortion)[0] for r, t_ in zip(rvecs, tvecs)])
+    else:
+        k1, k2, p1, p2, k3 = np.pad(distortion, (0, 5 - len(distortion)))
+        camera_points = objp[None].astype(np.float64) @ rodrigues(rvecs).transpose(0, 2, 1) + tvecs[:, None, :]
+        x = camera_points[..., 0] / camera_points[..., 2]
+        y = camera_points[..., 1] / camera_points[..., 2]
+        r2 = x * x + y * y
+        radial = 1 + k1 * r2 + k2 * r2 * r2 + k3 * r2 * r2 * r2
+        x_distorted = x * radial + 2 * p1 * x * y + p2 * (r2 + 2 * x * x)
+        y_distorted = y * radial + p1 * (r2 + 2 * y * y) + 2 * p2 * x * y
+        projected = np.stack((
+            matrix[0, 0] * x_distorted + matrix[0, 1] * y_distorted + matrix[0, 2],
+            matrix[1, 1] * y_distorted + matrix[1, 2]
+        ), axis=-1)
+    differences = projected.reshape(len(rvecs), -1, 2) - corners.reshape(len(rvecs), -1, 2)
+    return np.sqrt((differences ** 2).sum(axis=2).mean(axis=1))
+
+
 def calibrate():
     """
     performs the calibration calculations using the previously stored 
-    calibration points
+    calibration points. A bounded subset of informative views is calibrated with, and views
+    with outlying reprojection errors are dropped and the calibration is fitted again.
     """
     global frame_shape
 
-    # calculate calib values
-    ret, mtx, dist, rvecs, tvecs = cv2.calibrateCamera(objpoints, imgpoints, frame_shape, None, None)
+    start_time = t.perf_counter()
+    corners = np.array(imgpoints, dtype=np.float32).reshape(len(imgpoints), -1, 1, 2)
+    views = select_views(corners, frame_shape, MAX_VIEWS)
+    print(f"[INFO] Calibrating with {len(views)} of {len(corners)} views")
+    # why a view was not used for the final calibration, by view index
+    dropped: dict[int, str] = {i: "unused" for i in range(len(corners)) if i not in set(views.tolist())}
+
+    mtx, dist, flags = None, None, 0
+    for refit in range(MAX_REFITS + 1):
+        # calculate calib values, starting from the previous fit when refitting
+        ret, mtx, dist, rvecs, tvecs = cv2.calibrateCamera(
+            [objp] * len(views), [corners[i] for i in views], frame_shape, mtx, dist, flags=flags
+        )
+        flags = cv2.CALIB_USE_INTRINSIC_GUESS
+        errors = view_errors(corners[views], mtx, dist, rvecs, tvecs)
+
+        median = np.median(errors)
+        threshold = max(median + OUTLIER_MADS * 1.4826 * np.median(np.abs(errors - median)), MIN_OUTLIER_ERROR)
+        outliers = errors > threshold
+        if refit == MAX_REFITS or not outliers.any() or len(views) - outliers.sum() < MIN_VIEWS:
+            break
+        for i in views[outliers]:
+            dropped[int(i)] = f"outlier (refit {refit + 1})"
+        print(f"[INFO] Dropping {outliers.sum()} outlier views with errors above {threshold:.3f} px")
+        views = views[~outliers]
+
+    print(f"[INFO] Calibration took {t.perf_counter() - start_time:.2f} s")
     print("Calibration results:")
     print("ret:", ret)
     print("matrix:", mtx)
     print("distortion:", dist)
 
-    # save calibration values
-    CameraParams(mtx, dist).save(output_folder_path + "params_" + DATECODE + ".pickle")
+    # save calibration values together with the resolution they are valid for
+    CameraParams(mtx, dist, resolution=frame_shape, reprojection_error=ret).save(output_folder_path + "params_" + DATECODE + ".npz")
+
+    # per view errors: views not calibrated with are located with the final calibration
+    all_errors = np.zeros(len(corners))
+    all_errors[views] = errors
+    for i in dropped:
+        _, rvec, tvec = cv2.solvePnP(objp, corners[i], mtx, dist)
+        all_errors[i] = view_errors(corners[i:i + 1], mtx, dist, rvec.reshape(1, 3), tvec.reshape(1, 3))[0]
+    report = {
+        "reprojection_error": ret,
+        "views_used": len(views),
+        "views_total": len(corners),
+        "views": [
+            {"view": view_names[i] if i < len(view_names) else f"view {i}", "error": float(all_errors[i]), "status": dropped.get(i, "used")}
+            for i in range(len(corners))
+        ]
+    }
+    with open(output_folder_path + "view_errors_" + DATECODE + ".json", "w") as f:
+        json.dump(report, f, indent=4)
     
 
+def image_hash(image_file: str) -> str:
+    with open(image_file, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def find_corners(image_file: str) -> tuple[tuple[int, int], np.ndarray | None]:
+    """
+    Detects and refines the chessboard corners of an image file (runs in the worker processes)
+
+    @returns (image size as (width, height), corners or None if the chessboard wasn't found)
+    """
+    gray = cv2.imread(image_file, cv2.IMREAD_GRAYSCALE)
+    if gray is None:
+        raise ValueError(f"Could not read image '{image_file}'")
+    ret, corners = cv2.findChessboardCorners(gray, PATTERN_SIZE, FIND_FLAGS)
+    if not ret:
+        return gray.shape[::-1], None
+    return gray.shape[::-1], cv2.cornerSubPix(gray, corners, (11,11), (-1,-1), criteria).reshape(-1, 1, 2)
+
+
+def _init_worker():
+    # every worker processes one image at a time, OpenCV's own threads would only compete with the other workers
+    cv2.setNumThreads(1)
+
+
+def load_corner_cache(folder: str) -> dict[str, tuple[tuple[int, int], np.ndarray | None]]:
+    """
+    @returns the cached detection results of a folder's images by image hash, empty if there is no valid cache
+    """
+    cache_file = os.path.join(folder, CORNER_CACHE_FILE)
+    if not os.path.exists(cache_file):
+        return {}
+    try:
+        with np.load(cache_file, allow_pickle=False) as data:
+            if str(data["key"]) != CORNER_CACHE_KEY:
+                return {}
+            return {
+                str(h): ((int(size[0]), int(size[1])), corners if found else None)
+                for h, size, found, corners in zip(data["hashes"], data["sizes"], data["found"], data["corners"])
+            }
+    except (OSError, ValueError, KeyError):
+        print(f"[WARNING] Ignoring invalid corner cache '{cache_file}'")
+        return {}
+
+
+def save_corner_cache(folder: str, results: dict[str, tuple[tuple[int, int], np.ndarray | None]]):
+    corner_count = PATTERN_SIZE[0] * PATTERN_SIZE[1]
+    corners = np.zeros((len(results), corner_count, 1, 2), dtype=np.float32)
+    for i, (_, image_corners) in enumerate(results.values()):
+        if image_corners is not None:
+            corners[i] = image_corners
+    np.savez(
+        os.path.join(folder, CORNER_CACHE_FILE),
+        key=np.array(CORNER_CACHE_KEY),
+        hashes=np.array(list(results.keys()), dtype=str),
+        sizes=np.array([size for size, _ in results.values()], dtype=np.int32).reshape(-1, 2),
+        found=np.array([c is not None for _, c in results.values()], dtype=bool),
+        corners=corners
+    )
+
+
+def process_folder(folder: str, workers: int | None = None, use_cache: bool = True):
+    """
+    Detects the chessboard corners of all calibration images of a folder in a process pool and adds
+    them to the calibration values. Images whose corners are cached are not processed again.
+    """
+    global frame_shape
+
+    images = sorted(glob.glob(os.path.join(folder, "[0-9][0-9][0-9].png")))
+    hashes = [image_hash(image) for image in images]
+    cache = load_corner_cache(folder) if use_cache else {}
+    missing = [(image, h) for image, h in zip(images, hashes) if h not in cache]
+    print(f"[INFO] {len(images)} images, {len(images) - len(missing)} cached, processing {len(missing)}")
+
+    start_time = t.perf_counter()
+    results = {h: cache[h] for h in hashes if h in cache}
+    if missing:
+        with ProcessPoolExecutor(workers, initializer=_init_worker) as executor:
+            for (image, h), result in zip(missing, executor.map(find_corners, [image for image, _ in missing])):
+                results[h] = result
+                print("processed: ", image, result[1] is not None)
+        save_corner_cache(folder, results)
+    print(f"[INFO] Corner detection took {t.perf_counter() - start_time:.2f} s")
+
+    for image, h in zip(images, hashes):
+        size, corners = results[h]
+        if corners is None:
+            continue
+        if frame_shape is not None and size != frame_shape:
+            print(f"[WARNING] Skipping '{image}', its size {size} differs from {frame_shape}")
+            continue
+        frame_shape = size
+        objpoints.append(objp)
+        imgpoints.append(corners)
+        view_names.append(os.path.basename(image))
+
+
 if __name__ == "__main__":
-    user_choice = input("Image source folder or 'live' for live camera to take calibration data: ")
+    if len(sys.argv) > 1:
+        user_choice = sys.argv[1]
+    else:
+        user_choice = input("Image source folder or 'live' for live camera to take calibration data: ")
 
     if user_choice == "live":
         # prepare output folder
@@ -129,19 +411,12 @@ if __name__ == "__main__":
             # c for calibrate 
             elif key == ord("c"):
                 calibrate()
+
+        cv2.destroyAllWindows()
             
     else:
         # prepare output folder
         output_folder_path = user_choice + "/"
-        # process all the images
-        images = glob.glob(user_choice + "/[0-9][0-9][0-9].png")
-        for image in images:
-            print("processing: ", image)
-            img = cv2.imread(image)
-            process_calib_image(img, save=False)
-            if cv2.waitKey(1) & 0xFF == ord("q"):
-                break
-        
+        # process all the images without any GUI
+        process_folder(user_choice)
         calibrate()
-
-    cv2.destroyAllWindows()
@@ -1,7 +1,22 @@
 from ._marker import Marker
-from ._aruco_detector import ArucoDetector, ARUCO_DICTS
+from ._marker_table import MarkerTable, MARKER_DTYPE
+from ._marker_tracker import MarkerTracker
+from ._trajectory_store import TrajectoryStore, TRAJECTORY_DTYPE, draw_trajectory
+from ._aruco_detector import ArucoDetector, ARUCO_DICTS, DETECTOR_PRESETS, create_detector_parameters
+from ._pose_estimator import PoseEstimator
 from ._camera_device import CameraDevice
+from ._device_enumeration import DeviceEnumerator, VideoNode
 from ._camera_params import CameraParams
 from ._uvc_interface import UVCInterface, UVCControl
+from ._control_profile import ControlProfile, PROFILE_DIRECTORY
+from ._exposure_tuner import ExposureTuner, ExposureStatistics, frame_statistics
+from ._simulated_camera import SimulatedCamera
+from ._v4l2_controls import ControlBackend, V4L2DeviceFile, FakeV4L2Device, FakeControl
 from ._tracking_stream import TrackingStream
+from ._tracking_result import TrackingResult
+from ._tracking_sinks import TrackingSink, DisplaySink, RecordingSink, UdpPublishSink
+from ._frame_grabber import FrameGrabber
+from ._frame_bus import FrameBus, FrameBusSource
+from ._replay_source import ReplaySource, PACING_REALTIME, PACING_FAST
+from ._stream_scheduler import StreamScheduler, StreamConfig, StreamResult, allocate_cores
 from ._sharpen import sharpen_image
\ No newline at end of file
@@ -3,10 +3,13 @@
 
 # Based on information from: https://pyframesearch.com/2020/12/21/detecting-aruco-markers-with-opencv-and-python/
 
+import time
 import cv2
 import numpy as np
-from ..utilities import Vec2
+from ..utilities import StageTimer
 from ._marker import Marker
+from ._marker_table import MarkerTable
+from ._marker_tracker import MarkerTracker
 from ._camera_params import CameraParams
 
 
@@ -39,99 +42,307 @@ COLOR_ACCEPTED = (0, 255, 0)
 COLOR_REJECTED = (0, 0, 255)
 
 
+def create_detector_parameters(preset: str = "default") -> cv2.aruco.DetectorParameters:
+    """
+    Creates ArUco detector parameters from a named preset:
+    - "default": OpenCV's default parameters
+    - "fast": fewer adaptive threshold passes, no corner refinement and small markers are ignored
+    - "subpix": default parameters with subpixel corner refinement
+    - "apriltag": default parameters with AprilTag corner refinement (slow but accurate)
+    """
+    parameters = cv2.aruco.DetectorParameters()
+    match preset:
+        case "default":
+            pass
+        case "fast":
+            parameters.adaptiveThreshWinSizeMin = 5
+            parameters.adaptiveThreshWinSizeMax = 25
+            parameters.adaptiveThreshWinSizeStep = 20
+            parameters.minMarkerPerimeterRate = 0.05
+            parameters.cornerRefinementMethod = cv2.aruco.CORNER_REFINE_NONE
+        case "subpix":
+            parameters.cornerRefinementMethod = cv2.aruco.CORNER_REFINE_SUBPIX
+        case "apriltag":
+            parameters.cornerRefinementMethod = cv2.aruco.CORNER_REFINE_APRILTAG
+        case _:
+            raise ValueError(f"Unknown detector parameter preset '{preset}'")
+    return parameters
+
+
+DETECTOR_PRESETS = ("default", "fast", "subpix", "apriltag")
+
+
+# side length in pixels a marker should at least have in the (downscaled) detection image
+# to still be reliably decoded
+MIN_DETECTION_MARKER_SIZE = 30
+
+# corner refinement on the full resolution image after downscaled detection
+SUBPIX_CRITERIA = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.01)
+
+
+def draw_markers(frame: np.ndarray, rows: np.ndarray, camera_params: CameraParams):
+    """
+    Draws the outlines, centers, IDs and poses of markers onto a frame
+
+    @param frame the frame to draw on
+    @param rows marker table rows (see MARKER_DTYPE) of the markers to draw
+    @param camera_params calibration parameters used to project the poses, poses are not drawn if they contain no calibration
+    """
+    color = COLOR_ACCEPTED
+
+    if not len(rows):
+        return
+
+    # draw the poses calculated by the pose estimation (if any)
+    # https://docs.opencv.org/3.4/d5/dae/tutorial_aruco_detection.html
+    if camera_params.matrix is not None:
+        for rvec, tvec in zip(rows["rvec"][rows["pose_valid"]], rows["tvec"][rows["pose_valid"]]):
+            cv2.drawFrameAxes(
+                frame,
+                camera_params.matrix,
+                camera_params.distortion,
+                rvec,
+                tvec,
+                0.1
+            )
+    
+    # draw all outlines in one call
+    cv2.polylines(frame, rows["corners"].astype(np.int32), True, color, 2)
+    centers = rows["center"].astype(np.int32).tolist()
+    label_positions = (rows["corners"][:, 0] - 15).astype(np.int32).tolist()
+    for marker_id, center, label_position in zip(rows["id"].tolist(), centers, label_positions):
+        cv2.circle(frame, center, 4, (0, 255, 0), -1)
+        cv2.putText(frame, str(marker_id),
+            label_position, cv2.FONT_HERSHEY_SIMPLEX,
+            0.5, color, 2)
+
+
 class ArucoDetector:
-    def __init__(self, aruco_dict_type, camera_params: CameraParams):
+    def __init__(
+        self,
+        aruco_dict_type,
+        camera_params: CameraParams,
+        incremental: bool = False,
+        full_sweep_interval: int = 10,
+        roi_padding: float = 0.5,
+        detection_scale: float = 1.0,
+        min_marker_size: int | None = None,
+        detector_parameters: cv2.aruco.DetectorParameters | None = None,
+        track_rejected: bool = True
+    ):
+        """
+        @param aruco_dict_type the ArUco dictionary of the markers to detect
+        @param camera_params calibration parameters of the camera
+        @param incremental True to only search the areas around the markers found in the previous frame
+            instead of the entire frame. The entire frame is still searched every full_sweep_interval frames
+            and whenever a marker gets lost, so new markers are found as well.
+        @param full_sweep_interval in incremental mode, the entire frame is searched every this many frames
+        @param roi_padding in incremental mode, how far the search area around a marker extends beyond
+            the marker's bounding box, relative to the marker's size
+        @param detection_scale factor the image is scaled down by before searching for markers. The corners
+            found in the downscaled image are then refined on the full resolution image. 1 disables downscaling.
+        @param min_marker_size side length in pixels of the smallest marker expected in the full resolution image.
+            If provided, the detection scale is derived from it so that marker is still large enough to be decoded
+            and detection_scale is ignored.
+        @param detector_parameters OpenCV ArUco detector parameters, the defaults if None (see create_detector_parameters())
+        @param track_rejected True to match the rejected marker candidates to markers that were lost recently,
+            so markers stay visible in frames where they could not be decoded (see MarkerTracker)
+        """
         self._aruco_dict = cv2.aruco.getPredefinedDictionary(aruco_dict_type)
-        self._aruco_parameters = cv2.aruco.DetectorParameters()
+        self._aruco_parameters = detector_parameters if detector_parameters is not None else cv2.aruco.DetectorParameters()
         self._aruco_detector = cv2.aruco.ArucoDetector(self._aruco_dict, self._aruco_parameters)
         self._camera_params: CameraParams = camera_params
-        self.markers: dict[int, Marker] = {}
+        self.marker_table = MarkerTable()
+        # corners of the rejected marker candidates of the most recent detection
+        self.rejected_corners = np.empty((0, 4, 2), dtype=np.float32)
+        # matches the rejected candidates to lost markers, None to disable
+        self.tracker: MarkerTracker | None = MarkerTracker() if track_rejected else None
 
-    def process_detected_markers(self, frame, corners: np.ndarray, ids: np.ndarray):
-        # process the results
-        if len(corners) > 0:
-            # flatten the ArUco IDs list
-            ids = ids.flatten()
-            # loop over the detected ArUCo corners
-            marker_corner: np.ndarray
-            for (marker_corner, marker_id) in zip(corners, ids):
-                # extract the marker corners (which are always returned in
-                # top-left, top-right, bottom-right, and bottom-left order)
-                corners = marker_corner.reshape((4, 2))
-                (topLeft, topRight, bottomRight, bottomLeft) = corners
-                # convert each of the (x, y)-coordinate pairs to integers
-                top_left = Vec2(int(topLeft[0]), int(topLeft[1]))
-                top_right = Vec2(int(topRight[0]), int(topRight[1]))
-                bottom_left = Vec2(int(bottomLeft[0]), int(bottomLeft[1]))
-                bottom_right = Vec2(int(bottomRight[0]), int(bottomRight[1]))
-                    
-                if marker_id not in self.markers:
-                    self.markers[marker_id] = Marker(marker_id)
-                
-                current_marker = self.markers[marker_id]
-                current_marker.move((top_left, top_right, bottom_left, bottom_right))
-
-
-    def process_rejected_markers(self, frame, corners):
-        # process the results
+        # multi-resolution detection
+        if min_marker_size is not None:
+            detection_scale = MIN_DETECTION_MARKER_SIZE / min_marker_size
+        if detection_scale <= 0:
+            raise ValueError(f"Detection scale must be positive, not {detection_scale}")
+        self._detection_scale: float = min(detection_scale, 1.0)
+
+        # incremental detection
+        self._incremental = incremental
+        self._full_sweep_interval = full_sweep_interval
+        self._roi_padding = roi_padding
+        self._frames_since_full_sweep: int = 0
+        self.full_sweep_count: int = 0
+        self.roi_detection_count: int = 0
+
+        # timing of the detection stages
+        self.timer = StageTimer()
+
+    @property
+    def markers(self) -> dict[int, Marker]:
+        """
+        Marker objects for all known markers. These are created from the marker table on every access,
+        so use marker_table directly wherever performance matters.
+        """
+        return self.marker_table.markers()
+
+    def process_detected_markers(self, frame, corners: np.ndarray, ids: np.ndarray, timestamp: float):
+        # store the results in the marker table in one go
+        self.marker_table.update(corners, ids, timestamp)
+
+    def process_rejected_markers(self, frame, corners, timestamp: float):
+        # keep the rejected candidates (which are returned in the same (tl, tr, br, bl) order) 
+        # as one array so they can be matched to known markers
         if len(corners) > 0:
-            # loop over the detected ArUCo corners
-            marker_corner: np.ndarray
-            for marker_corner in corners:
-                # extract the marker corners (which ar returned in
-                # top-left, top-right, bottom-right, and bottom-left order)
-                current_corners = marker_corner.reshape((4, 2))
-                #(topLeft, topRight, bottomRight, bottomLeft) = current_corners
-                (topLeft, topRight,  bottomRight, bottomLeft) = current_corners
-                # convert each of the (x, y)-coordinate pairs to integers
-                top_left = Vec2(int(topLeft[0]), int(topLeft[1]))
-                top_right = Vec2(int(topRight[0]), int(topRight[1]))
-                bottom_left = Vec2(int(bottomLeft[0]), int(bottomLeft[1]))
-                bottom_right = Vec2(int(bottomRight[0]), int(bottomRight[1]))
-
-                for _, marker in self.markers.items():
-                    if marker.maybe_move((top_left, top_right, bottom_left, bottom_right)):
-                        break
+            self.rejected_corners = np.asarray(corners, dtype=np.float32).reshape(-1, 4, 2)
+        else:
+            self.rejected_corners = np.empty((0, 4, 2), dtype=np.float32)
+
+        # markers that got lost in this frame may still be among the candidates, just not decodable
+        if self.tracker is not None:
+            self.tracker.match(self.marker_table, self.rejected_corners, timestamp)
     
-    def detect(self, frame: np.ndarray):
-        (corners, ids, rejected) = self._aruco_detector.detectMarkers(frame)
+    @property
+    def detection_scale(self) -> float:
+        return self._detection_scale
 
-        # TODO: remove this and implement pose estimation properly
-        self._last_corners = corners
+    def _detect_markers(self, image: np.ndarray) -> tuple[tuple, np.ndarray | None, tuple]:
+        """
+        Detects markers in an image. If a detection scale is configured, the markers are searched
+        in a downscaled copy of the image and the corners are then refined to subpixel accuracy on the
+        full resolution image.
 
-        self.process_detected_markers(frame, corners, ids)
-        self.process_rejected_markers(frame, rejected)
-    
-    def draw_markers_on_frame(self, frame: np.ndarray):
-        color = COLOR_ACCEPTED
-
-        # https://docs.opencv.org/3.4/d5/dae/tutorial_aruco_detection.html
-        # https://stackoverflow.com/questions/46380040/opencv-aruco-estimateposesinglemarkers-python
-        rvecs, tvecs, _ = cv2.aruco.estimatePoseSingleMarkers(
-            self._last_corners, 
-            0.053, 
-            self._camera_params.matrix, 
-            self._camera_params.distortion
+        @param image full resolution grayscale image
+        @returns (corners, ids, rejected) like cv2.aruco.ArucoDetector.detectMarkers
+        """
+        scale = self._detection_scale
+        if scale >= 1.0:
+            return self._aruco_detector.detectMarkers(image)
+
+        small = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        corners, ids, rejected = self._aruco_detector.detectMarkers(small)
+
+        # map pixel centers of the downscaled image back to the full resolution image
+        def upscale(points: np.ndarray) -> np.ndarray:
+            return (points + 0.5) / scale - 0.5
+
+        rejected = tuple(upscale(r) for r in rejected)
+        if not len(corners):
+            return corners, ids, rejected
+
+        # refine all corners in one go. The search window must cover the error introduced by downscaling.
+        all_corners = upscale(np.concatenate(corners).reshape(-1, 1, 2)).astype(np.float32)
+        window = int(np.ceil(1 / scale)) + 2
+        cv2.cornerSubPix(image, all_corners, (window, window), (-1, -1), SUBPIX_CRITERIA)
+        corners = tuple(all_corners.reshape(-1, 1, 4, 2))
+
+        return corners, ids, rejected
+
+    def _search_areas(self, frame_shape: tuple[int, ...]) -> list[tuple[int, int, int, int]]:
+        """
+        Calculates the areas of the frame that need to be searched to find all markers
+        that were visible in the previous frame again. Overlapping areas are merged.
+
+        @param frame_shape shape of the frame that will be searched
+        @returns list of (x0, y0, x1, y1) rectangles
+        """
+        height, width = frame_shape[:2]
+        previous_corners = self.marker_table.visible_rows["corners"]
+
+        # padded bounding boxes of all markers
+        mins = previous_corners.min(axis=1)
+        maxs = previous_corners.max(axis=1)
+        padding = (maxs - mins).max(axis=1, keepdims=True) * self._roi_padding + 4
+        boxes = np.hstack((mins - padding, maxs + padding))
+        boxes = np.clip(boxes, 0, [width, height, width, height]).astype(np.int32)
+
+        # merge overlapping boxes so no area is searched twice and markers on the border between two areas are not cut
+        areas: list[list[int]] = [list(box) for box in boxes]
+        merged = True
+        while merged:
+            merged = False
+            for i in range(len(areas)):
+                for j in range(i + 1, len(areas)):
+                    a, b = areas[i], areas[j]
+                    if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                        areas[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                        areas.pop(j)
+                        merged = True
+                        break
+                if merged:
+                    break
+
+        return [tuple(area) for area in areas]
+
+    def _detect_in_areas(self, frame: np.ndarray, areas: list[tuple[int, int, int, int]]) -> tuple[tuple, np.ndarray | None, tuple]:
+        """
+        Runs the marker detection only inside the provided areas of the frame and
+        moves the results back to full frame coordinates.
+
+        @returns (corners, ids, rejected) like cv2.aruco.ArucoDetector.detectMarkers
+        """
+        all_corners: list[np.ndarray] = []
+        all_ids: list[np.ndarray] = []
+        all_rejected: list[np.ndarray] = []
+
+        for x0, y0, x1, y1 in areas:
+            corners, ids, rejected = self._detect_markers(frame[y0:y1, x0:x1])
+            offset = np.float32([x0, y0])
+            all_corners.extend(c + offset for c in corners)
+            all_rejected.extend(r + offset for r in rejected)
+            if ids is not None:
+                all_ids.append(ids)
+
+        ids = np.vstack(all_ids) if all_ids else None
+        return tuple(all_corners), ids, tuple(all_rejected)
+
+    def detect(self, frame: np.ndarray, timestamp: float | None = None):
+        """
+        Detects all markers in a frame and updates the marker table
+
+        @param frame grayscale image to detect markers in
+        @param timestamp capture time of the frame, the current time if None
+        """
+        if timestamp is None:
+            timestamp = time.time()
+
+        self.timer.start()
+        # markers only matched by the tracker were not decoded before either, so the search areas can't be expected to find them
+        decoded_ids = self.marker_table.decoded_ids
+        full_sweep = (
+            not self._incremental
+            or not len(decoded_ids)
+            or self._frames_since_full_sweep + 1 >= self._full_sweep_interval
         )
-        if rvecs is not None and tvecs is not None:
-            for rvec, tvec in zip(rvecs, tvecs):
-                cv2.drawFrameAxes(
-                    frame,
-                    self._camera_params.matrix,
-                    self._camera_params.distortion,
-                    rvec,
-                    tvec,
-                    0.1
-                )
-
-        for _, marker in self.markers.items():
-            cv2.line(frame, marker.top_left.icart, marker.top_right.icart, color, 2)
-            cv2.line(frame, marker.top_right.icart, marker.bottom_right.icart, color, 2)
-            cv2.line(frame, marker.bottom_right.icart, marker.bottom_left.icart, color, 2)
-            cv2.line(frame, marker.bottom_left.icart, marker.top_left.icart, color, 2)
-            cv2.circle(frame, marker.center.icart, 4, (0, 255, 0), -1)
-            cv2.putText(frame, str(marker.id),
-                (marker.top_left - Vec2(15, 15)).icart, cv2.FONT_HERSHEY_SIMPLEX,
-                0.5, color, 2)
 
+        if not full_sweep:
+            (corners, ids, rejected) = self._detect_in_areas(frame, self._search_areas(frame.shape))
+            found_ids = np.empty(0, dtype=np.int32) if ids is None else ids.flatten()
+            # if any marker got lost, it may have moved too far or is now outside of the search areas,
+            # so the entire frame needs to be searched
+            if not np.all(np.isin(decoded_ids, found_ids)):
+                full_sweep = True
+            else:
+                self._frames_since_full_sweep += 1
+                self.roi_detection_count += 1
+            self.timer.lap("detect_areas")
+
+        if full_sweep:
+            (corners, ids, rejected) = self._detect_markers(frame)
+            self._frames_since_full_sweep = 0
+            self.full_sweep_count += 1
+            self.timer.lap("detect_full")
 
+        self.process_detected_markers(frame, corners, ids, timestamp)
+        self.timer.lap("process_detected")
+        self.process_rejected_markers(frame, rejected, timestamp)
+        self.timer.lap("process_rejected")
+    
+    def marker_corners(self) -> dict[int, np.ndarray]:
+        """
+        @returns a new dict mapping the ID of every known marker to a 4x2 float32 array of its corners 
+        in (tl, tr, br, bl) order, the same order that OpenCV uses.
+        """
+        rows = self.marker_table.rows
+        return {int(marker_id): corners.copy() for marker_id, corners in zip(rows["id"], rows["corners"])}
+    
+    def draw_markers_on_frame(self, frame: np.ndarray):
+        draw_markers(frame, self.marker_table.rows, self._camera_params)
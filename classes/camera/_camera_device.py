@@ -1,7 +1,7 @@
 
-import subprocess
 import cv2
 from . import cv_types
+from ._device_enumeration import DeviceEnumerator
 
 class CameraDevice:
     """
@@ -11,16 +11,25 @@ class CameraDevice:
     but not for processing video.
     """
 
+    # the cameras found by the last update_available_cameras() call. The cameras are only enumerated
+    # on first use (or explicitly), so importing this module never touches the hardware.
     available_cameras: list["CameraDevice"] = []
+    _enumerated: bool = False
+    # reads the devices from sysfs and the udev database, can be replaced to use a different (e.g. fake) sysfs tree
+    enumerator = DeviceEnumerator()
 
-    def __init__(self, video_index: int, display_name: str, sub_id: int):
+    def __init__(self, video_index: int, display_name: str, sub_id: int, udev_parameters: dict[str, str] | None = None):
+        """
+        @param udev_parameters the udev properties of the device, read from the udev database if None
+        """
         self.video_index: int = video_index
         self.display_name: str = display_name
         self.device_sub_id: int = sub_id
-        self._udev_parameters: dict[str, str] = {}
+        self._udev_parameters: dict[str, str] = dict(udev_parameters) if udev_parameters is not None else {}
 
         # read udev parameters to get serial number and other info
-        self._get_udev_parameters()
+        if udev_parameters is None:
+            self._get_udev_parameters()
         self._abc = "hsdf"
     
     def __repr__(self) -> str:
@@ -51,7 +60,7 @@ class CameraDevice:
         to create a hopefully rather unique identifier for a single camera device,
         regardless of video index
         """
-        return self.vendor_id + "_" + self.model_id + "_" + self.serial_number + "_" + self.device_sub_id
+        return self.vendor_id + "_" + self.model_id + "_" + self.serial_number + "_" + str(self.device_sub_id)
 
     def _get_udev_parameters(self):
         """
@@ -61,32 +70,10 @@ class CameraDevice:
         Info: identify cameras by serial number:
         https://superuser.com/questions/902012/how-to-identify-usb-webcam-by-serial-number-from-the-linux-command-line
         """
-
-        # run udevadmin to get some info on the device
-        process = subprocess.Popen(
-            ["udevadm", "info", "--query=all", "/dev/video" + str(self.video_index), "|", "grep", "'VENDOR_ID\|MODEL_ID\|SERIAL_SHORT'"],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT
-        )
-        stdout, _ = process.communicate()
-        
-        # go through all of the lines to load the parameters
-        output_lines = stdout.decode('UTF-8').splitlines()
-
-        # check for error output
-        if len(output_lines) == 1 and output_lines[0].startswith("Unknown"):
+        node = self.enumerator.video_node(self.video_index)
+        if node is None:
             raise IndexError(f"Could not find camera with video index {self.video_index}")
-        
-        # extract all parameters
-        for output_line in output_lines:
-            # only the ones starting with "E: " prefix are interesting
-            LINE_PREFIX = "E: "
-            if not output_line.startswith(LINE_PREFIX):
-                continue
-            
-            parameter = output_line.removeprefix(LINE_PREFIX)
-            param_name, param_value = parameter.split("=", 1)
-            self._udev_parameters[param_name] = param_value
+        self._udev_parameters.update(node.udev_parameters)
 
     def open(self) -> cv_types.VideoCapture:
         """
@@ -95,82 +82,38 @@ class CameraDevice:
         return cv2.VideoCapture(self.video_index)
     
     @classmethod
-    def _supports_video_stream(cls, camera_device: str) -> bool:
-        """
-        @param camera_device: camera device path such as /dev/video0
-        @retval True if a provided camera device supports any video stream formats
-        @retval False if the device is not found or doesn't support any video stream format (i.e. is not a usable video input device)
-        """
-        # run v4l2-ctl to get the info
-        process = subprocess.Popen(
-            ["v4l2-ctl", "--list-formats", "--device=" + camera_device],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT
-        )
-        stdout, _ = process.communicate()
-        output_text = stdout.decode('UTF-8')
-
-        # video formats are prefixed with a menu id in square brackets, so if there are any square brackets
-        # there must be some supported video formats. If the provided device name is invalid, 
-        # there are no brackets either
-        if "[" in output_text and "]" in output_text:
-            return True
-        return False
-
-    @classmethod
-    def update_available_cameras(cls) -> list["CameraDevice"]:
+    def update_available_cameras(cls, force: bool = False) -> list["CameraDevice"]:
         """
         updates the internally stored dict of available cameras 
         and their serial numbers and returns it.
+
+        @param force True to read all devices again, even if the devices seem to be unchanged
         """
+        nodes = cls.enumerator.video_nodes(force)
+        cls._enumerated = True
 
         # clear old available devices
         cls.available_cameras.clear()
 
-        # run v4l2-ctl to get list of available devices
-        process = subprocess.Popen(
-            ["v4l2-ctl", "--list-devices"],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT
-        )
-        stdout, _ = process.communicate()
-        
-        # go through all of the lines individually
-        output_lines: list[str] = stdout.decode('UTF-8').splitlines()
-        # variable that is set whenever a name line is encountered
-        current_name: str = None
         # counter for sub-devices of a single physical device. This information
         # is used to identify multiple logical camera devices that belong to the same physical device
-        device_sub_id: int = 0
-
-        output_line: str
-        for output_line in output_lines:
-
-            # lines that start with some name indicate a new physical device. store name and reset sub id
-            if not output_line.startswith(" ") and ":" in output_line:
-                current_name = output_line.split(":")[0]
-                device_sub_id = 0
-                continue
-
-            # remove leading spaces
-            output_line = output_line.strip()
-
-            # ignore media devices and others that are not /dev/video*
-            if not output_line.startswith("/dev/video"):
-                continue
+        device_sub_ids: dict[str, int] = {}
 
+        for node in nodes:
             # ignore any alternate function video devices that don't support video input streams
-            if not cls._supports_video_stream(output_line):
+            if not node.supports_capture:
                 continue
-            
-            # create camera device instance and save it
+
+            device_sub_id = device_sub_ids.get(node.device_path, 0)
+            # the card name of UVC devices is "<name>: <name>", like the device names v4l2-ctl lists
             cls.available_cameras.append(CameraDevice(
-                int(output_line.removeprefix("/dev/video")),
-                current_name,
-                device_sub_id
+                node.video_index,
+                node.name.split(":")[0],
+                device_sub_id,
+                node.udev_parameters
             ))
             # increment sub id for next device
-            device_sub_id += 1
+            device_sub_ids[node.device_path] = device_sub_id + 1
         
         return cls.available_cameras
     
@@ -181,9 +124,10 @@ class CameraDevice:
         Raises RuntimeError if not found.
 
         Set update to true to update available cameras before searching.
+        They are always updated on the first search.
         """
 
-        if update:
+        if update or not cls._enumerated:
             cls.update_available_cameras()
 
         for cam in cls.available_cameras:
@@ -199,9 +143,10 @@ class CameraDevice:
         Raises RuntimeError if not found.
 
         Set update to true to update available cameras before searching.
+        They are always updated on the first search.
         """
 
-        if update:
+        if update or not cls._enumerated:
             cls.update_available_cameras()
 
         for cam in cls.available_cameras:
@@ -217,9 +162,10 @@ class CameraDevice:
         Raises RuntimeError if not found.
 
         Set update to true to update available cameras before searching.
+        They are always updated on the first search.
         """
 
-        if update:
+        if update or not cls._enumerated:
             cls.update_available_cameras()
 
         for cam in cls.available_cameras:
@@ -229,12 +175,8 @@ class CameraDevice:
         raise RuntimeError(f"No camera with video index {video_index} available.")
 
 
-# update global list of available devices when loaded
-CameraDevice.update_available_cameras()
-
-
 # test code
 if __name__ == "__main__":
 
-    for cam in CameraDevice.available_cameras:
+    for cam in CameraDevice.update_available_cameras():
         print(cam)
\ No newline at end of file
@@ -1,32 +1,168 @@
+"""
+Camera calibration parameters and the data derived from them.
 
-from dataclasses import dataclass
-import numpy as np
+Calibrations are saved as .npz files (loaded without pickle) that also record the resolution the camera was
+calibrated at and the reprojection error of the calibration. The older pickle files can still be loaded.
+
+Undistortion maps of a calibration are cached as .npy files next to the calibration file, keyed by resolution
+and a hash of the calibration, so they are memory mapped instead of computed again on the next start.
+"""
+
+from dataclasses import dataclass, field
+import hashlib
+import os
 import pickle
+import threading
+import cv2
+import numpy as np
+
+# version 1: pickled dict, version 2: npz
+LEGACY_FORMAT_VERSION = 1
+FORMAT_VERSION = 2
 
-FORMAT_VERSION = 1
 
 @dataclass
 class CameraParams:
     matrix: np.ndarray = None
     distortion: np.ndarray = None
+    # (width, height) of the frames the camera was calibrated with, None if unknown
+    resolution: tuple[int, int] | None = None
+    # RMS reprojection error of the calibration in pixels, None if unknown
+    reprojection_error: float | None = None
+    # directory the derived data (undistortion maps) is cached in, None to only cache it in memory
+    cache_directory: str | None = field(default=None, compare=False, repr=False)
+    # undistortion maps by resolution
+    _undistort_maps: dict[tuple[int, int], np.ndarray] = field(default_factory=dict, init=False, compare=False, repr=False)
+
+    def __getstate__(self) -> dict:
+        # the maps are loaded from the cache again instead of being sent to other processes
+        state = self.__dict__.copy()
+        state["_undistort_maps"] = {}
+        return state
 
     def load(self, file: str) -> "CameraParams":
         """
-        loads parameters from a 
+        loads parameters from a .npz file, or a pickle file of the old format
         """
-        with open(file, "rb") as f:
-            data = pickle.load(f)
-            if data["version"] != FORMAT_VERSION:
-                raise ValueError("Cannot load CameraParams from file " + file + ": invalid structure or format version")
-            self.matrix = data["matrix"]
-            self.distortion = data["distortion"]
+        if file.endswith(".npz"):
+            # allow_pickle=False makes sure loading a file never executes any code
+            with np.load(file, allow_pickle=False) as data:
+                if "version" not in data or int(data["version"]) != FORMAT_VERSION:
+                    raise ValueError("Cannot load CameraParams from file " + file + ": invalid structure or format version")
+                self.matrix = data["matrix"]
+                self.distortion = data["distortion"]
+                self.resolution = tuple(int(v) for v in data["resolution"]) if data["resolution"].size == 2 else None
+                self.reprojection_error = float(data["reprojection_error"]) if np.isfinite(data["reprojection_error"]) else None
+        else:
+            with open(file, "rb") as f:
+                data = pickle.load(f)
+                if data["version"] != LEGACY_FORMAT_VERSION:
+                    raise ValueError("Cannot load CameraParams from file " + file + ": invalid structure or format version")
+                self.matrix = data["matrix"]
+                self.distortion = data["distortion"]
+                self.resolution = None
+                self.reprojection_error = None
+        self.cache_directory = os.path.dirname(os.path.abspath(file))
+        self._undistort_maps.clear()
         return self
-    
+
     def save(self, file: str) -> "CameraParams":
-        with open(file, "wb") as f:
-            pickle.dump({
-                "version": FORMAT_VERSION,
-                "matrix": self.matrix, 
-                "distortion": self.distortion
-            }, f)
+        """
+        saves the parameters to a .npz file
+        """
+        if not file.endswith(".npz"):
+            raise ValueError(f"CameraParams can only be saved as .npz, not '{file}'")
+        np.savez(
+            file,
+            version=np.int32(FORMAT_VERSION),
+            matrix=self.matrix,
+            distortion=self.distortion,
+            resolution=np.array(self.resolution if self.resolution is not None else [], dtype=np.int32),
+            reprojection_error=np.float64(self.reprojection_error if self.reprojection_error is not None else np.nan)
+        )
+        self.cache_directory = os.path.dirname(os.path.abspath(file))
         return self
+
+    @property
+    def content_hash(self) -> str:
+        """
+        short hash of the calibration, which changes whenever the matrix, distortion or resolution do
+        """
+        digest = hashlib.sha1()
+        for values in (self.matrix, self.distortion, self.resolution):
+            if values is not None:
+                digest.update(np.asarray(values, dtype=np.float64).tobytes())
+        return digest.hexdigest()[:16]
+
+    def scaled(self, resolution: tuple[int, int]) -> "CameraParams":
+        """
+        Scales the intrinsics to a different capture resolution. The distortion coefficients
+        apply to normalized coordinates, so they stay the same.
+
+        @param resolution (width, height) of the frames the parameters are used for
+        @returns parameters for the resolution, self if they already fit or the calibration resolution is unknown
+        """
+        resolution = (int(resolution[0]), int(resolution[1]))
+        if self.matrix is None or self.resolution is None or tuple(self.resolution) == resolution:
+            return self
+
+        scale_x = resolution[0] / self.resolution[0]
+        scale_y = resolution[1] / self.resolution[1]
+        if not np.isclose(scale_x, scale_y, rtol=0.01):
+            print(f"Warning: scaling a calibration of {self.resolution[0]}x{self.resolution[1]} to {resolution[0]}x{resolution[1]} "
+                  "changes the aspect ratio, the camera may crop the image in this mode")
+        matrix = np.array(self.matrix, dtype=np.float64)
+        matrix[0, :] *= scale_x
+        matrix[1, :] *= scale_y
+        return CameraParams(matrix, self.distortion, resolution, self.reprojection_error, self.cache_directory)
+
+    def _undistort_map_file(self, resolution: tuple[int, int]) -> str | None:
+        if self.cache_directory is None:
+            return None
+        return os.path.join(self.cache_directory, f"undistort_{resolution[0]}x{resolution[1]}_{self.content_hash}.npy")
+
+    def undistort_map(self, resolution: tuple[int, int] | None = None) -> np.ndarray:
+        """
+        Map of the raw frame position of every pixel of the undistorted frame, which has the same camera matrix
+        (usable with cv2.remap). The map is loaded memory mapped from the cache directory if it was computed before,
+        otherwise it is computed and written there.
+
+        @param resolution (width, height) of the frames, the calibration resolution if None
+        @returns HxWx2 float32 map of (x, y) positions
+        """
+        if self.matrix is None or self.distortion is None:
+            raise ValueError("Undistortion maps require a calibration")
+        if resolution is None:
+            if self.resolution is None:
+                raise ValueError("The calibration resolution is unknown, the resolution of the map must be specified")
+            resolution = self.resolution
+        resolution = (int(resolution[0]), int(resolution[1]))
+        if resolution in self._undistort_maps:
+            return self._undistort_maps[resolution]
+
+        params = self.scaled(resolution)
+        file = params._undistort_map_file(resolution)
+        undistort_map = None
+        if file is not None and os.path.exists(file):
+            try:
+                undistort_map = np.load(file, mmap_mode="r", allow_pickle=False)
+            except (OSError, ValueError):
+                undistort_map = None
+            if undistort_map is not None and (undistort_map.shape != (resolution[1], resolution[0], 2) or undistort_map.dtype != np.float32):
+                undistort_map = None
+        if undistort_map is None:
+            undistort_map, _ = cv2.initUndistortRectifyMap(
+                params.matrix, params.distortion, None, params.matrix, resolution, cv2.CV_32FC2
+            )
+            if file is not None:
+                # written to a temporary file first, so other processes never load a partially written map.
+                # the thread is part of the name because thread workers share a process.
+                temporary_file = f"{file}.{os.getpid()}.{threading.get_ident()}.tmp"
+                try:
+                    with open(temporary_file, "wb") as f:
+                        np.save(f, undistort_map)
+                    os.replace(temporary_file, file)
+                except OSError as e:
+                    print(f"Warning: could not cache undistortion map in '{file}': {e}")
+        self._undistort_maps[resolution] = undistort_map
+        return undistort_map
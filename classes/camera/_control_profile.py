@@ -0,0 +1,99 @@
+"""
+Named sets of UVC control values (e.g. fixed exposure, white balance and focus for tracking) that are
+saved per camera, so the same settings can be reapplied at every start instead of setting them by hand.
+
+Profiles are stored as JSON in <directory>/<camera identifier>/<profile name>.json, which keeps them
+editable and tied to a single physical camera regardless of its video index.
+"""
+
+import json
+import os
+from dataclasses import dataclass, field
+
+FORMAT_VERSION = 1
+PROFILE_DIRECTORY = "profiles"
+
+# Auto mode controls and the manual controls they govern. While an auto mode is active, the driver
+# ignores (or rejects) writes of the manual value, so the auto modes have to be written first.
+# Both the current and the older kernel control names are listed.
+AUTO_CONTROLS: dict[str, tuple[str, ...]] = {
+    "auto_exposure": ("exposure_time_absolute", "exposure_absolute", "exposure_dynamic_framerate", "iris_absolute", "iris_relative"),
+    "exposure_auto": ("exposure_time_absolute", "exposure_absolute", "exposure_auto_priority", "iris_absolute", "iris_relative"),
+    "white_balance_automatic": ("white_balance_temperature", "red_balance", "blue_balance"),
+    "white_balance_temperature_auto": ("white_balance_temperature", "red_balance", "blue_balance"),
+    "focus_automatic_continuous": ("focus_absolute", "focus_relative"),
+    "focus_auto": ("focus_absolute", "focus_relative"),
+    "gain_automatic": ("gain",),
+    "hue_auto": ("hue",),
+}
+
+
+def ordered_controls(values: dict[str, int | str]) -> dict[str, int | str]:
+    """
+    @returns the control values with all auto mode controls first, otherwise in the original order
+    """
+    auto = {name: value for name, value in values.items() if name in AUTO_CONTROLS}
+    manual = {name: value for name, value in values.items() if name not in AUTO_CONTROLS}
+    return auto | manual
+
+
+def governed_controls(auto_control: str) -> tuple[str, ...]:
+    """
+    @returns the manual controls whose value depends on an auto mode control
+    """
+    return AUTO_CONTROLS.get(auto_control, ())
+
+
+@dataclass
+class ControlProfile:
+    name: str = ""
+    # control values (or menu option names) by control name
+    values: dict[str, int | str] = field(default_factory=dict)
+
+    @staticmethod
+    def file_for(identifier: str, name: str, directory: str = PROFILE_DIRECTORY) -> str:
+        """
+        @param identifier the identifier of the camera (see CameraDevice.identifier)
+        @returns the path of a camera's profile file
+        """
+        return os.path.join(directory, identifier, name + ".json")
+
+    def load(self, file: str) -> "ControlProfile":
+        with open(file, "r") as f:
+            data = json.load(f)
+        if data.get("version") != FORMAT_VERSION:
+            raise ValueError("Cannot load ControlProfile from file " + file + ": invalid structure or format version")
+        self.name = data["name"]
+        self.values = dict(data["controls"])
+        return self
+
+    def save(self, file: str) -> "ControlProfile":
+        directory = os.path.dirname(file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(file, "w") as f:
+            json.dump({
+                "version": FORMAT_VERSION,
+                "name": self.name,
+                "controls": ordered_controls(self.values)
+            }, f, indent=4)
+        return self
+
+    @classmethod
+    def for_camera(cls, identifier: str, name: str, directory: str = PROFILE_DIRECTORY) -> "ControlProfile":
+        """
+        Loads a named profile of a camera
+
+        @param identifier the identifier of the camera (see CameraDevice.identifier)
+        """
+        return cls().load(cls.file_for(identifier, name, directory))
+
+    def save_for_camera(self, identifier: str, directory: str = PROFILE_DIRECTORY) -> str:
+        """
+        Saves the profile under its name for a camera
+
+        @returns the path of the written file
+        """
+        file = self.file_for(identifier, self.name, directory)
+        self.save(file)
+        return file
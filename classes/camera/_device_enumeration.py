@@ -0,0 +1,207 @@
+"""
+Finds the available V4L2 video devices by reading sysfs and the udev runtime database directly,
+instead of running v4l2-ctl and udevadm for every device.
+
+Info on the sysfs attributes of video devices:
+https://www.kernel.org/doc/Documentation/ABI/stable/sysfs-class-video4linux
+"""
+
+import os
+import fcntl
+import struct
+from dataclasses import dataclass, field
+from typing import Callable
+
+
+# VIDIOC_QUERYCAP = _IOR('V', 0, struct v4l2_capability), the struct is 104 bytes large
+VIDIOC_QUERYCAP = 0x80685600
+# driver[16], card[32], bus_info[32], version, capabilities, device_caps, reserved[3]
+V4L2_CAPABILITY_FORMAT = "16s32s32sIII3I"
+V4L2_CAP_VIDEO_CAPTURE = 0x00000001
+V4L2_CAP_VIDEO_CAPTURE_MPLANE = 0x00001000
+V4L2_CAP_DEVICE_CAPS = 0x80000000
+
+
+@dataclass
+class VideoNode:
+    """
+    A /dev/video* node as found in sysfs
+    """
+    video_index: int
+    # name of the device (the card name reported by the driver)
+    name: str
+    # sysfs path of the physical device the node belongs to. Multiple nodes can belong to the same device.
+    device_path: str
+    # whether the node can capture video. Devices often have additional nodes for metadata.
+    supports_capture: bool
+    # udev properties such as ID_SERIAL_SHORT, ID_VENDOR_ID and ID_MODEL_ID
+    udev_parameters: dict[str, str] = field(default_factory=dict)
+
+
+def query_capabilities(device_file: str) -> int | None:
+    """
+    Queries the capabilities of a video device with a single VIDIOC_QUERYCAP ioctl
+
+    @param device_file device path such as /dev/video0
+    @returns the V4L2_CAP_* flags of the node, None if the device could not be queried
+    """
+    try:
+        fd = os.open(device_file, os.O_RDWR | os.O_NONBLOCK)
+    except OSError:
+        return None
+    try:
+        buffer = bytearray(struct.calcsize(V4L2_CAPABILITY_FORMAT))
+        fcntl.ioctl(fd, VIDIOC_QUERYCAP, buffer)
+    except OSError:
+        return None
+    finally:
+        os.close(fd)
+
+    _, _, _, _, capabilities, device_caps, *_ = struct.unpack(V4L2_CAPABILITY_FORMAT, buffer)
+    # the capabilities field describes the entire physical device, device_caps only this node
+    if capabilities & V4L2_CAP_DEVICE_CAPS:
+        return device_caps
+    return capabilities
+
+
+class DeviceEnumerator:
+    """
+    Enumerates video devices from sysfs and the udev database. The result is cached and only
+    enumerated again if the set of video nodes or their udev database entries changed.
+
+    All roots are configurable so the enumeration can run against a fake directory tree.
+    """
+
+    def __init__(
+        self,
+        sysfs_root: str = "/sys",
+        udev_data_root: str = "/run/udev/data",
+        dev_root: str = "/dev",
+        capability_query: Callable[[str], int | None] = query_capabilities
+    ):
+        """
+        @param sysfs_root where sysfs is mounted
+        @param udev_data_root directory of the udev runtime database
+        @param dev_root directory containing the device files
+        @param capability_query function returning the V4L2_CAP_* flags of a device file (see query_capabilities())
+        """
+        self.sysfs_root = sysfs_root
+        self.udev_data_root = udev_data_root
+        self.dev_root = dev_root
+        self._capability_query = capability_query
+        self._cache_key: tuple | None = None
+        self._cached_nodes: list[VideoNode] = []
+
+    @property
+    def _class_dir(self) -> str:
+        return os.path.join(self.sysfs_root, "class", "video4linux")
+
+    @staticmethod
+    def _read_attribute(path: str) -> str | None:
+        try:
+            with open(path, "r") as f:
+                return f.read().strip()
+        except OSError:
+            return None
+
+    def _node_names(self) -> list[str]:
+        try:
+            names = os.listdir(self._class_dir)
+        except OSError:
+            return []
+        return sorted((n for n in names if n.startswith("video") and n[5:].isdigit()), key=lambda n: int(n[5:]))
+
+    def _udev_data_file(self, node_name: str) -> str | None:
+        # udev database entries of character devices are named after the device numbers, like c81:0
+        dev_numbers = self._read_attribute(os.path.join(self._class_dir, node_name, "dev"))
+        if dev_numbers is None:
+            return None
+        return os.path.join(self.udev_data_root, "c" + dev_numbers)
+
+    def _cache_key_for(self, node_names: list[str]) -> tuple:
+        """
+        A cheap fingerprint of the current devices: the node names and the modification times of their
+        udev database entries, which are rewritten whenever a device is (re)added.
+        """
+        key = []
+        for node_name in node_names:
+            data_file = self._udev_data_file(node_name)
+            try:
+                modified = os.stat(data_file).st_mtime_ns if data_file is not None else None
+            except OSError:
+                modified = None
+            key.append((node_name, data_file, modified))
+        return tuple(key)
+
+    def _read_udev_parameters(self, node_name: str, device_path: str) -> dict[str, str]:
+        """
+        Reads the udev properties ("E:" lines) of a node from the udev database. If there is no database,
+        the most important USB properties are read from sysfs instead.
+        """
+        parameters: dict[str, str] = {}
+        data_file = self._udev_data_file(node_name)
+        if data_file is not None:
+            try:
+                with open(data_file, "r") as f:
+                    for line in f:
+                        if line.startswith("E:") and "=" in line:
+                            name, value = line[2:].strip().split("=", 1)
+                            parameters[name] = value
+            except OSError:
+                pass
+
+        if "ID_VENDOR_ID" not in parameters:
+            # the USB device directory is a parent of the interface directory the node belongs to
+            path = device_path
+            while path.startswith(self.sysfs_root) and path != self.sysfs_root:
+                vendor_id = self._read_attribute(os.path.join(path, "idVendor"))
+                if vendor_id is not None:
+                    parameters["ID_VENDOR_ID"] = vendor_id
+                    model_id = self._read_attribute(os.path.join(path, "idProduct"))
+                    serial = self._read_attribute(os.path.join(path, "serial"))
+                    if model_id is not None:
+                        parameters["ID_MODEL_ID"] = model_id
+                    if serial is not None:
+                        parameters["ID_SERIAL_SHORT"] = serial
+                    break
+                path = os.path.dirname(path)
+        return parameters
+
+    def _read_node(self, node_name: str) -> VideoNode:
+        node_dir = os.path.join(self._class_dir, node_name)
+        device_path = os.path.realpath(os.path.join(node_dir, "device"))
+        capabilities = self._capability_query(os.path.join(self.dev_root, node_name))
+        return VideoNode(
+            video_index=int(node_name[5:]),
+            name=self._read_attribute(os.path.join(node_dir, "name")) or node_name,
+            device_path=device_path,
+            supports_capture=capabilities is not None and bool(capabilities & (V4L2_CAP_VIDEO_CAPTURE | V4L2_CAP_VIDEO_CAPTURE_MPLANE)),
+            udev_parameters=self._read_udev_parameters(node_name, device_path)
+        )
+
+    def video_nodes(self, force: bool = False) -> list[VideoNode]:
+        """
+        @param force True to enumerate again even if the devices didn't change
+        @returns all video nodes sorted by video index
+        """
+        node_names = self._node_names()
+        cache_key = self._cache_key_for(node_names)
+        if force or cache_key != self._cache_key:
+            self._cached_nodes = [self._read_node(node_name) for node_name in node_names]
+            self._cache_key = cache_key
+        return list(self._cached_nodes)
+
+    def video_node(self, video_index: int) -> VideoNode | None:
+        """
+        @returns the node with a video index, None if there is none
+        """
+        for node in self.video_nodes():
+            if node.video_index == video_index:
+                return node
+        return None
+
+    def invalidate(self):
+        """
+        Forces the next call to video_nodes() to enumerate again
+        """
+        self._cache_key = None
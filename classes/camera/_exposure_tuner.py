@@ -0,0 +1,342 @@
+"""
+Tunes the exposure of a camera for marker detection instead of pretty pictures.
+
+The camera's own auto exposure picks long exposure times, which blur moving markers. The tuner switches it off
+and searches for the shortest exposure time (brightening with gain instead) at which the markers are still decoded
+about as reliably as at the longest one, using the statistics of the live frames:
+- the number of decoded markers, relative to the most seen during the search (the recall)
+- the number of rejected marker candidates, to tell markers that became unreadable from markers that left the view
+- the sharpness around the markers and candidates, to notice growing motion blur before markers get lost
+- the histogram clipping and brightness, to keep the marker contrast
+"""
+
+from dataclasses import dataclass
+import cv2
+import numpy as np
+from ._uvc_interface import UVCInterface, UVCControl
+
+
+# gray values counted as clipped
+CLIP_LOW = 5
+CLIP_HIGH = 250
+# maximum number of markers the sharpness is measured around per frame
+SHARPNESS_MARKERS = 8
+
+# control names of the current and older kernels
+AUTO_EXPOSURE_CONTROLS = ("auto_exposure", "exposure_auto")
+EXPOSURE_CONTROLS = ("exposure_time_absolute", "exposure_absolute")
+DYNAMIC_FRAMERATE_CONTROLS = ("exposure_dynamic_framerate", "exposure_auto_priority")
+GAIN_CONTROLS = ("gain",)
+
+
+@dataclass
+class ExposureStatistics:
+    """
+    Detection and image statistics, averaged over the frames of a measurement window
+    """
+    # decoded markers per frame
+    markers: float
+    # rejected marker candidates per frame
+    rejected: float
+    # edge sharpness around the markers and candidates, None if there were none (see frame_statistics())
+    sharpness: float | None
+    # mean gray value
+    brightness: float
+    # fractions of dark and bright clipped pixels
+    clipped_low: float
+    clipped_high: float
+    frames: int
+
+
+def frame_statistics(frame: np.ndarray, corners: np.ndarray) -> tuple[float | None, float, float, float]:
+    """
+    Measures the image statistics of a grayscale frame
+
+    @param corners Nx4x2 corners of the markers (or marker candidates) detected in the frame
+    @returns (sharpness, brightness, clipped_low, clipped_high). The sharpness is the ratio of the Laplacian's
+        and the image's standard deviation around the markers, so it does not depend on the brightness.
+    """
+    # every 4th pixel is plenty for the histogram
+    sample = np.ascontiguousarray(frame[::4, ::4])
+    histogram = cv2.calcHist([sample], [0], None, [256], [0, 256]).ravel() / sample.size
+    brightness = float(np.dot(histogram, np.arange(256)))
+    clipped_low = float(histogram[:CLIP_LOW + 1].sum())
+    clipped_high = float(histogram[CLIP_HIGH:].sum())
+
+    sharpness_values = []
+    for marker_corners in corners[:SHARPNESS_MARKERS]:
+        x0, y0 = np.maximum(np.floor(marker_corners.min(axis=0)).astype(int), 0)
+        x1, y1 = np.ceil(marker_corners.max(axis=0)).astype(int) + 1
+        area = frame[y0:y1, x0:x1]
+        if area.shape[0] < 4 or area.shape[1] < 4:
+            continue
+        contrast = area.std()
+        if contrast > 1.0:
+            sharpness_values.append(cv2.Laplacian(area, cv2.CV_32F).std() / contrast)
+    sharpness = float(np.mean(sharpness_values)) if sharpness_values else None
+    return sharpness, brightness, clipped_low, clipped_high
+
+
+def _find_control(interface: UVCInterface, names: tuple[str, ...]) -> UVCControl | None:
+    controls = interface.controls
+    for name in names:
+        if name in controls:
+            return controls[name]
+    return None
+
+
+class ExposureTuner:
+    """
+    Closed-loop exposure time and gain control from detection statistics. Frames are passed to observe()
+    (TrackingStream does this if it is given a tuner), and every window of frames the tuner decides on new
+    control values, which are written right away. Once the shortest good exposure time is found, the tuner
+    is converged and only keeps watching, searching again if the recall drops or the markers get blurry.
+    """
+
+    def __init__(
+        self,
+        interface: UVCInterface,
+        target_recall: float = 0.9,
+        window: int = 15,
+        settle_frames: int = 3,
+        exposure_step: float = 0.8,
+        brightness_range: tuple[float, float] = (60.0, 190.0),
+        max_clipping: float = 0.02,
+        min_exposure: int | None = None,
+        max_exposure: int | None = None,
+        blur_tolerance: float = 0.75
+    ):
+        """
+        @param interface the controls of the camera to tune. The controls are loaded if they aren't yet.
+        @param target_recall fraction of the most markers decoded during the search that must still be decoded
+            at the chosen exposure time
+        @param window number of frames the statistics are averaged over for every decision
+        @param settle_frames number of frames ignored after changing controls, until the camera applied them
+        @param exposure_step factor the exposure time is multiplied with per search step (less than 1)
+        @param brightness_range the mean gray values the frames are kept within
+        @param max_clipping maximum fraction of clipped dark or bright pixels
+        @param min_exposure shortest exposure time to use, the control minimum if None
+        @param max_exposure longest exposure time to use, the control maximum if None
+        @param blur_tolerance the search starts again if the marker sharpness drops below this fraction
+            of the sharpness at the chosen exposure time
+        """
+        if not 0 < exposure_step < 1:
+            raise ValueError(f"Exposure step must be between 0 and 1, not {exposure_step}")
+
+        self._interface = interface
+        self.target_recall = target_recall
+        self.window = window
+        self.settle_frames = settle_frames
+        self.exposure_step = exposure_step
+        self.brightness_range = brightness_range
+        self.max_clipping = max_clipping
+        self.blur_tolerance = blur_tolerance
+        self._min_exposure = min_exposure
+        self._max_exposure = max_exposure
+
+        self._started = False
+        self._exposure_control: UVCControl | None = None
+        self._gain_control: UVCControl | None = None
+        self.exposure: int = 0
+        self.gain: int = 0
+
+        # per frame (markers, rejected, sharpness, brightness, clipped_low, clipped_high) of the current window
+        self._samples: list[tuple] = []
+        self._frames_to_skip = 0
+
+        self.converged = False
+        # most markers per frame decoded during the search
+        self._best_markers = 0.0
+        # the shortest (exposure, gain) found good so far and the marker sharpness there
+        self._good_settings: tuple[int, int] | None = None
+        self._good_sharpness: float | None = None
+        # the statistics of the most recent window
+        self.statistics: ExposureStatistics | None = None
+        # every decision as (exposure, gain, statistics, action)
+        self.history: list[tuple[int, int, ExposureStatistics, str]] = []
+
+    def start(self):
+        """
+        Switches the camera to manual exposure, starting from the exposure time the auto exposure picked.
+        This is done automatically by the first observe().
+        """
+        interface = self._interface
+        if not interface.controls:
+            interface.load_controls()
+        self._exposure_control = _find_control(interface, EXPOSURE_CONTROLS)
+        if self._exposure_control is None:
+            raise RuntimeError("Camera has no exposure time control to tune")
+        self._gain_control = _find_control(interface, GAIN_CONTROLS)
+        auto_control = _find_control(interface, AUTO_EXPOSURE_CONTROLS)
+        dynamic_framerate_control = _find_control(interface, DYNAMIC_FRAMERATE_CONTROLS)
+
+        # the current exposure time is the one the auto exposure chose
+        interface.read_controls([self._exposure_control.name])
+        values = {}
+        if auto_control is not None:
+            manual_options = [value for value, option in auto_control.menu_val_to_name.items() if "manual" in option.lower()]
+            values[auto_control.name] = manual_options[0] if manual_options else 1
+        if dynamic_framerate_control is not None:
+            # the frame rate must not drop with longer exposure times
+            values[dynamic_framerate_control.name] = 0
+        values[self._exposure_control.name] = self._clamped_exposure(self._exposure_control.value)
+        interface.apply_controls(values)
+
+        self.exposure = self._exposure_control.value
+        self.gain = self._gain_control.value if self._gain_control is not None else 0
+        self._started = True
+        self._frames_to_skip = self.settle_frames
+
+    @property
+    def min_exposure(self) -> int:
+        if self._min_exposure is not None:
+            return max(self._min_exposure, self._exposure_control.min)
+        return self._exposure_control.min
+
+    @property
+    def max_exposure(self) -> int:
+        if self._max_exposure is not None:
+            return min(self._max_exposure, self._exposure_control.max)
+        return self._exposure_control.max
+
+    def _clamped_exposure(self, exposure: int) -> int:
+        return int(min(max(exposure, self.min_exposure), self.max_exposure))
+
+    def _shorter(self, exposure: int) -> int:
+        return self._clamped_exposure(min(int(exposure * self.exposure_step), exposure - 1))
+
+    def _longer(self, exposure: int) -> int:
+        return self._clamped_exposure(max(int(round(exposure / self.exposure_step)), exposure + 1))
+
+    def _gain_step(self) -> int:
+        control = self._gain_control
+        return max(control.step or 1, (control.max - control.min) // 16)
+
+    def _can_raise_gain(self) -> bool:
+        return self._gain_control is not None and self.gain < self._gain_control.max
+
+    def _can_lower_gain(self) -> bool:
+        return self._gain_control is not None and self.gain > self._gain_control.min
+
+    def observe(self, frame: np.ndarray, markers: np.ndarray, rejected_corners: np.ndarray) -> bool:
+        """
+        Adds the statistics of a frame
+
+        @param frame grayscale frame
+        @param markers rows of the markers visible in the frame (see MARKER_DTYPE). Rows the tracker matched
+            from rejected candidates are not counted as decoded.
+        @param rejected_corners Nx4x2 corners of the rejected marker candidates in the frame
+        @returns whether the controls were changed
+        """
+        if not self._started:
+            self.start()
+            return True
+        if self._frames_to_skip > 0:
+            self._frames_to_skip -= 1
+            return False
+
+        # markers the tracker only matched to rejected candidates weren't decoded in this frame
+        decoded = markers[~markers["matched"]]
+        if len(decoded) > 0:
+            corners = decoded["corners"]
+        else:
+            # blurred markers often aren't decoded at all, so the tracked markers and candidates are measured instead
+            corners = np.concatenate((markers["corners"], np.asarray(rejected_corners, dtype=np.float32).reshape(-1, 4, 2)))
+        sharpness, brightness, clipped_low, clipped_high = frame_statistics(frame, corners)
+        self._samples.append((len(decoded), len(rejected_corners), sharpness, brightness, clipped_low, clipped_high))
+        if len(self._samples) < self.window:
+            return False
+
+        samples = self._samples
+        self._samples = []
+        sharpness_values = [sample[2] for sample in samples if sample[2] is not None]
+        self.statistics = ExposureStatistics(
+            markers=float(np.mean([sample[0] for sample in samples])),
+            rejected=float(np.mean([sample[1] for sample in samples])),
+            sharpness=float(np.mean(sharpness_values)) if sharpness_values else None,
+            brightness=float(np.mean([sample[3] for sample in samples])),
+            clipped_low=float(np.mean([sample[4] for sample in samples])),
+            clipped_high=float(np.mean([sample[5] for sample in samples])),
+            frames=len(samples)
+        )
+
+        exposure, gain, action = self._decide(self.statistics)
+        self.history.append((self.exposure, self.gain, self.statistics, action))
+        return self._set(exposure, gain)
+
+    def _set(self, exposure: int, gain: int) -> bool:
+        values = {self._exposure_control.name: exposure}
+        if self._gain_control is not None:
+            values[self._gain_control.name] = gain
+        changed = self._interface.apply_controls(values)
+        self.exposure, self.gain = exposure, gain
+        if changed:
+            self._frames_to_skip = self.settle_frames
+        return bool(changed)
+
+    def _decide(self, stats: ExposureStatistics) -> tuple[int, int, str]:
+        """
+        @returns the (exposure, gain) to use next and a short description of the decision
+        """
+        exposure, gain = self.exposure, self.gain
+
+        # clipped highlights cost marker contrast: darken, with gain first as it also adds noise
+        if stats.clipped_high > self.max_clipping or stats.brightness > self.brightness_range[1]:
+            if self._can_lower_gain():
+                return exposure, max(gain - self._gain_step(), self._gain_control.min), "lower gain (too bright)"
+            if exposure > self.min_exposure:
+                return self._shorter(exposure), gain, "shorter exposure (too bright)"
+            return exposure, gain, "too bright at the shortest exposure"
+
+        # too dark: brighten with gain first, as longer exposures blur. The black marker cells are always
+        # dark, so only clipped shadows well beyond them count.
+        if stats.clipped_low > 4 * self.max_clipping or stats.brightness < self.brightness_range[0]:
+            if self._can_raise_gain():
+                return exposure, min(gain + self._gain_step(), self._gain_control.max), "raise gain (too dark)"
+            if exposure < self.max_exposure:
+                return self._longer(exposure), gain, "longer exposure (too dark)"
+            return exposure, gain, "too dark at the longest exposure"
+
+        if stats.markers == 0 and stats.rejected == 0:
+            return exposure, gain, "no markers in view"
+
+        self._best_markers = max(self._best_markers, stats.markers)
+        if self._best_markers == 0:
+            # there are candidates, but none was ever decoded. Motion blur is the likely cause.
+            if exposure > self.min_exposure:
+                return self._shorter(exposure), gain, "shorter exposure (no marker decoded)"
+            return exposure, gain, "no marker decoded at the shortest exposure"
+        recall = stats.markers / self._best_markers
+
+        if recall >= self.target_recall:
+            if self.converged:
+                if (stats.sharpness is not None and self._good_sharpness is not None
+                        and stats.sharpness < self._good_sharpness * self.blur_tolerance
+                        and exposure > self.min_exposure):
+                    # markers move faster than during the search
+                    self.converged = False
+                    return self._shorter(exposure), gain, "shorter exposure (markers blurred)"
+                return exposure, gain, "converged"
+            self._good_settings = (exposure, gain)
+            self._good_sharpness = stats.sharpness
+            if exposure <= self.min_exposure:
+                self.converged = True
+                return exposure, gain, "converged at the shortest exposure"
+            return self._shorter(exposure), gain, "shorter exposure"
+
+        # fewer markers were decoded
+        if stats.markers + stats.rejected < self._best_markers * self.target_recall:
+            # there aren't even candidates for them, so the markers left the view rather than became unreadable
+            return exposure, gain, "markers out of view"
+        if self._good_settings is not None and self._good_settings[0] > exposure:
+            # the last step was too short
+            self.converged = True
+            good_exposure, good_gain = self._good_settings
+            return good_exposure, good_gain, "converged (previous exposure)"
+        if exposure < self.max_exposure:
+            self.converged = False
+            return self._longer(exposure), gain, "longer exposure (markers lost)"
+        # nothing better is possible under the current conditions
+        self._best_markers = stats.markers
+        self.converged = True
+        return exposure, gain, "converged at the longest exposure"
@@ -0,0 +1,336 @@
+
+"""
+Passing frames between processes through multiprocessing queues pickles and copies every frame,
+which costs more than the detection itself for large frames. The frame bus instead keeps a ring of
+frame slots in shared memory that one capture process writes into and any number of worker processes
+read NumPy views from without copying.
+
+The handoff is lock free: every slot has a sequence number that is invalidated while the slot is written.
+Readers take the newest frame and can check afterwards whether the writer has overwritten it in the meantime.
+"""
+
+import sys
+import threading
+import time
+from multiprocessing import shared_memory, resource_tracker
+import cv2
+import numpy as np
+
+
+SLOT_HEADER_DTYPE = np.dtype([
+    ("sequence", np.int64),     # number of the frame in the slot, 0 while the slot is empty or being written
+    ("timestamp", np.float64),
+])
+
+# frames start at a multiple of this many bytes for faster copies
+FRAME_ALIGNMENT = 64
+
+
+def _aligned(size: int) -> int:
+    return (size + FRAME_ALIGNMENT - 1) // FRAME_ALIGNMENT * FRAME_ALIGNMENT
+
+
+_register_lock = threading.Lock()
+
+
+def _attach_untracked(name: str) -> shared_memory.SharedMemory:
+    """
+    Attaches to existing shared memory without registering it with the resource tracker (before Python 3.13).
+    Otherwise, the tracker of an independent process removes the memory for everybody once that process exits.
+    The registration is skipped instead of undone afterwards, because spawned children share the tracker
+    of their parent, where unregistering would drop the registration of the owner.
+    """
+    with _register_lock:
+        register = resource_tracker.register
+
+        def register_except_shared_memory(resource_name: str, resource_type: str):
+            if resource_type != "shared_memory":
+                register(resource_name, resource_type)
+
+        resource_tracker.register = register_except_shared_memory
+        try:
+            return shared_memory.SharedMemory(name)
+        finally:
+            resource_tracker.register = register
+
+
+class FrameBus:
+    """
+    A ring of fixed size frame slots in shared memory with a single writer and multiple readers.
+    The bus can be passed to processes as an argument, the child processes attach to the same memory.
+    """
+
+    def __init__(self, frame_shape: tuple[int, ...], dtype=np.uint8, slot_count: int = 4, name: str | None = None, create: bool = True):
+        """
+        @param frame_shape shape of the frames, e.g. (1080, 1920, 3)
+        @param dtype data type of the frames
+        @param slot_count number of frame slots. Readers have to be done with a frame before the
+            writer has written slot_count - 1 more frames.
+        @param name name of the shared memory block, a random one if None
+        @param create True to create the shared memory block, False to attach to an existing one
+        """
+        if slot_count < 2:
+            raise ValueError(f"Frame bus needs at least 2 slots, not {slot_count}")
+        self._frame_shape = tuple(int(s) for s in frame_shape)
+        self._dtype = np.dtype(dtype)
+        self._slot_count = slot_count
+        self._owner = create
+
+        frame_size = _aligned(int(np.prod(self._frame_shape)) * self._dtype.itemsize)
+        # layout: [newest sequence][slot headers][frames]
+        headers_offset = np.dtype(np.int64).itemsize
+        frames_offset = _aligned(headers_offset + slot_count * SLOT_HEADER_DTYPE.itemsize)
+        total_size = frames_offset + slot_count * frame_size
+
+        if create:
+            self._memory = shared_memory.SharedMemory(name, create=True, size=total_size)
+        elif sys.version_info >= (3, 13):
+            # attached processes must not remove the memory when they exit, only the owner does
+            self._memory = shared_memory.SharedMemory(name, track=False)
+        else:
+            self._memory = _attach_untracked(name)
+        if self._memory.size < total_size:
+            raise ValueError(f"Shared memory '{name}' is too small for {slot_count} frames of shape {self._frame_shape}")
+
+        buffer = self._memory.buf
+        self._newest = np.ndarray((1,), np.int64, buffer, 0)
+        self._headers = np.ndarray((slot_count,), SLOT_HEADER_DTYPE, buffer, headers_offset)
+        self._frames = [
+            np.ndarray(self._frame_shape, self._dtype, buffer, frames_offset + slot * frame_size)
+            for slot in range(slot_count)
+        ]
+        # readers get read only views so they can't modify frames other readers are using
+        self._read_views = [frame.view() for frame in self._frames]
+        for view in self._read_views:
+            view.flags.writeable = False
+
+        if create:
+            self._newest[0] = 0
+            self._headers["sequence"] = 0
+            self._headers["timestamp"] = 0
+
+        # sequence number of the frame currently being written
+        self._write_sequence: int = int(self._newest[0])
+
+    @classmethod
+    def _attach(cls, name: str, frame_shape: tuple[int, ...], dtype: str, slot_count: int) -> "FrameBus":
+        return cls(frame_shape, dtype, slot_count, name, create=False)
+
+    def __reduce__(self):
+        # processes receiving the bus attach to the same shared memory instead of copying it
+        return (self._attach, (self.name, self._frame_shape, self._dtype.str, self._slot_count))
+
+    @property
+    def name(self) -> str:
+        return self._memory.name
+
+    @property
+    def frame_shape(self) -> tuple[int, ...]:
+        return self._frame_shape
+
+    @property
+    def owner(self) -> bool:
+        """
+        whether this process created the bus and frees it on close()
+        """
+        return self._owner
+
+    @property
+    def slot_count(self) -> int:
+        return self._slot_count
+
+    @property
+    def newest_sequence(self) -> int:
+        """
+        sequence number of the most recently written frame, 0 if there was none yet
+        """
+        return int(self._newest[0])
+
+    def _slot_of(self, sequence: int) -> int:
+        return (sequence - 1) % self._slot_count
+
+    # == writer side ==
+
+    def begin_write(self) -> np.ndarray:
+        """
+        Invalidates the next slot and returns a writable view of it to write a frame into.
+        Call commit() once the frame is complete.
+        """
+        sequence = self._write_sequence + 1
+        slot = self._slot_of(sequence)
+        # readers still using this slot's old frame will notice it is gone
+        self._headers["sequence"][slot] = 0
+        return self._frames[slot]
+
+    def commit(self, timestamp: float | None = None) -> int:
+        """
+        Publishes the frame written to the slot returned by begin_write()
+
+        @returns the sequence number of the frame
+        """
+        self._write_sequence += 1
+        slot = self._slot_of(self._write_sequence)
+        self._headers["timestamp"][slot] = time.time() if timestamp is None else timestamp
+        self._headers["sequence"][slot] = self._write_sequence
+        self._newest[0] = self._write_sequence
+        return self._write_sequence
+
+    def write(self, frame: np.ndarray, timestamp: float | None = None) -> int:
+        """
+        Copies a frame into the next slot and publishes it
+
+        @returns the sequence number of the frame
+        """
+        if frame.shape != self._frame_shape:
+            raise ValueError(f"Frame of shape {frame.shape} does not fit into frame bus slots of shape {self._frame_shape}")
+        np.copyto(self.begin_write(), frame, casting="unsafe")
+        return self.commit(timestamp)
+
+    def capture(self, capture, timestamp: float | None = None) -> tuple[bool, np.ndarray | None]:
+        """
+        Reads a frame from a capture (cv2.VideoCapture, ReplaySource, ...) directly into the next slot
+        and publishes it. Captures that can't read into a provided array are copied from.
+
+        @returns (status, writable view of the slot) like cv2.VideoCapture.read(). The view must not be
+            modified, as it is shared with the readers.
+        """
+        slot_frame = self.begin_write()
+        status, frame = capture.read(slot_frame)
+        if frame is None:
+            return False, None
+        # OpenCV returns a new array object for the provided memory, so compare memory instead of objects
+        if not np.may_share_memory(frame, slot_frame):
+            if frame.shape != self._frame_shape:
+                raise ValueError(f"Frame of shape {frame.shape} does not fit into frame bus slots of shape {self._frame_shape}")
+            np.copyto(slot_frame, frame, casting="unsafe")
+        self.commit(timestamp)
+        return status, slot_frame
+
+    # == reader side ==
+
+    def read_newest(self, after: int = 0) -> tuple[int, float, np.ndarray] | None:
+        """
+        Returns the newest frame if it is newer than a sequence number. The returned view stays valid
+        until the writer reuses its slot, use is_valid() to check whether it was overwritten.
+
+        @param after sequence number of the last frame the caller has processed
+        @returns (sequence, timestamp, read only frame view), or None if there is no newer frame
+        """
+        # the writer may overwrite the slot while its header is read, so retry until the header is consistent
+        for _ in range(self._slot_count):
+            sequence = int(self._newest[0])
+            if sequence <= after:
+                return None
+            slot = self._slot_of(sequence)
+            timestamp = float(self._headers["timestamp"][slot])
+            if int(self._headers["sequence"][slot]) == sequence:
+                return sequence, timestamp, self._read_views[slot]
+        return None
+
+    def wait_newest(self, after: int = 0, timeout: float = 1.0, poll_interval: float = 0.001) -> tuple[int, float, np.ndarray] | None:
+        """
+        Like read_newest(), but waits up to timeout seconds for a newer frame
+        """
+        deadline = time.perf_counter() + timeout
+        while True:
+            result = self.read_newest(after)
+            if result is not None or time.perf_counter() >= deadline:
+                return result
+            time.sleep(poll_interval)
+
+    def is_valid(self, sequence: int) -> bool:
+        """
+        @returns whether the frame with the sequence number is still in its slot, i.e. whether
+            a view returned for it has not been (partially) overwritten
+        """
+        return int(self._headers["sequence"][self._slot_of(sequence)]) == sequence
+
+    def detach(self):
+        """
+        Detaches from the shared memory without freeing it, even in the process that created the bus.
+        All frame views must be released before.
+        """
+        self._frames = []
+        self._read_views = []
+        self._newest = None
+        self._headers = None
+        self._memory.close()
+
+    def close(self):
+        """
+        Detaches from the shared memory. The process that created the bus also frees it.
+        All frame views must be released before.
+        """
+        self.detach()
+        if self._owner:
+            self._memory.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class FrameBusSource:
+    """
+    Reads frames from a frame bus like a video capture, so a TrackingStream can process
+    the frames captured by another process. Frames are returned as read only views into
+    the shared memory, so the stream should run in headless mode.
+    """
+
+    def __init__(self, bus: FrameBus, timeout: float = 1.0):
+        """
+        @param bus the frame bus to read from
+        @param timeout seconds to wait for a new frame before read() fails
+        """
+        self._bus = bus
+        self._timeout = timeout
+        self._last_sequence: int = 0
+        self.name = f"FrameBus {bus.name}"
+        # statistics
+        self.read_frames: int = 0
+        self.skipped_frames: int = 0
+
+    def read(self, image: np.ndarray | None = None) -> tuple[bool, np.ndarray | None]:
+        """
+        Returns the newest frame of the bus, skipping frames that were written since the previous call
+
+        @param image ignored, only accepted for compatibility with cv2.VideoCapture.read()
+        """
+        result = self._bus.wait_newest(self._last_sequence, self._timeout)
+        if result is None:
+            return False, None
+        sequence, _, frame = result
+        if self._last_sequence:
+            self.skipped_frames += sequence - self._last_sequence - 1
+        self._last_sequence = sequence
+        self.read_frames += 1
+        return True, frame
+
+    @property
+    def last_sequence(self) -> int:
+        return self._last_sequence
+
+    def is_valid(self) -> bool:
+        """
+        @returns whether the most recently read frame has not been overwritten yet
+        """
+        return self._last_sequence > 0 and self._bus.is_valid(self._last_sequence)
+
+    def get(self, prop_id: int) -> float:
+        # only the frame size is known
+        if prop_id == cv2.CAP_PROP_FRAME_WIDTH:
+            return float(self._bus.frame_shape[1])
+        if prop_id == cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(self._bus.frame_shape[0])
+        return 0.0
+
+    def isOpened(self) -> bool:
+        return True
+
+    def release(self):
+        # the bus is only freed by whoever created it. In the creating process, the bus object is shared
+        # with the writer, so it is left attached for the owner to close.
+        if not self._bus.owner:
+            self._bus.detach()
@@ -0,0 +1,155 @@
+
+import threading
+import numpy as np
+from ..utilities import backoff_delay
+from . import cv_types
+
+
+class FrameGrabber:
+    """
+    Wraps a video capture and continuously drains it from a background thread
+    into a small ring buffer of frame slots, so the consumer always gets the newest frame
+    instead of whatever has been piling up in the driver queue while it was busy.
+
+    FrameGrabber implements the cv_types.VideoCapture protocol, so it can be used
+    anywhere a regular OpenCV capture is expected.
+    """
+
+    def __init__(self, capture: cv_types.VideoCapture, buffer_size: int = 3, stale_timeout: float = 0.1):
+        """
+        @param capture the video capture to read frames from. It is owned by the grabber from now on.
+        @param buffer_size number of frame slots in the ring buffer. At least 3 are required so there is always
+            one slot for the newest frame, one for the frame currently handed out to the consumer and one for writing.
+        @param stale_timeout maximum time in seconds read() waits for a new frame before handing out the previous one again
+        """
+        if buffer_size < 3:
+            raise ValueError(f"FrameGrabber buffer size must be at least 3, not {buffer_size}")
+
+        self._capture = capture
+        self._stale_timeout = stale_timeout
+
+        # frame slots are allocated by the first read of the capture and then reused
+        self._slots: list[np.ndarray | None] = [None] * buffer_size
+        # index of the slot holding the newest complete frame (-1 means there is no frame yet)
+        self._latest_index: int = -1
+        # index of the slot that was last handed out to the consumer and must not be overwritten
+        self._reader_index: int = -1
+        # sequence numbers of the newest captured frame and the last frame handed out to the consumer
+        self._latest_sequence: int = 0
+        self._consumed_sequence: int = 0
+
+        # statistics
+        self.captured_frames: int = 0   # frames read from the capture
+        self.dropped_frames: int = 0    # frames that were replaced by a newer one before anybody read them
+        self.stale_frames: int = 0      # reads that had to return a frame that was already handed out before
+
+        self._new_frame = threading.Condition()
+        self._running = True
+        self._thread = threading.Thread(target=self._capture_loop, daemon=True)
+        self._thread.start()
+
+    def _next_write_index(self) -> int:
+        """
+        @returns the index of a slot that is neither the newest frame nor in use by the consumer
+        """
+        for index in range(len(self._slots)):
+            if index != self._latest_index and index != self._reader_index:
+                return index
+        # cannot happen with at least 3 slots
+        raise RuntimeError("FrameGrabber has no free frame slot")
+
+    def _capture_loop(self):
+        failed_reads = 0
+        while self._running:
+            with self._new_frame:
+                write_index = self._next_write_index()
+
+            # read directly into the preallocated slot. This happens outside the lock
+            # because the slot is not referenced by anybody else right now.
+            status, frame = self._capture.read(self._slots[write_index])
+
+            if not status or frame is None:
+                if not self._capture.isOpened():
+                    break
+                # e.g. a replay past its end or a camera that stopped delivering while still open.
+                # back off instead of spinning, waiting on the condition so release() can still wake us up.
+                failed_reads += 1
+                delay = backoff_delay(failed_reads)
+                if delay > 0:
+                    with self._new_frame:
+                        self._new_frame.wait_for(lambda: not self._running, delay)
+                continue
+            failed_reads = 0
+
+            with self._new_frame:
+                # the capture may have (re)allocated the output, e.g. on the first read
+                self._slots[write_index] = frame
+                self.captured_frames += 1
+                if self._latest_sequence > self._consumed_sequence:
+                    self.dropped_frames += 1
+                self._latest_index = write_index
+                self._latest_sequence += 1
+                self._new_frame.notify_all()
+
+        # wake up any reader waiting for a frame that will never come
+        with self._new_frame:
+            self._running = False
+            self._new_frame.notify_all()
+
+    def read(self, image: np.ndarray | None = None) -> tuple[bool, np.ndarray | None]:
+        """
+        Returns the newest frame. If no new frame has been captured since the last call,
+        waits up to stale_timeout seconds for one before returning the previous frame again.
+        Once the capture thread has stopped and every frame was handed out, returns (False, None).
+
+        @param image ignored, only accepted for compatibility with cv2.VideoCapture.read()
+
+        The returned array is owned by the grabber and stays valid until the next call to read().
+        """
+        with self._new_frame:
+            if self._latest_sequence == self._consumed_sequence and self._running:
+                self._new_frame.wait_for(
+                    lambda: self._latest_sequence != self._consumed_sequence or not self._running,
+                    self._stale_timeout
+                )
+
+            if self._latest_index < 0:
+                return False, None
+            # the capture ended, so the previous frame would be handed out forever
+            if self._latest_sequence == self._consumed_sequence and not self._running:
+                return False, None
+
+            if self._latest_sequence == self._consumed_sequence:
+                self.stale_frames += 1
+
+            self._reader_index = self._latest_index
+            self._consumed_sequence = self._latest_sequence
+            return True, self._slots[self._reader_index]
+
+    def get(self, prop_id: int) -> float:
+        return self._capture.get(prop_id)
+
+    def isOpened(self) -> bool:
+        return self._running and self._capture.isOpened()
+
+    def release(self):
+        """
+        Stops the capture thread and releases the underlying capture
+        """
+        with self._new_frame:
+            self._running = False
+            self._new_frame.notify_all()
+        self._thread.join()
+        self._capture.release()
+
+    @property
+    def statistics(self) -> dict[str, int]:
+        """
+        frame counters of the grabber
+        """
+        with self._new_frame:
+            return {
+                "captured": self.captured_frames,
+                "dropped": self.dropped_frames,
+                "stale": self.stale_frames
+            }
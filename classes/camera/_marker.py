@@ -15,6 +15,17 @@ class Marker:
     def __init__(self, id) -> None:
         self.id = id
 
+    @classmethod
+    def from_corners(cls, id, corners) -> "Marker":
+        """
+        Creates a marker at the position given by a 4x2 array of corners
+        in (tl, tr, br, bl) order, like returned by OpenCV.
+        """
+        marker = cls(id)
+        top_left, top_right, bottom_right, bottom_left = (Vec2(float(x), float(y)) for x, y in corners)
+        marker.move((top_left, top_right, bottom_left, bottom_right))
+        return marker
+
     def _calculate_center(self):
         self.center = Vec2.between(self.top_left, self.bottom_right)
     
@@ -30,8 +41,13 @@ class Marker:
         self._calculate_center()
     
     def maybe_move(self, new_position: tuple[Vec2]) -> bool:
-        return False
-        # create a temporary list of references to the old corners
+        """
+        Moves the marker to a new position (corners in tl, tr, bl, br order) if every new corner
+        is close to a different one of the old corners, e.g. for an undecoded candidate
+        that is likely this marker. The corner order of the candidate may be rotated.
+
+        @returns True if the marker was moved
+        """
         old_corners = [
             self.top_left,
             self.top_right,
@@ -39,19 +55,17 @@ class Marker:
             self.bottom_right
         ]
 
-
+        # find an old corner that is close enough to every new corner, each old corner can only be used once.
+        # the new corners are stored at the position of their old corner, as the candidate's order may be rotated.
+        matched_corners: list[Vec2 | None] = [None] * len(old_corners)
         for corner in new_position:
-            # find a corner that was previously close enough to this new corner and assign them
             for index, old_corner in enumerate(old_corners):
-                if old_corner.distance_to(corner) < self._unrelated_distance:
-                    old_corner.assign(corner)
-                    old_corners.pop(index)
+                if matched_corners[index] is None and old_corner.distance_to(corner) < self._unrelated_distance:
+                    matched_corners[index] = corner.copy()
                     break
-        
-        # if all the old corners were assigned a new one, the marker was matched successfully
-        if not len(old_corners):
-            self._calculate_center()
-            print("Distance matched")
-            return True
-            
-        return False
+            else:
+                return False
+
+        # all the corners were matched, so the candidate is this marker
+        self.move(tuple(matched_corners))
+        return True
@@ -0,0 +1,216 @@
+
+import numpy as np
+from ._marker import Marker
+
+
+# layout of a single marker table row
+MARKER_DTYPE = np.dtype([
+    ("id", np.int32),
+    ("corners", np.float32, (4, 2)),    # (tl, tr, br, bl) order, like OpenCV
+    ("center", np.float32, (2,)),
+    ("velocity", np.float32, (2,)),     # smoothed velocity of the center in pixels per second
+    ("timestamp", np.float64),          # time the marker was last detected
+    ("visible", np.bool_),              # whether the marker was detected in the most recent update
+    ("matched", np.bool_),              # whether the position was matched by the tracker instead of decoded
+    ("matched_frames", np.int32),       # number of consecutive updates the marker was only matched by the tracker
+    ("rvec", np.float64, (3,)),         # rotation of the marker relative to the camera (Rodrigues vector)
+    ("tvec", np.float64, (3,)),         # position of the marker relative to the camera in meters
+    ("pose_valid", np.bool_),           # whether rvec and tvec hold a pose estimated since the marker became visible
+])
+
+
+class MarkerTable:
+    """
+    Array-backed storage for all markers known to a detector. Every marker gets a row in
+    a structured NumPy array (see MARKER_DTYPE) that is updated with vectorized operations
+    directly from the detectMarkers() output, so there are no Python objects per marker or corner
+    involved in the tracking loop. Marker objects can still be created on request.
+    """
+
+    # weight of a new velocity measurement in the smoothed velocity
+    velocity_smoothing: float = 0.5
+    # markers not seen for longer than this many seconds start over with zero velocity
+    velocity_max_gap: float = 0.5
+
+    def __init__(self, capacity: int = 32):
+        """
+        @param capacity number of rows to preallocate. The table grows automatically if more markers are found.
+        """
+        self._rows = np.zeros(capacity, dtype=MARKER_DTYPE)
+        self._count: int = 0
+        # lookup array from marker ID to row index, -1 for unknown IDs. ArUco IDs are small
+        # (at most the dictionary size), so this stays small as well.
+        self._row_of_id = np.full(64, -1, dtype=np.int32)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __contains__(self, marker_id: int) -> bool:
+        return 0 <= marker_id < len(self._row_of_id) and self._row_of_id[marker_id] >= 0
+
+    @property
+    def rows(self) -> np.ndarray:
+        """
+        view of all used table rows. This is invalidated by the next update, use snapshot() to keep the data.
+        """
+        return self._rows[:self._count]
+
+    @property
+    def visible_rows(self) -> np.ndarray:
+        """
+        copy of the rows of all markers visible in the most recent update
+        """
+        rows = self.rows
+        return rows[rows["visible"]]
+
+    @property
+    def ids(self) -> np.ndarray:
+        return self.rows["id"]
+
+    @property
+    def visible_ids(self) -> np.ndarray:
+        rows = self.rows
+        return rows["id"][rows["visible"]]
+
+    @property
+    def decoded_ids(self) -> np.ndarray:
+        """
+        IDs of the visible markers that were decoded in the most recent update, not only matched by the tracker
+        """
+        rows = self.rows
+        return rows["id"][rows["visible"] & ~rows["matched"]]
+
+    def snapshot(self) -> np.ndarray:
+        """
+        @returns a copy of all used table rows
+        """
+        return self.rows.copy()
+
+    def row_indices(self, ids: np.ndarray) -> np.ndarray:
+        """
+        @returns the row index of every provided marker ID, -1 for unknown IDs
+        """
+        ids = np.asarray(ids, dtype=np.int32).reshape(-1)
+        indices = np.full(len(ids), -1, dtype=np.int32)
+        in_range = ids < len(self._row_of_id)
+        indices[in_range] = self._row_of_id[ids[in_range]]
+        return indices
+
+    def _add_rows(self, new_ids: np.ndarray):
+        """
+        Creates rows for the provided (unique and so far unknown) marker IDs
+        """
+        required_rows = self._count + len(new_ids)
+        if required_rows > len(self._rows):
+            grown = np.zeros(max(required_rows, 2 * len(self._rows)), dtype=MARKER_DTYPE)
+            grown[:self._count] = self.rows
+            self._rows = grown
+
+        max_id = int(new_ids.max())
+        if max_id >= len(self._row_of_id):
+            grown_lookup = np.full(max(max_id + 1, 2 * len(self._row_of_id)), -1, dtype=np.int32)
+            grown_lookup[:len(self._row_of_id)] = self._row_of_id
+            self._row_of_id = grown_lookup
+
+        new_rows = np.arange(self._count, required_rows, dtype=np.int32)
+        self._rows["id"][new_rows] = new_ids
+        self._row_of_id[new_ids] = new_rows
+        self._count = required_rows
+
+    def update(self, corners: tuple | np.ndarray, ids: np.ndarray | None, timestamp: float):
+        """
+        Updates the table with the results of a detection. All markers that are not
+        part of the detection are marked as not visible but keep their last position.
+
+        @param corners marker corners as returned by detectMarkers() (N arrays of 1x4x2 or an Nx4x2 array)
+        @param ids marker IDs as returned by detectMarkers() (Nx1 array or None if nothing was detected)
+        @param timestamp time of the frame the markers were detected in
+        """
+        self._rows["visible"][:self._count] = False
+
+        if ids is None or len(ids) == 0:
+            self._rows["pose_valid"][:self._count] = False
+            return
+
+        ids = np.asarray(ids, dtype=np.int32).reshape(-1)
+        corners = np.asarray(corners, dtype=np.float32).reshape(-1, 4, 2)
+
+        # create rows for markers that have never been seen before
+        unknown = self.row_indices(ids) < 0
+        if np.any(unknown):
+            self._add_rows(np.unique(ids[unknown]))
+
+        rows = self._row_of_id[ids]
+        self.move_rows(rows, corners, timestamp)
+        self._rows["matched"][rows] = False
+        self._rows["matched_frames"][rows] = 0
+        # poses of markers that are not visible anymore are outdated. The poses of visible
+        # markers are kept until the next pose estimation, which can use them as a starting point.
+        self._rows["pose_valid"][:self._count] &= self._rows["visible"][:self._count]
+
+    def move_rows(self, rows: np.ndarray, corners: np.ndarray, timestamp: float):
+        """
+        Moves the markers in the provided rows to new corners, updates their velocity
+        and marks them as visible.
+
+        @param rows row indices of the markers to move
+        @param corners Nx4x2 array of the new corners
+        @param timestamp time of the frame the markers were found in
+        """
+        centers = corners.mean(axis=1)
+
+        # update the smoothed velocity of markers that were seen shortly before
+        time_delta = timestamp - self._rows["timestamp"][rows]
+        has_previous = (self._rows["timestamp"][rows] > 0) & (time_delta > 0) & (time_delta < self.velocity_max_gap)
+        measured = (centers - self._rows["center"][rows]) / np.where(has_previous, time_delta, 1)[:, np.newaxis]
+        smoothed = self.velocity_smoothing * measured + (1 - self.velocity_smoothing) * self._rows["velocity"][rows]
+        self._rows["velocity"][rows] = np.where(has_previous[:, np.newaxis], smoothed, 0)
+
+        self._rows["corners"][rows] = corners
+        self._rows["center"][rows] = centers
+        self._rows["timestamp"][rows] = timestamp
+        self._rows["visible"][rows] = True
+
+    def mark_matched(self, rows: np.ndarray):
+        """
+        Marks the markers in the provided rows as matched by the tracker instead of decoded,
+        counting the consecutive updates they have only been matched for.
+
+        @param rows row indices of the matched markers
+        """
+        self._rows["matched"][rows] = True
+        self._rows["matched_frames"][rows] += 1
+
+    def corners(self, marker_id: int) -> np.ndarray:
+        """
+        @returns a copy of the 4x2 corners of a marker in (tl, tr, br, bl) order
+        """
+        if marker_id not in self:
+            raise KeyError(f"Marker {marker_id} is not in the table")
+        return self._rows["corners"][self._row_of_id[marker_id]].copy()
+
+    def pose(self, marker_id: int) -> tuple[np.ndarray, np.ndarray] | None:
+        """
+        @returns copies of (rvec, tvec) of a marker or None if there is no valid pose for it
+        """
+        if marker_id not in self:
+            raise KeyError(f"Marker {marker_id} is not in the table")
+        row = self._rows[self._row_of_id[marker_id]]
+        if not row["pose_valid"]:
+            return None
+        return row["rvec"].copy(), row["tvec"].copy()
+
+    def marker(self, marker_id: int) -> Marker:
+        """
+        @returns a Marker object with the position of a marker in the table
+        """
+        return Marker.from_corners(marker_id, self.corners(marker_id))
+
+    def markers(self) -> dict[int, Marker]:
+        """
+        @returns Marker objects for all markers in the table by ID
+        """
+        return {
+            int(row["id"]): Marker.from_corners(int(row["id"]), row["corners"])
+            for row in self.rows
+        }
@@ -0,0 +1,109 @@
+
+import numpy as np
+from ..utilities import linear_sum_assignment
+from ._marker_table import MarkerTable
+
+
+# cost of assignments that are not allowed, large but finite as required by the assignment solver
+FORBIDDEN_COST = 1e9
+
+
+def candidate_distances(predicted: np.ndarray, candidates: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Calculates the mean corner distance between every predicted marker and every candidate quad.
+    The corner order of undecoded candidates may be rotated, so all four cyclic rotations of every
+    candidate are compared and the best one is used.
+
+    @param predicted Kx4x2 predicted marker corners
+    @param candidates Mx4x2 candidate corners
+    @returns (KxM distances, KxM index of the best rotation)
+    """
+    # all cyclic rotations of the candidate corners: M x 4 rotations x 4 corners x 2
+    rotations = np.stack([np.roll(candidates, -shift, axis=1) for shift in range(4)], axis=1)
+    # K x M x 4 rotations x 4 corners
+    corner_distances = np.linalg.norm(
+        predicted[:, np.newaxis, np.newaxis, :, :] - rotations[np.newaxis, :, :, :, :],
+        axis=-1
+    )
+    mean_distances = corner_distances.mean(axis=-1)
+    best_rotation = mean_distances.argmin(axis=-1)
+    return np.take_along_axis(mean_distances, best_rotation[..., np.newaxis], axis=-1)[..., 0], best_rotation
+
+
+class MarkerTracker:
+    """
+    Keeps track of markers that could not be decoded in a frame (e.g. because they are blurred
+    or partially occluded) by matching the rejected marker candidates to the positions predicted
+    for the lost markers. Predictions use a constant velocity model based on the smoothed velocities
+    stored in the marker table, and candidates are assigned optimally using a vectorized cost matrix.
+    """
+
+    def __init__(self, max_distance: float = 0.5, min_distance: float = 10, max_age: float = 0.5, max_matched_frames: int = 15):
+        """
+        @param max_distance maximum mean corner distance between prediction and candidate relative to the marker size
+        @param min_distance the maximum distance in pixels is never smaller than this, so slow and small markers can be matched as well
+        @param max_age markers that were last seen longer than this many seconds ago are not tracked anymore
+        @param max_matched_frames markers that have only been matched but not decoded for this many updates are not tracked anymore
+        """
+        self._max_distance = max_distance
+        self._min_distance = min_distance
+        self._max_age = max_age
+        self._max_matched_frames = max_matched_frames
+
+    def predict(self, table: MarkerTable, timestamp: float) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Predicts the positions of all markers that are currently lost but still tracked.
+
+        @returns (row indices, Kx4x2 predicted corners)
+        """
+        rows = table.rows
+        tracked = (
+            ~rows["visible"]
+            & (timestamp - rows["timestamp"] <= self._max_age)
+            & (rows["matched_frames"] < self._max_matched_frames)
+        )
+        indices = np.flatnonzero(tracked)
+        time_delta = (timestamp - rows["timestamp"][indices]).astype(np.float32)
+        predicted = rows["corners"][indices] + (rows["velocity"][indices] * time_delta[:, np.newaxis])[:, np.newaxis, :]
+        return indices, predicted
+
+    def match(self, table: MarkerTable, candidates: np.ndarray, timestamp: float) -> int:
+        """
+        Matches rejected marker candidates to the lost markers in the table and moves
+        the matched markers to their candidates.
+
+        @param table the marker table, already updated with the decoded markers of the frame
+        @param candidates Mx4x2 corners of the rejected candidates of the frame
+        @param timestamp time of the frame
+        @returns the number of markers that were matched
+        """
+        if not len(candidates):
+            return 0
+        indices, predicted = self.predict(table, timestamp)
+        if not len(indices):
+            return 0
+
+        distances, rotations = candidate_distances(predicted, candidates)
+
+        # only allow assignments closer than a distance relative to the marker size
+        marker_sizes = np.linalg.norm(predicted - np.roll(predicted, 1, axis=1), axis=-1).mean(axis=-1)
+        max_distances = np.maximum(marker_sizes * self._max_distance, self._min_distance)
+        allowed = distances <= max_distances[:, np.newaxis]
+        if not np.any(allowed):
+            return 0
+
+        marker_indices, candidate_indices = linear_sum_assignment(np.where(allowed, distances, FORBIDDEN_COST))
+        valid = allowed[marker_indices, candidate_indices]
+        marker_indices, candidate_indices = marker_indices[valid], candidate_indices[valid]
+        if not len(marker_indices):
+            return 0
+
+        # bring the candidate corners into the same order as the marker corners
+        shifts = rotations[marker_indices, candidate_indices]
+        corner_order = (np.arange(4)[np.newaxis, :] + shifts[:, np.newaxis]) % 4
+        matched_corners = np.take_along_axis(candidates[candidate_indices], corner_order[:, :, np.newaxis], axis=1)
+
+        rows = indices[marker_indices]
+        table.move_rows(rows, matched_corners, timestamp)
+        table.mark_matched(rows)
+        return len(rows)
@@ -0,0 +1,94 @@
+
+import cv2
+import numpy as np
+from ._camera_params import CameraParams
+from ._marker_table import MarkerTable
+
+
+# side length of the markers on our robots in meters
+DEFAULT_MARKER_SIZE = 0.053
+
+
+def marker_object_points(size: float) -> np.ndarray:
+    """
+    @returns the 3D corners of a square marker with the given side length, centered at the origin,
+        in (tl, tr, br, bl) order as required by cv2.SOLVEPNP_IPPE_SQUARE
+    """
+    half = size / 2
+    return np.float32([
+        [-half, half, 0],
+        [half, half, 0],
+        [half, -half, 0],
+        [-half, -half, 0]
+    ])
+
+
+class PoseEstimator:
+    """
+    Estimates the poses of all visible markers in a MarkerTable in one pass and stores them
+    in the table, so drawing and other consumers can use them without recalculating anything.
+
+    Markers that were already tracked in the previous frame are refined starting from their previous pose,
+    which is faster and more stable than solving from scratch. New markers are solved with IPPE_SQUARE.
+    """
+
+    def __init__(self, camera_params: CameraParams, marker_sizes: dict[int, float] | None = None, default_marker_size: float = DEFAULT_MARKER_SIZE):
+        """
+        @param camera_params calibration parameters of the camera. Poses can only be estimated if they contain a calibration.
+        @param marker_sizes side lengths of markers in meters by marker ID
+        @param default_marker_size side length in meters for all markers not in marker_sizes
+        """
+        self.camera_params = camera_params
+        self._marker_sizes: dict[int, float] = dict(marker_sizes) if marker_sizes is not None else {}
+        self._default_marker_size = default_marker_size
+        # object points are cached per marker size
+        self._object_points: dict[float, np.ndarray] = {}
+
+    def set_marker_size(self, marker_id: int, size: float):
+        """
+        Sets the side length in meters of the marker with a specific ID
+        """
+        self._marker_sizes[marker_id] = size
+
+    def marker_size(self, marker_id: int) -> float:
+        return self._marker_sizes.get(marker_id, self._default_marker_size)
+
+    def _object_points_for(self, marker_id: int) -> np.ndarray:
+        size = self.marker_size(marker_id)
+        if size not in self._object_points:
+            self._object_points[size] = marker_object_points(size)
+        return self._object_points[size]
+
+    def estimate(self, table: MarkerTable):
+        """
+        Estimates the poses of all visible markers in the table and stores them in the table
+        """
+        matrix = self.camera_params.matrix
+        distortion = self.camera_params.distortion
+        if matrix is None:
+            return
+
+        rows = table.rows
+        for index in np.flatnonzero(rows["visible"]):
+            row = rows[index]
+            object_points = self._object_points_for(int(row["id"]))
+            image_points = row["corners"]
+
+            if row["pose_valid"]:
+                # the marker was tracked in the previous frame, so its old pose is a good starting point
+                rvec = row["rvec"].copy()
+                tvec = row["tvec"].copy()
+                success, rvec, tvec = cv2.solvePnP(
+                    object_points, image_points, matrix, distortion,
+                    rvec, tvec, useExtrinsicGuess=True, flags=cv2.SOLVEPNP_ITERATIVE
+                )
+            else:
+                success, rvec, tvec = cv2.solvePnP(
+                    object_points, image_points, matrix, distortion,
+                    flags=cv2.SOLVEPNP_IPPE_SQUARE
+                )
+
+            if success:
+                row["rvec"] = rvec.reshape(3)
+                row["tvec"] = tvec.reshape(3)
+            row["pose_valid"] = success
@@ -0,0 +1,193 @@
+"""
+A video source that replays recorded frames instead of reading from a camera.
+This allows running and profiling the tracking pipeline without any camera hardware.
+"""
+
+import os
+import glob
+import re
+import time
+import cv2
+import numpy as np
+
+
+# pacing modes
+PACING_REALTIME = "realtime"    # frames are returned at the recorded frame rate
+PACING_FAST = "fast"            # frames are returned as fast as they are requested
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+
+
+def natural_sort_key(file: str) -> tuple[str | int, ...]:
+    """
+    @returns a sort key of a file name that compares the numeric parts by value,
+        so frame_2.png comes before frame_10.png
+    """
+    # splitting on the digit groups puts the numbers at every odd index, so the keys of two names always line up
+    parts = re.split(r"(\d+)", os.path.basename(file).lower())
+    return tuple(int(part) if index % 2 else part for index, part in enumerate(parts))
+
+
+class ReplaySource:
+    """
+    Replays frames from a video file, a directory of numbered images or a raw frame dump
+    and implements the cv_types.VideoCapture protocol, so it can be used instead of a camera.
+
+    Raw frame dumps are either .npy files containing an array of frames or headerless
+    binary files of consecutive frames, in which case the frame shape must be provided.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        pacing: str = PACING_FAST,
+        loop: bool = False,
+        fps: float | None = None,
+        frame_shape: tuple[int, ...] | None = None
+    ):
+        """
+        @param path video file, image directory, .npy file or raw frame dump to replay
+        @param pacing PACING_REALTIME to return frames at the frame rate, PACING_FAST to return them as fast as possible
+        @param loop True to start over at the first frame after the last one instead of ending the stream
+        @param fps frame rate for realtime pacing. Defaults to the frame rate of video files and to 30 otherwise.
+        @param frame_shape (height, width) or (height, width, channels) of the frames in a headerless raw dump
+        """
+        if pacing not in (PACING_REALTIME, PACING_FAST):
+            raise ValueError(f"Invalid pacing mode '{pacing}'")
+
+        # constructor arguments, to reopen the source when it is sent to another process
+        self._arguments = (path, pacing, loop, fps, frame_shape)
+
+        self.name = os.path.basename(os.path.normpath(path))
+        self._path = path
+        self._pacing = pacing
+        self._loop = loop
+        self._opened = True
+
+        self._video: cv2.VideoCapture | None = None
+        self._image_files: list[str] | None = None
+        self._raw_frames: np.ndarray | None = None
+
+        if os.path.isdir(path):
+            self._image_files = sorted(
+                (file for file in glob.glob(os.path.join(path, "*")) if file.lower().endswith(IMAGE_EXTENSIONS)),
+                key=natural_sort_key
+            )
+            if not self._image_files:
+                raise ValueError(f"Directory '{path}' contains no images to replay")
+            first_frame = cv2.imread(self._image_files[0], cv2.IMREAD_COLOR)
+            self._frame_count = len(self._image_files)
+            self._frame_size = (first_frame.shape[1], first_frame.shape[0])
+        elif path.endswith(".npy"):
+            self._raw_frames = np.load(path, mmap_mode="r")
+        elif frame_shape is not None:
+            self._raw_frames = np.memmap(path, dtype=np.uint8, mode="r")
+            frame_pixels = int(np.prod(frame_shape))
+            self._raw_frames = self._raw_frames[:len(self._raw_frames) // frame_pixels * frame_pixels].reshape((-1, *frame_shape))
+        else:
+            self._video = cv2.VideoCapture(path)
+            if not self._video.isOpened():
+                raise ValueError(f"Could not open video file '{path}'")
+            self._frame_count = int(self._video.get(cv2.CAP_PROP_FRAME_COUNT))
+            self._frame_size = (
+                int(self._video.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                int(self._video.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            )
+            if fps is None and self._video.get(cv2.CAP_PROP_FPS) > 0:
+                fps = self._video.get(cv2.CAP_PROP_FPS)
+
+        if self._raw_frames is not None:
+            if not len(self._raw_frames):
+                raise ValueError(f"'{path}' contains no frames to replay")
+            self._frame_count = len(self._raw_frames)
+            self._frame_size = (self._raw_frames.shape[2], self._raw_frames.shape[1])
+
+        self._fps: float = fps if fps is not None else 30.0
+        # index of the next frame to return
+        self._position: int = 0
+        # time the first frame was returned at, for realtime pacing
+        self._start_time: float | None = None
+        self._frames_since_start: int = 0
+
+    def __reduce__(self):
+        # the source is reopened from the start instead of pickling open files and captures
+        return (self.__class__, self._arguments)
+
+    def _read_frame(self, index: int) -> np.ndarray | None:
+        # frames are always returned as 3 channel BGR images, like a camera delivers them
+        if self._image_files is not None:
+            return cv2.imread(self._image_files[index], cv2.IMREAD_COLOR)
+        if self._raw_frames is not None:
+            frame = self._raw_frames[index]
+            if frame.ndim == 2 or frame.shape[2] == 1:
+                return cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+            if frame.shape[2] == 4:
+                return cv2.cvtColor(frame, cv2.COLOR_BGRA2BGR)
+            # copy so the frame can be modified (e.g. drawn on) without touching the file
+            return np.array(frame)
+        _, frame = self._video.read()
+        return frame
+
+    def _rewind(self):
+        self._position = 0
+        if self._video is not None:
+            self._video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+
+    def read(self, image: np.ndarray | None = None) -> tuple[bool, np.ndarray | None]:
+        """
+        Returns the next frame. In realtime mode, this waits until the frame is due.
+
+        @param image ignored, only accepted for compatibility with cv2.VideoCapture.read()
+        """
+        if not self._opened:
+            return False, None
+
+        if self._position >= self._frame_count:
+            if not self._loop:
+                self._opened = False
+                return False, None
+            self._rewind()
+
+        frame = self._read_frame(self._position)
+        if frame is None and self._video is not None and self._loop and self._position > 0:
+            # the frame count of some video containers is not exact
+            self._rewind()
+            frame = self._read_frame(self._position)
+        if frame is None:
+            self._opened = False
+            return False, None
+        self._position += 1
+
+        if self._pacing == PACING_REALTIME:
+            if self._start_time is None:
+                self._start_time = time.perf_counter()
+            due = self._start_time + self._frames_since_start / self._fps
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            self._frames_since_start += 1
+
+        return True, frame
+
+    def get(self, prop_id: int) -> float:
+        match prop_id:
+            case cv2.CAP_PROP_FRAME_WIDTH:
+                return float(self._frame_size[0])
+            case cv2.CAP_PROP_FRAME_HEIGHT:
+                return float(self._frame_size[1])
+            case cv2.CAP_PROP_FPS:
+                return float(self._fps)
+            case cv2.CAP_PROP_FRAME_COUNT:
+                return float(self._frame_count)
+            case cv2.CAP_PROP_POS_FRAMES:
+                return float(self._position)
+            case _:
+                return 0.0
+
+    def isOpened(self) -> bool:
+        return self._opened
+
+    def release(self):
+        self._opened = False
+        if self._video is not None:
+            self._video.release()
@@ -0,0 +1,144 @@
+"""
+A camera simulation for testing exposure control without hardware: replayed frames are rendered as if they
+were taken with the exposure time and gain currently set on an emulated V4L2 device.
+"""
+
+from collections import deque
+import cv2
+import numpy as np
+from . import cv_types
+from ._v4l2_controls import FakeV4L2Device, FakeControl, V4L2_CTRL_TYPE_BOOLEAN, V4L2_CTRL_TYPE_MENU
+
+
+# control IDs from linux/v4l2-controls.h
+V4L2_CID_GAIN = 0x00980913
+V4L2_CID_EXPOSURE_AUTO = 0x009a0901
+V4L2_CID_EXPOSURE_ABSOLUTE = 0x009a0902
+V4L2_CID_EXPOSURE_AUTO_PRIORITY = 0x009a0903
+
+EXPOSURE_MANUAL = 1
+EXPOSURE_APERTURE_PRIORITY = 3
+
+
+class SimulatedCamera:
+    """
+    Wraps a video capture (usually a ReplaySource) and applies the exposure time and gain set on its emulated
+    control device to every frame:
+    - brightness scales with exposure time and gain
+    - markers moving across the frame are motion blurred in proportion to the exposure time
+    - sensor noise is amplified by the gain
+
+    The source frames should be sharp and are treated as if they were taken with the reference exposure time and
+    no gain. The controls are accessed like a real camera's, e.g. with UVCInterface(0, ControlBackend(camera.device)).
+
+    SimulatedCamera implements the cv_types.VideoCapture protocol.
+    """
+
+    def __init__(
+        self,
+        capture: cv_types.VideoCapture,
+        reference_exposure: int = 300,
+        auto_exposure: int | None = None,
+        motion_speed: float = 400.0,
+        motion_angle: float = 0.0,
+        gain_per_doubling: float = 25.0,
+        noise: float = 2.0,
+        latency_frames: int = 1,
+        seed: int | None = 0
+    ):
+        """
+        @param capture the video capture to read the source frames from. It is owned by the simulation from now on.
+        @param reference_exposure exposure time (in 100 µs units, like exposure_time_absolute) that reproduces
+            the brightness of the source frames
+        @param auto_exposure exposure time the emulated auto exposure picks, the reference exposure if None
+        @param motion_speed speed of the simulated motion in pixels per second
+        @param motion_angle direction of the simulated motion in degrees
+        @param gain_per_doubling gain control steps that double the brightness
+        @param noise standard deviation of the sensor noise without gain, in gray values
+        @param latency_frames number of frames it takes for changed controls to affect the frames, like on a real camera
+        @param seed seed of the noise, for reproducible simulations
+        """
+        self._capture = capture
+        self.name = "simulated " + getattr(capture, "name", type(capture).__name__)
+        self.reference_exposure = reference_exposure
+        self.auto_exposure = auto_exposure if auto_exposure is not None else reference_exposure
+        self.motion_speed = motion_speed
+        self.motion_angle = motion_angle
+        self.gain_per_doubling = gain_per_doubling
+        self.noise = noise
+        self._rng = np.random.default_rng(seed)
+
+        self.device = FakeV4L2Device({
+            V4L2_CID_GAIN: FakeControl("Gain", minimum=0, maximum=100, default=0),
+            V4L2_CID_EXPOSURE_AUTO: FakeControl(
+                "Auto Exposure", V4L2_CTRL_TYPE_MENU, 0, 3, 1, EXPOSURE_APERTURE_PRIORITY,
+                menu={EXPOSURE_MANUAL: "Manual Mode", EXPOSURE_APERTURE_PRIORITY: "Aperture Priority Mode"}
+            ),
+            V4L2_CID_EXPOSURE_ABSOLUTE: FakeControl("Exposure Time, Absolute", minimum=3, maximum=2047, default=self.auto_exposure),
+            V4L2_CID_EXPOSURE_AUTO_PRIORITY: FakeControl("Exposure, Dynamic Framerate", V4L2_CTRL_TYPE_BOOLEAN, 0, 1, 1, 0),
+        })
+        # (exposure, gain) of the most recent frames, the oldest one is applied to the next frame
+        self._settings: deque[tuple[int, int]] = deque(maxlen=latency_frames + 1)
+        # motion blur kernels by length
+        self._kernels: dict[int, np.ndarray] = {}
+
+    @property
+    def exposure(self) -> int:
+        """
+        exposure time of the next frame, in 100 µs units
+        """
+        if self.device.controls[V4L2_CID_EXPOSURE_AUTO].value != EXPOSURE_MANUAL:
+            return self.auto_exposure
+        return self.device.controls[V4L2_CID_EXPOSURE_ABSOLUTE].value
+
+    @property
+    def gain(self) -> int:
+        return self.device.controls[V4L2_CID_GAIN].value
+
+    def _blur_kernel(self, length: int) -> np.ndarray:
+        if length not in self._kernels:
+            kernel = np.zeros((length, length), dtype=np.float32)
+            kernel[length // 2, :] = 1.0 / length
+            rotation = cv2.getRotationMatrix2D(((length - 1) / 2, (length - 1) / 2), self.motion_angle, 1.0)
+            kernel = cv2.warpAffine(kernel, rotation, (length, length))
+            self._kernels[length] = kernel / kernel.sum()
+        return self._kernels[length]
+
+    def render(self, frame: np.ndarray, exposure: int, gain: int) -> np.ndarray:
+        """
+        @returns a source frame as it would look with an exposure time and gain
+        """
+        # exposure_time_absolute is in 100 µs units
+        blur_length = int(round(self.motion_speed * exposure * 1e-4))
+        image = frame
+        if blur_length >= 2:
+            image = cv2.filter2D(image, -1, self._blur_kernel(blur_length))
+
+        gain_factor = 2.0 ** (gain / self.gain_per_doubling)
+        image = image.astype(np.float32)
+        image *= exposure / self.reference_exposure * gain_factor
+        if self.noise > 0:
+            noise = self._rng.standard_normal(image.shape, dtype=np.float32)
+            noise *= self.noise * gain_factor
+            image += noise
+        return np.clip(image, 0, 255, out=image).astype(np.uint8)
+
+    def read(self, image: np.ndarray | None = None) -> tuple[bool, np.ndarray | None]:
+        """
+        @param image ignored, only accepted for compatibility with cv2.VideoCapture.read()
+        """
+        status, frame = self._capture.read()
+        if not status or frame is None:
+            return status, frame
+        self._settings.append((self.exposure, self.gain))
+        exposure, gain = self._settings[0]
+        return True, self.render(frame, exposure, gain)
+
+    def get(self, prop_id: int) -> float:
+        return self._capture.get(prop_id)
+
+    def isOpened(self) -> bool:
+        return self._capture.isOpened()
+
+    def release(self):
+        self._capture.release()
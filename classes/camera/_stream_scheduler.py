@@ -0,0 +1,293 @@
+"""
+Runs multiple TrackingStreams in parallel and collects their results in one place.
+
+Every stream gets its own worker (a process by default, optionally a thread) that is pinned
+to a dedicated set of CPU cores and limited to the same number of OpenCV threads, so multiple
+streams don't fight over the same cores.
+"""
+
+import os
+import time
+import queue
+import threading
+import traceback
+import multiprocessing as mp
+from dataclasses import dataclass, field
+import cv2
+import numpy as np
+from ._camera_device import CameraDevice
+from ._camera_params import CameraParams
+from ._aruco_detector import ARUCO_DICTS
+from ._tracking_stream import TrackingStream
+from ._replay_source import ReplaySource
+from ..utilities import backoff_delay
+
+
+@dataclass
+class StreamConfig:
+    """
+    Everything required to create a TrackingStream inside of a worker
+    """
+    # a camera or a video source that can be sent to the worker, such as a ReplaySource
+    source: CameraDevice | ReplaySource
+    camera_params: CameraParams
+    aruco_dict: int = ARUCO_DICTS["DICT_4X4_50"]
+    # playing field corners in (tl, tr, br, bl) order, None for the entire frame
+    source_corners: np.ndarray | None = None
+    threaded_capture: bool = False
+
+
+@dataclass
+class StreamResult:
+    """
+    The result of a single TrackingStream update as sent back by the workers
+    """
+    stream_index: int
+    sequence: int
+    timestamp: float
+    markers: dict[int, np.ndarray] = field(default_factory=dict)
+    frame: np.ndarray | None = None
+    # formatted traceback if the worker failed, its last result
+    error: str | None = None
+
+
+def allocate_cores(stream_count: int, cores: list[int] | None = None) -> list[list[int]]:
+    """
+    Splits the available CPU cores into one contiguous block per stream.
+    If there are fewer cores than streams, streams share cores round-robin.
+
+    @param stream_count number of streams to allocate cores for
+    @param cores the cores that may be used, all cores available to this process if None
+    @returns a list of core lists, one per stream
+    """
+    if cores is None:
+        if hasattr(os, "sched_getaffinity"):
+            cores = sorted(os.sched_getaffinity(0))
+        else:
+            cores = list(range(os.cpu_count() or 1))
+
+    if stream_count <= 0:
+        return []
+
+    if len(cores) < stream_count:
+        return [[cores[i % len(cores)]] for i in range(stream_count)]
+
+    per_stream = len(cores) // stream_count
+    return [cores[i * per_stream:(i + 1) * per_stream] for i in range(stream_count)]
+
+
+def _run_stream(
+    stream_index: int,
+    config: StreamConfig,
+    cores: list[int],
+    opencv_threads: int | None,
+    send_frames: bool,
+    results: "queue.Queue[StreamResult]",
+    stop_event: threading.Event
+):
+    """
+    Worker main function that creates a TrackingStream and updates it until stopped,
+    sending every result to the result queue. If the worker fails, a result with the error is sent last.
+    """
+    try:
+        _track_stream(stream_index, config, cores, opencv_threads, send_frames, results, stop_event)
+    except Exception:
+        # exceptions may not be picklable, so the formatted traceback is sent instead.
+        # the error must not be dropped like regular results, so this waits for space in the queue.
+        try:
+            results.put(StreamResult(stream_index, -1, time.time(), error=traceback.format_exc()), timeout=5)
+        except queue.Full:
+            traceback.print_exc()
+
+
+def _track_stream(
+    stream_index: int,
+    config: StreamConfig,
+    cores: list[int],
+    opencv_threads: int | None,
+    send_frames: bool,
+    results: "queue.Queue[StreamResult]",
+    stop_event: threading.Event
+):
+    # pin this worker to its cores. On Linux, this only affects the calling thread,
+    # so it works for both thread and process workers.
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    # the OpenCV thread count is per process, so it is only set by process workers
+    if opencv_threads is not None:
+        cv2.setNumThreads(opencv_threads)
+
+    stream = TrackingStream(
+        config.source,
+        config.camera_params,
+        config.aruco_dict,
+        threaded_capture=config.threaded_capture,
+        debug_window=False,
+        # if no frames are sent, nothing needs to be drawn
+        headless=not send_frames
+    )
+    if config.source_corners is not None:
+        stream._configure_source_area(config.source_corners)
+
+    sequence: int = 0
+    failed_updates: int = 0
+    try:
+        while not stop_event.is_set():
+            tracking_result = stream.update()
+            if tracking_result is None:
+                # the source will never deliver again, e.g. a replay without looping that reached its end
+                if not stream.is_open:
+                    break
+                # the source is still open but not delivering, so back off instead of spinning
+                failed_updates += 1
+                delay = backoff_delay(failed_updates)
+                if delay > 0:
+                    stop_event.wait(delay)
+                continue
+            failed_updates = 0
+            result = StreamResult(
+                stream_index,
+                sequence,
+                tracking_result.timestamp,
+                tracking_result.marker_corners(),
+                tracking_result.output_frame
+            )
+            sequence += 1
+
+            # if the collector can't keep up, the newest results are more interesting than old ones,
+            # so results are dropped instead of blocking the tracking
+            try:
+                results.put_nowait(result)
+            except queue.Full:
+                pass
+    finally:
+        stream.release()
+
+
+class StreamScheduler:
+    """
+    Runs any number of TrackingStreams in parallel worker processes or threads.
+    The results of all streams are returned through a single collector queue.
+    """
+
+    def __init__(
+        self,
+        configs: list[StreamConfig],
+        use_processes: bool = True,
+        send_frames: bool = True,
+        cores: list[int] | None = None,
+        queue_size: int = 16
+    ):
+        """
+        @param configs one config for every stream that should be run
+        @param use_processes True to run every stream in its own process, False to use threads.
+            OpenCV releases the GIL in most of its functions, so threads work fine as well
+            as long as most time is spent in OpenCV.
+        @param send_frames True to send the transformed output frames to the collector, False to only send the markers
+        @param cores CPU cores to distribute among the streams, all available cores if None
+        @param queue_size maximum number of results waiting to be collected before new results are dropped
+        """
+        self._configs = configs
+        self._use_processes = use_processes
+        self._send_frames = send_frames
+        self._core_allocation = allocate_cores(len(configs), cores)
+
+        self._workers: list[mp.Process | threading.Thread] = []
+        if use_processes:
+            # spawn instead of fork, because forking a process that already uses OpenCV's thread pool can deadlock
+            self._context = mp.get_context("spawn")
+            self._results = self._context.Queue(queue_size)
+            self._stop_event = self._context.Event()
+        else:
+            self._results = queue.Queue(queue_size)
+            self._stop_event = threading.Event()
+
+    @property
+    def core_allocation(self) -> list[list[int]]:
+        """
+        the CPU cores each stream is pinned to
+        """
+        return self._core_allocation
+
+    def start(self):
+        """
+        Starts one worker for every configured stream
+        """
+        if self._workers:
+            raise RuntimeError("StreamScheduler is already running")
+
+        self._stop_event.clear()
+
+        if not self._use_processes:
+            # all the threads share one OpenCV thread pool, so it is sized to what one stream gets
+            cv2.setNumThreads(max(len(c) for c in self._core_allocation) if self._core_allocation else 1)
+
+        for stream_index, (config, cores) in enumerate(zip(self._configs, self._core_allocation)):
+            args = (
+                stream_index,
+                config,
+                cores,
+                len(cores) if self._use_processes else None,
+                self._send_frames,
+                self._results,
+                self._stop_event
+            )
+            if self._use_processes:
+                worker = self._context.Process(target=_run_stream, args=args, daemon=True)
+            else:
+                worker = threading.Thread(target=_run_stream, args=args, daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def stop(self, timeout: float = 5):
+        """
+        Signals all workers to stop and waits for them to exit
+        """
+        self._stop_event.set()
+
+        # drain the result queue so process workers can flush their queue buffers and exit
+        deadline = time.time() + timeout
+        for worker in self._workers:
+            while worker.is_alive() and time.time() < deadline:
+                self._receive(0.05)
+                worker.join(0.05)
+            if self._use_processes and worker.is_alive():
+                worker.terminate()
+
+        self._workers.clear()
+
+    def collect(self, timeout: float | None = None) -> list[StreamResult]:
+        """
+        Waits up to timeout seconds for results and returns all results that are available.
+
+        @param timeout maximum time to wait for the first result, None to wait forever
+        @returns all available results in the order they were received, possibly empty
+        @raises RuntimeError if a worker failed
+        """
+        collected = self._receive(timeout)
+        for result in collected:
+            if result.error is not None:
+                raise RuntimeError(f"Stream {result.stream_index} failed:\n{result.error.rstrip()}")
+        # process workers can also die without getting to send an error, e.g. when they crash
+        if self._use_processes:
+            for stream_index, worker in enumerate(self._workers):
+                if worker.exitcode:
+                    raise RuntimeError(f"Stream {stream_index} exited with code {worker.exitcode}")
+        return collected
+
+    def _receive(self, timeout: float | None) -> list[StreamResult]:
+        collected: list[StreamResult] = []
+        try:
+            collected.append(self._results.get(timeout=timeout))
+            while True:
+                collected.append(self._results.get_nowait())
+        except queue.Empty:
+            pass
+        return collected
+
+    def __enter__(self) -> "StreamScheduler":
+        self.start()
+        return self
+
+    def __exit__(self, *_):
+        self.stop()
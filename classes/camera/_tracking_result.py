@@ -0,0 +1,61 @@
+
+from dataclasses import dataclass
+import numpy as np
+from ._marker_table import MARKER_DTYPE
+
+
+@dataclass
+class TrackingResult:
+    """
+    The structured result of a single TrackingStream update
+    """
+    # number of the update that produced this result
+    sequence: int
+    # time the frame was read
+    timestamp: float
+    # copy of the marker table rows (see MARKER_DTYPE) of all markers visible in the frame
+    markers: np.ndarray
+    # the raw camera frame. This may be reused by the capture for the next frame,
+    # so it must be copied if it is needed after the next update.
+    frame: np.ndarray | None = None
+    # the undistorted and perspective transformed frame with marker overlays, None in headless mode
+    output_frame: np.ndarray | None = None
+
+    @classmethod
+    def empty(cls, sequence: int = 0, timestamp: float = 0.0) -> "TrackingResult":
+        return cls(sequence, timestamp, np.zeros(0, dtype=MARKER_DTYPE))
+
+    @property
+    def ids(self) -> np.ndarray:
+        return self.markers["id"]
+
+    @property
+    def corners(self) -> np.ndarray:
+        """
+        Nx4x2 array of the corners of all markers in (tl, tr, br, bl) order
+        """
+        return self.markers["corners"]
+
+    def marker_corners(self) -> dict[int, np.ndarray]:
+        """
+        @returns a dict mapping marker IDs to their 4x2 corners
+        """
+        return {int(marker_id): corners for marker_id, corners in zip(self.markers["id"], self.markers["corners"])}
+
+    def to_dict(self) -> dict:
+        """
+        @returns a JSON serializable representation of the result without the frames
+        """
+        return {
+            "sequence": self.sequence,
+            "timestamp": self.timestamp,
+            "markers": [
+                {
+                    "id": int(row["id"]),
+                    "corners": row["corners"].tolist(),
+                    "rvec": row["rvec"].tolist() if row["pose_valid"] else None,
+                    "tvec": row["tvec"].tolist() if row["pose_valid"] else None
+                }
+                for row in self.markers
+            ]
+        }
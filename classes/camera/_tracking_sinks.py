@@ -0,0 +1,134 @@
+"""
+Output sinks that can be attached to a TrackingStream to display, record or publish its results.
+They are called with every TrackingResult after the tracking work of an update is done.
+"""
+
+import json
+import socket
+import cv2
+from ._camera_params import CameraParams
+from ._aruco_detector import draw_markers
+from ._tracking_result import TrackingResult
+
+
+class TrackingSink:
+    """
+    Base class of all tracking sinks
+    """
+
+    def consume(self, result: TrackingResult):
+        """
+        Called with the result of every TrackingStream update
+        """
+        raise NotImplementedError()
+
+    def close(self):
+        """
+        Called when the stream is released
+        """
+        pass
+
+
+class DisplaySink(TrackingSink):
+    """
+    Shows the raw camera frames with marker overlays in an OpenCV window.
+    The window is only updated when cv2.waitKey() is called, so this should only be used
+    when the stream is updated from the main thread.
+    """
+
+    def __init__(self, window_name: str, camera_params: CameraParams | None = None, draw_overlays: bool = True):
+        """
+        @param window_name name of the OpenCV window
+        @param camera_params calibration to draw marker poses with, poses are not drawn if None
+        @param draw_overlays True to draw the markers onto the frame. This modifies the frame.
+        """
+        self._window_name = window_name
+        self._camera_params = camera_params if camera_params is not None else CameraParams()
+        self._draw_overlays = draw_overlays
+
+    def consume(self, result: TrackingResult):
+        if result.frame is None:
+            return
+        if self._draw_overlays:
+            draw_markers(result.frame, result.markers, self._camera_params)
+        cv2.imshow(self._window_name, result.frame)
+
+    def close(self):
+        cv2.destroyWindow(self._window_name)
+
+
+class RecordingSink(TrackingSink):
+    """
+    Records the raw camera frames to a video file and/or the marker results to a JSON lines file.
+    Recorded videos can be played back with a ReplaySource.
+    """
+
+    def __init__(self, video_file: str | None = None, markers_file: str | None = None, fps: float = 30.0, fourcc: str = "MJPG"):
+        """
+        @param video_file file to record the raw frames to, None to not record frames
+        @param markers_file file to write one JSON object per result to, None to not record markers
+        @param fps frame rate of the video file
+        @param fourcc codec of the video file
+        """
+        self._video_file = video_file
+        self._fps = fps
+        self._fourcc = fourcc
+        # the video writer is opened with the first frame, as the frame size is not known before
+        self._video_writer: cv2.VideoWriter | None = None
+        self._markers_output = open(markers_file, "w") if markers_file is not None else None
+
+    def consume(self, result: TrackingResult):
+        if self._video_file is not None and result.frame is not None:
+            if self._video_writer is None:
+                height, width = result.frame.shape[:2]
+                self._video_writer = cv2.VideoWriter(
+                    self._video_file,
+                    cv2.VideoWriter_fourcc(*self._fourcc),
+                    self._fps,
+                    (width, height),
+                    result.frame.ndim == 3
+                )
+            self._video_writer.write(result.frame)
+
+        if self._markers_output is not None:
+            self._markers_output.write(json.dumps(result.to_dict()) + "\n")
+
+    def close(self):
+        if self._video_writer is not None:
+            self._video_writer.release()
+            self._video_writer = None
+        if self._markers_output is not None:
+            self._markers_output.close()
+            self._markers_output = None
+
+
+class UdpPublishSink(TrackingSink):
+    """
+    Publishes the marker results (without frames) as one JSON datagram per update via UDP
+    """
+
+    def __init__(self, host: str, port: int):
+        self._address = (host, port)
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # statistics
+        self.failed_sends: int = 0      # results that could not be sent
+        # consecutive failed sends, the warning is only printed at the start of a streak
+        self._failure_streak: int = 0
+
+    def consume(self, result: TrackingResult):
+        try:
+            self._socket.sendto(json.dumps(result.to_dict()).encode("UTF-8"), self._address)
+        except OSError as e:
+            # the receiver being unavailable must not stop the tracking, and must not
+            # print a warning for every single frame until it is back either
+            self.failed_sends += 1
+            self._failure_streak += 1
+            if self._failure_streak == 1:
+                print(f"Warning: could not publish tracking results to {self._address}, dropping them until it works again: {e}")
+            return
+        if self._failure_streak > 0:
+            print(f"[INFO] Publishing tracking results to {self._address} again after {self._failure_streak} failed sends")
+            self._failure_streak = 0
+
+    def close(self):
+        self._socket.close()
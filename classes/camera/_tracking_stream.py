@@ -10,12 +10,23 @@ https://stackoverflow.com/questions/31147438/how-to-undo-a-perspective-transform
 
 
 
+import json
+import time
 import cv2
 import numpy as np
+from ..utilities import StageTimer
+from . import cv_types
 from ._camera_device import CameraDevice
 from ._camera_params import CameraParams
 from ._aruco_detector import ArucoDetector, ARUCO_DICTS
 from ._sharpen import sharpen_image
+from ._frame_grabber import FrameGrabber
+from ._frame_bus import FrameBus
+from ._pose_estimator import PoseEstimator
+from ._tracking_result import TrackingResult
+from ._tracking_sinks import TrackingSink, DisplaySink
+from ._trajectory_store import TrajectoryStore, draw_trajectory
+from ._exposure_tuner import ExposureTuner
 
 
 TRACKER_OUTPUT_SHAPE = (400, 400)
@@ -30,19 +41,70 @@ class TrackingStream:
     the specified source camera is disconnected/connected (TBD).
     """
 
-    def __init__(self, source: CameraDevice, camera_params: CameraParams, aruco_dict: int = ARUCO_DICTS["DICT_4X4_50"]):
-        self._source_device = source
+    def __init__(self, source: CameraDevice | cv_types.VideoCapture, camera_params: CameraParams, aruco_dict: int = ARUCO_DICTS["DICT_4X4_50"], threaded_capture: bool = False, debug_window: bool = True, incremental_detection: bool = False, detection_scale: float = 1.0, undistort: bool = True, marker_sizes: dict[int, float] | None = None, headless: bool = False, trajectory_length: int = 256, frame_bus: FrameBus | None = None, exposure_tuner: ExposureTuner | None = None):
+        """
+        @param source the camera to read frames from, or any already opened video capture such as a ReplaySource
+        @param camera_params calibration parameters of the camera
+        @param aruco_dict ArUco dictionary of the markers to track
+        @param threaded_capture True to read the camera from a background thread and always process the newest frame
+            instead of the oldest one waiting in the driver queue (see FrameGrabber)
+        @param debug_window True to show the raw camera image with marker overlays in an OpenCV window on every update
+            (by attaching a DisplaySink). This must be disabled when the stream is not updated from the main thread.
+            Ignored in headless mode.
+        @param incremental_detection True to only search for markers around their previous positions
+            most of the time (see ArucoDetector)
+        @param detection_scale factor to downscale frames by for marker detection. Corners are refined
+            on the full resolution frame afterwards (see ArucoDetector)
+        @param undistort True to correct lens distortion in the output frame using the camera params (if they contain a calibration)
+        @param marker_sizes side lengths of the markers in meters by marker ID for pose estimation. 
+            Markers not listed use the default size (see PoseEstimator).
+        @param headless True to only produce the structured tracking results without drawing overlays,
+            transforming the output frame or showing any windows. Sinks can still be attached.
+        @param trajectory_length number of recent positions kept per marker (see TrajectoryStore)
+        @param frame_bus shared memory frame bus to capture the raw frames into, so processes reading
+            from the bus with a FrameBusSource get every frame without copying
+        @param exposure_tuner tuner that adjusts the exposure of the camera from the statistics of every frame
+        """
+        self._source_device: CameraDevice | None = None
         self._aruco_dict = aruco_dict
-        self._camera_params = camera_params
-        self._input_stream = self._source_device.open()
+        self._headless = headless
+        self._frame_bus = frame_bus
+        self._exposure_tuner = exposure_tuner
+        self._undistort = undistort
+        if isinstance(source, CameraDevice):
+            self._source_device = source
+            self._input_stream = source.open()
+            self._display_name = source.display_name + f" ({source.video_index})"
+        else:
+            self._input_stream = source
+            self._display_name = getattr(source, "name", type(source).__name__)
+        if threaded_capture:
+            self._input_stream = FrameGrabber(self._input_stream)
         self._input_shape = (
             int(self._input_stream.get(cv2.CAP_PROP_FRAME_WIDTH)),
             int(self._input_stream.get(cv2.CAP_PROP_FRAME_HEIGHT))
         )
+        # the calibration may have been made at a different resolution than the camera is capturing at
+        self._camera_params = self._params_for_input(camera_params)
         self._detector = ArucoDetector(
             self._aruco_dict,
-            self._camera_params
+            self._camera_params,
+            incremental=incremental_detection,
+            detection_scale=detection_scale
         )
+        self._pose_estimator = PoseEstimator(self._camera_params, marker_sizes)
+        # recent positions of all markers for path drawing, speed estimation, ...
+        self.trajectories = TrajectoryStore(trajectory_length)
+
+        # timing of the update stages
+        self.timer = StageTimer()
+
+        # outputs the results of every update is passed to
+        self._sinks: list[TrackingSink] = []
+        if debug_window and not headless:
+            # the overlays are already drawn by the stream itself
+            self.add_sink(DisplaySink(self._display_name, draw_overlays=False))
+        self._sequence: int = 0
 
         # the output frame is stored, so in case the camera disconnects, the old frame can be shown for the time being
         self._output_frame: cv2.Mat = np.zeros(TRACKER_OUTPUT_SHAPE)
@@ -51,6 +113,10 @@ class TrackingStream:
         self._transformation_matrix: np.ndarray
         self._source_corners: np.ndarray
         self._dest_corners: np.ndarray
+        # lookup table that maps every output pixel to its source pixel in the raw camera frame,
+        # combining lens undistortion and the perspective transformation (see _build_remap())
+        self._remap_x: np.ndarray
+        self._remap_y: np.ndarray
         # by default, the source area is the entire frame
         self._configure_source_area(np.float32(
             [
@@ -77,60 +143,243 @@ class TrackingStream:
             [0, TRACKER_OUTPUT_SHAPE[1]]                        # bl
         ])
 
+        # the perspective transformation applies to the undistorted image, so the source corners (which are
+        # picked on the raw image) need to be undistorted as well.
+        undistorted_corners = self._source_corners
+        if self._undistortion_enabled:
+            undistorted_corners = cv2.undistortPoints(
+                np.float32(self._source_corners).reshape(-1, 1, 2),
+                self._camera_params.matrix,
+                self._camera_params.distortion,
+                P=self._camera_params.matrix
+            ).reshape(-1, 2)
+
         self._transformation_matrix = cv2.getPerspectiveTransform(
-            self._source_corners,
+            np.float32(undistorted_corners),
             self._dest_corners
         )
 
+        self._build_remap()
+
+    def _params_for_input(self, camera_params: CameraParams) -> CameraParams:
+        if self._input_shape[0] > 0 and self._input_shape[1] > 0:
+            return camera_params.scaled(self._input_shape)
+        return camera_params
+
+    @property
+    def _undistortion_enabled(self) -> bool:
+        return self._undistort and self._camera_params.matrix is not None and self._camera_params.distortion is not None
+
+    def _distorted_points(self, points: np.ndarray) -> np.ndarray:
+        """
+        @param points Nx1x2 points in the undistorted image
+        @returns the matching Nx1x2 points in the raw frame
+        """
+        # convert to normalized camera coordinates and project them with lens distortion applied
+        matrix = self._camera_params.matrix
+        normalized = cv2.undistortPoints(points, matrix, None)
+        object_points = cv2.convertPointsToHomogeneous(normalized).reshape(-1, 3)
+        distorted_points, _ = cv2.projectPoints(
+            object_points,
+            np.zeros(3), np.zeros(3),
+            matrix,
+            self._camera_params.distortion
+        )
+        return distorted_points
+
+    def _build_remap(self):
+        """
+        Calculates the remap lookup table that produces the output frame from a raw camera frame in 
+        a single cv2.remap() call. For every output pixel, the perspective transformation is inverted to find 
+        the matching point in the undistorted image, which is then distorted again using the camera params 
+        to find the pixel in the raw frame. 
+
+        The distortion is looked up in the undistortion map of the camera params, which is cached with the
+        calibration, so only points outside the frame have to be projected.
+        
+        This only has to be done when the source area or camera params change.
+        """
+
+        # every pixel of the output image
+        grid_x, grid_y = np.meshgrid(
+            np.arange(TRACKER_OUTPUT_SHAPE[0], dtype=np.float32),
+            np.arange(TRACKER_OUTPUT_SHAPE[1], dtype=np.float32)
+        )
+        output_points = np.dstack((grid_x, grid_y)).reshape(-1, 1, 2)
+
+        # invert the perspective transformation
+        source_points = cv2.perspectiveTransform(output_points, np.linalg.inv(self._transformation_matrix))
+
+        map_xy = source_points.reshape(TRACKER_OUTPUT_SHAPE[1], TRACKER_OUTPUT_SHAPE[0], 2).astype(np.float32)
+
+        if self._undistortion_enabled:
+            if self._input_shape[0] > 0 and self._input_shape[1] > 0:
+                undistort_map = self._camera_params.undistort_map(self._input_shape)
+                inside = (
+                    (map_xy[..., 0] >= 0) & (map_xy[..., 0] <= self._input_shape[0] - 1)
+                    & (map_xy[..., 1] >= 0) & (map_xy[..., 1] <= self._input_shape[1] - 1)
+                )
+                distorted_xy = cv2.remap(np.asarray(undistort_map), map_xy[..., 0], map_xy[..., 1], cv2.INTER_LINEAR)
+                if not inside.all():
+                    distorted_xy[~inside] = self._distorted_points(map_xy[~inside].reshape(-1, 1, 2)).reshape(-1, 2)
+                map_xy = distorted_xy
+            else:
+                map_xy = self._distorted_points(source_points).reshape(map_xy.shape).astype(np.float32)
+        # fixed point maps are smaller and faster to remap with than float maps
+        self._remap_x, self._remap_y = cv2.convertMaps(map_xy, None, cv2.CV_16SC2)
+
+    def set_camera_params(self, camera_params: CameraParams):
+        """
+        Changes the camera calibration used for undistortion and pose estimation
+        """
+        self._camera_params = self._params_for_input(camera_params)
+        self._detector._camera_params = self._camera_params
+        self._pose_estimator.camera_params = self._camera_params
+        self._configure_source_area(self._source_corners)
+
+    def add_sink(self, sink: TrackingSink):
+        """
+        Attaches a sink that receives the result of every update
+        """
+        self._sinks.append(sink)
+
+    def remove_sink(self, sink: TrackingSink):
+        self._sinks.remove(sink)
 
-    def update(self) -> cv2.Mat:
+    def update(self) -> TrackingResult | None:
         """
         Reads a new frame from the camera and performs all tracking operations
 
-        @returns the finished and and transformed frame of the 
+        @returns the tracking result of the new frame, None if there was no new frame
         """
+        timer = self.timer
+        timer.start()
         
         # read frame
-        status, frame_raw = self._input_stream.read()
+        if self._frame_bus is not None:
+            status, frame_raw = self._frame_bus.capture(self._input_stream)
+        else:
+            status, frame_raw = self._input_stream.read()
+        timestamp = time.time()
+        timer.lap("read")
 
         # if there is no frame, don't do anything
         if frame_raw is None:
-            return self._output_frame
-        
-        # correct for distortion (making things worse currently)
-        # new_matrix, _ = cv2.getOptimalNewCameraMatrix(
-        #     self._camera_params.matrix, 
-        #     self._camera_params.distortion,
-        #     self._input_shape, 1, self._input_shape
-        # )
-        # frame_raw = cv2.undistort(
-        #     frame_raw,
-        #     self._camera_params.matrix,
-        #     self._camera_params.distortion,
-        #     None, new_matrix
-        # )
+            return None
         
         # image preprocessing
-        frame_bw = cv2.cvtColor(frame_raw, cv2.COLOR_BGR2GRAY)
-        frame_bw = sharpen_image(frame_bw)
+        frame_gray = cv2.cvtColor(frame_raw, cv2.COLOR_BGR2GRAY)
+        timer.lap("cvtColor")
+        frame_bw = sharpen_image(frame_gray)
+        timer.lap("sharpen")
 
         # detect markers
-        self._detector.detect(frame_bw)
-        self._detector.draw_markers_on_frame(frame_raw)
-
-        # warp image to output perspective
-        self._output_frame = cv2.warpPerspective(
-            frame_raw,
-            self._transformation_matrix,
-            TRACKER_OUTPUT_SHAPE,
-            flags=cv2.INTER_LINEAR
+        self._detector.detect(frame_bw, timestamp)
+        timer.lap("detect")
+        self._pose_estimator.estimate(self._detector.marker_table)
+        timer.lap("pose")
+
+        if self._exposure_tuner is not None:
+            # the statistics are taken from the frame as the camera delivered it, before sharpening
+            self._exposure_tuner.observe(frame_gray, self._detector.marker_table.visible_rows, self._detector.rejected_corners)
+            timer.lap("exposure")
+
+        result = TrackingResult(
+            self._sequence,
+            timestamp,
+            self._detector.marker_table.visible_rows,
+            frame_raw
         )
+        self._sequence += 1
+        self.trajectories.record(result.markers)
+        timer.lap("trajectory")
+
+        if not self._headless:
+            # frames shared with other processes must not be drawn on, and neither must grabber frames,
+            # which are handed out again if no new frame arrives in time and would then be detected with the overlays
+            if self._frame_bus is not None or isinstance(self._input_stream, FrameGrabber) or not frame_raw.flags.writeable:
+                frame_raw = frame_raw.copy()
+                result.frame = frame_raw
+            self._detector.draw_markers_on_frame(frame_raw)
+            for marker_id in result.ids:
+                # markers may not have a trajectory if the memory cap is reached
+                if int(marker_id) in self.trajectories:
+                    draw_trajectory(frame_raw, self.trajectories.points(int(marker_id)))
+            timer.lap("draw")
+
+            # undistort and warp image to output perspective
+            self._output_frame = cv2.remap(
+                frame_raw,
+                self._remap_x,
+                self._remap_y,
+                cv2.INTER_LINEAR
+            )
+            result.output_frame = self._output_frame
+            timer.lap("remap")
+
+        # pass the results on to display, recording, publishing, ...
+        if self._sinks:
+            for sink in self._sinks:
+                sink.consume(result)
+            timer.lap("sinks")
 
-        # show direct camera image with overlays for debugging
-        cv2.imshow(self._source_device.display_name + f" ({self._source_device.video_index})", frame_raw)
+        return result
 
+    @property
+    def output_frame(self) -> np.ndarray:
+        """
+        the most recent undistorted and transformed output frame. In headless mode, this is never updated.
+        """
         return self._output_frame
-        
 
+    def timing_summary(self) -> dict[str, dict[str, float]]:
+        """
+        @returns timing statistics in milliseconds of all stages of update() and the stages of the
+            marker detection (prefixed with "detect/"), see StageTimer.summary()
+        """
+        summary = self.timer.summary()
+        for stage, stats in self._detector.timer.summary().items():
+            summary["detect/" + stage] = stats
+        return summary
 
-        
\ No newline at end of file
+    def dump_timings(self, file: str):
+        """
+        Writes the timing summary to a JSON file
+        """
+        with open(file, "w") as f:
+            json.dump(self.timing_summary(), f, indent=4)
+
+    @property
+    def markers(self) -> dict[int, np.ndarray]:
+        """
+        snapshot of the corners of all currently known markers by marker ID
+        """
+        return self._detector.marker_corners()
+
+    @property
+    def exposure_tuner(self) -> ExposureTuner | None:
+        return self._exposure_tuner
+
+    @property
+    def is_open(self) -> bool:
+        """
+        False once the source can no longer deliver frames, e.g. a replay that reached its end
+        """
+        return self._input_stream.isOpened()
+
+    @property
+    def capture_statistics(self) -> dict[str, int] | None:
+        """
+        captured/dropped/stale frame counters of the capture thread, None if threaded capture is not enabled
+        """
+        if isinstance(self._input_stream, FrameGrabber):
+            return self._input_stream.statistics
+        return None
+
+    def release(self):
+        """
+        Releases the camera (and stops the capture thread if there is one) and closes all sinks
+        """
+        self._input_stream.release()
+        for sink in self._sinks:
+            sink.close()
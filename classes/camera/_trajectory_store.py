@@ -0,0 +1,263 @@
+
+import cv2
+import numpy as np
+
+
+TRAJECTORY_DTYPE = np.dtype([
+    ("timestamp", np.float64),
+    ("x", np.float32),
+    ("y", np.float32),
+    ("heading", np.float32),    # angle of the marker's top edge in radians, 0 = pointing right
+])
+
+
+class TrajectoryStore:
+    """
+    Stores the recent trajectory of every marker in preallocated circular NumPy buffers,
+    so appending a sample of a known marker never allocates and queries such as velocities can be computed vectorized.
+
+    The memory of all buffers together is capped. Once the cap is reached, the buffer of the marker
+    that was not updated for the longest time is reused for new markers.
+    """
+
+    def __init__(self, length: int = 256, max_bytes: int = 4 * 1024 * 1024):
+        """
+        @param length number of samples kept per marker
+        @param max_bytes maximum memory used by the sample buffers of all markers together
+        """
+        if length < 2:
+            raise ValueError(f"Trajectory length must be at least 2, not {length}")
+        self._length = length
+        self._max_slots = max_bytes // (length * TRAJECTORY_DTYPE.itemsize)
+        if self._max_slots < 1:
+            raise ValueError(f"{max_bytes} bytes are not enough for a trajectory of {length} samples")
+
+        # one buffer row (slot) per marker. Slots are allocated on demand up to max_slots.
+        self._buffer = np.zeros((0, length), dtype=TRAJECTORY_DTYPE)
+        # index the next sample of every slot is written to
+        self._head = np.zeros(0, dtype=np.int32)
+        # number of valid samples in every slot
+        self._size = np.zeros(0, dtype=np.int32)
+        # marker ID stored in every slot
+        self._slot_ids = np.zeros(0, dtype=np.int32)
+        # lookup array from marker ID to slot index, -1 for markers without trajectory
+        self._slot_of_id = np.full(64, -1, dtype=np.int32)
+
+    @property
+    def length(self) -> int:
+        return self._length
+
+    @property
+    def ids(self) -> np.ndarray:
+        return self._slot_ids.copy()
+
+    @property
+    def memory_usage(self) -> int:
+        """
+        number of bytes currently allocated for samples
+        """
+        return self._buffer.nbytes
+
+    def __contains__(self, marker_id: int) -> bool:
+        return 0 <= marker_id < len(self._slot_of_id) and self._slot_of_id[marker_id] >= 0
+
+    def __len__(self) -> int:
+        return len(self._slot_ids)
+
+    def _slot(self, marker_id: int) -> int:
+        if marker_id not in self:
+            raise KeyError(f"No trajectory for marker {marker_id}")
+        return int(self._slot_of_id[marker_id])
+
+    def _allocate_slots(self, new_ids: np.ndarray):
+        """
+        Creates slots for the provided (unique and so far unknown) marker IDs, reusing
+        the least recently updated slots if the memory cap is reached
+        """
+        max_id = int(new_ids.max())
+        if max_id >= len(self._slot_of_id):
+            grown_lookup = np.full(max(max_id + 1, 2 * len(self._slot_of_id)), -1, dtype=np.int32)
+            grown_lookup[:len(self._slot_of_id)] = self._slot_of_id
+            self._slot_of_id = grown_lookup
+
+        # only as many new markers as there are slots at all can be stored
+        new_ids = new_ids[:self._max_slots]
+
+        free_slots = self._max_slots - len(self._slot_ids)
+        grow_count = min(free_slots, len(new_ids))
+        if grow_count > 0:
+            old_count = len(self._slot_ids)
+            self._buffer = np.concatenate([self._buffer, np.zeros((grow_count, self._length), dtype=TRAJECTORY_DTYPE)])
+            self._head = np.concatenate([self._head, np.zeros(grow_count, dtype=np.int32)])
+            self._size = np.concatenate([self._size, np.zeros(grow_count, dtype=np.int32)])
+            self._slot_ids = np.concatenate([self._slot_ids, new_ids[:grow_count].astype(np.int32)])
+            self._slot_of_id[new_ids[:grow_count]] = np.arange(old_count, old_count + grow_count, dtype=np.int32)
+
+        # the remaining markers take over the slots that were not updated for the longest time
+        evicted_ids = new_ids[grow_count:]
+        if len(evicted_ids):
+            last_sample = (self._head - 1) % self._length
+            last_update = np.where(self._size > 0, self._buffer["timestamp"][np.arange(len(self._head)), last_sample], -np.inf)
+            # slots of markers that are being added in this call must not be reused
+            last_update[self._slot_of_id[new_ids[:grow_count]]] = np.inf
+            slots = np.argsort(last_update, kind="stable")[:len(evicted_ids)]
+            self._slot_of_id[self._slot_ids[slots]] = -1
+            self._slot_ids[slots] = evicted_ids
+            self._slot_of_id[evicted_ids] = slots
+            self._head[slots] = 0
+            self._size[slots] = 0
+
+    def append(self, ids: np.ndarray, timestamp: float, centers: np.ndarray, headings: np.ndarray):
+        """
+        Appends one sample to the trajectories of multiple markers
+
+        @param ids unique IDs of the markers
+        @param timestamp time of the samples
+        @param centers Nx2 array of the marker centers
+        @param headings N marker headings in radians
+        """
+        ids = np.asarray(ids, dtype=np.int32).reshape(-1)
+        if not len(ids):
+            return
+
+        in_lookup = ids < len(self._slot_of_id)
+        known = np.zeros(len(ids), dtype=bool)
+        known[in_lookup] = self._slot_of_id[ids[in_lookup]] >= 0
+        if not np.all(known):
+            self._allocate_slots(ids[~known])
+
+        slots = self._slot_of_id[ids]
+        # markers that did not fit into memory are not recorded
+        stored = slots >= 0
+        slots = slots[stored]
+        heads = self._head[slots]
+
+        samples = self._buffer[slots, heads]
+        samples["timestamp"] = timestamp
+        samples["x"] = centers[stored, 0]
+        samples["y"] = centers[stored, 1]
+        samples["heading"] = np.asarray(headings)[stored]
+        self._buffer[slots, heads] = samples
+
+        self._head[slots] = (heads + 1) % self._length
+        self._size[slots] = np.minimum(self._size[slots] + 1, self._length)
+
+    def record(self, rows: np.ndarray):
+        """
+        Appends the positions of the provided marker table rows (see MARKER_DTYPE), e.g. the visible rows
+        after an update. All rows must have the same timestamp.
+        """
+        if not len(rows):
+            return
+        # the heading is the direction of the top edge, from the top left to the top right corner
+        top_edges = rows["corners"][:, 1] - rows["corners"][:, 0]
+        headings = np.arctan2(top_edges[:, 1], top_edges[:, 0])
+        self.append(rows["id"], float(rows["timestamp"][0]), rows["center"], headings)
+
+    def trajectory(self, marker_id: int, count: int | None = None) -> np.ndarray:
+        """
+        @param count number of most recent samples to return, all stored samples if None
+        @returns a copy of the samples (see TRAJECTORY_DTYPE) of a marker in chronological order
+        """
+        slot = self._slot(marker_id)
+        size = int(self._size[slot])
+        if count is not None:
+            size = min(size, count)
+        indices = (self._head[slot] - size + np.arange(size)) % self._length
+        return self._buffer[slot, indices]
+
+    def points(self, marker_id: int, count: int | None = None) -> np.ndarray:
+        """
+        @returns Nx2 float32 array of the centers of a marker in chronological order, e.g. for drawing its path
+        """
+        samples = self.trajectory(marker_id, count)
+        return np.stack([samples["x"], samples["y"]], axis=1)
+
+    def velocities(self, marker_id: int, count: int | None = None) -> np.ndarray:
+        """
+        @returns (N-1)x2 array of the velocities in pixels per second between consecutive samples
+        """
+        samples = self.trajectory(marker_id, count)
+        time_deltas = np.diff(samples["timestamp"])
+        # samples with the same timestamp have no measurable velocity
+        time_deltas[time_deltas <= 0] = np.inf
+        return np.stack([np.diff(samples["x"]), np.diff(samples["y"])], axis=1) / time_deltas[:, np.newaxis]
+
+    def accelerations(self, marker_id: int, count: int | None = None) -> np.ndarray:
+        """
+        @returns (N-2)x2 array of the accelerations in pixels per second² between consecutive velocities
+        """
+        samples = self.trajectory(marker_id, count)
+        velocities = self.velocities(marker_id, count)
+        # velocities are located in the middle between two samples
+        midpoints = (samples["timestamp"][1:] + samples["timestamp"][:-1]) / 2
+        time_deltas = np.diff(midpoints)
+        time_deltas[time_deltas <= 0] = np.inf
+        return np.diff(velocities, axis=0) / time_deltas[:, np.newaxis]
+
+    def speed(self, marker_id: int, count: int = 5) -> float:
+        """
+        @returns the average speed in pixels per second over the most recent count samples,
+            0 if there are not enough samples
+        """
+        samples = self.trajectory(marker_id, count)
+        if len(samples) < 2:
+            return 0.0
+        duration = samples["timestamp"][-1] - samples["timestamp"][0]
+        if duration <= 0:
+            return 0.0
+        distance = np.sum(np.hypot(np.diff(samples["x"]), np.diff(samples["y"])))
+        return float(distance / duration)
+
+    def latest_velocities(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Calculates the current velocity of all markers at once from their two most recent samples
+
+        @returns (marker IDs, Nx2 velocities in pixels per second). Markers with less than two samples have zero velocity.
+        """
+        slots = np.arange(len(self._slot_ids))
+        newest = self._buffer[slots, (self._head - 1) % self._length]
+        previous = self._buffer[slots, (self._head - 2) % self._length]
+        time_deltas = newest["timestamp"] - previous["timestamp"]
+        valid = (self._size >= 2) & (time_deltas > 0)
+        time_deltas = np.where(valid, time_deltas, 1)
+        velocities = np.stack([newest["x"] - previous["x"], newest["y"] - previous["y"]], axis=1) / time_deltas[:, np.newaxis]
+        velocities[~valid] = 0
+        return self._slot_ids.copy(), velocities
+
+    def remove(self, marker_id: int):
+        """
+        Discards the trajectory of a marker. Its slot is reused for the next new marker.
+        """
+        slot = self._slot(marker_id)
+        self._size[slot] = 0
+        self._head[slot] = 0
+        # move the last slot into the free one so the used slots stay contiguous
+        last = len(self._slot_ids) - 1
+        if slot != last:
+            self._buffer[slot] = self._buffer[last]
+            self._head[slot] = self._head[last]
+            self._size[slot] = self._size[last]
+            self._slot_ids[slot] = self._slot_ids[last]
+            self._slot_of_id[self._slot_ids[slot]] = slot
+        self._slot_of_id[marker_id] = -1
+        self._buffer = self._buffer[:last]
+        self._head = self._head[:last]
+        self._size = self._size[:last]
+        self._slot_ids = self._slot_ids[:last]
+
+    def clear(self):
+        self._buffer = np.zeros((0, self._length), dtype=TRAJECTORY_DTYPE)
+        self._head = np.zeros(0, dtype=np.int32)
+        self._size = np.zeros(0, dtype=np.int32)
+        self._slot_ids = np.zeros(0, dtype=np.int32)
+        self._slot_of_id[:] = -1
+
+
+def draw_trajectory(frame: np.ndarray, points: np.ndarray, color: tuple[int, int, int] = (0, 127, 255), thickness: int = 2):
+    """
+    Draws the path through the provided Nx2 points onto a frame
+    """
+    if len(points) < 2:
+        return
+    cv2.polylines(frame, [np.round(points).astype(np.int32).reshape(-1, 1, 2)], False, color, thickness)
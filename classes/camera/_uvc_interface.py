@@ -1,11 +1,13 @@
 
 from dataclasses import dataclass
-import subprocess
 from typing import Any
+from ._v4l2_controls import (
+    ControlBackend, ControlInfo, V4L2DeviceFile,
+    V4L2_CTRL_TYPE_INTEGER, V4L2_CTRL_TYPE_BOOLEAN, V4L2_CTRL_TYPE_MENU, V4L2_CTRL_TYPE_INTEGER_MENU
+)
+from ._control_profile import ControlProfile, ordered_controls, governed_controls
 
 
-MENU_LEGEND_LINE_PREFIX = "\t\t\t\t"
-
 # The menu type of UVC controls basically is a dictionary
 menu = dict
 
@@ -27,6 +29,9 @@ class UVCControl:
     menu_val_to_name: dict[int, str] | None = None
     menu_name_to_val: dict[str, int] | None = None
     value: int = 0
+    # whether the value can be read from/written to the device
+    readable: bool = True
+    writable: bool = True
     
     @property
     def option(self) -> str:
@@ -45,11 +50,32 @@ class UVCControl:
         return f"{self.__class__.__name__}({self.name} ({self.datatype.__name__}, {str(self.min) + '-' + str(self.max)  + ', ' if self.min is not None and self.max is not None else ''}{'step=' + str(self.step) + ', ' if self.step is not None else ''}default={self.default}): {self.value}{' ' + self.menu_val_to_name[self.value] if self.datatype is menu else ''})"
 
 
+# control datatypes by V4L2 control type
+CONTROL_DATATYPES = {
+    V4L2_CTRL_TYPE_INTEGER: int,
+    V4L2_CTRL_TYPE_BOOLEAN: bool,
+    V4L2_CTRL_TYPE_MENU: menu,
+    V4L2_CTRL_TYPE_INTEGER_MENU: menu
+}
+
+
 class UVCInterface:
+    """
+    Reads and writes the UVC controls of a video device. Controls are accessed as attributes
+    (e.g. interface.brightness = 10), multiple controls can be written at once with set_controls().
+
+    The device is accessed with ioctls, so writing controls only takes a fraction of a millisecond.
+    """
 
-    def __init__(self, device: str | int = 0):
+    def __init__(self, device: str | int = 0, backend: ControlBackend | None = None):
+        """
+        @param device video device path or number
+        @param backend the backend to access the controls with, e.g. a ControlBackend of a FakeV4L2Device for testing.
+            The device file is opened with the first access if None.
+        """
         self._device_path: str
         self._controls: dict[str, UVCControl] = {}
+        self._backend: ControlBackend | None = backend
 
         if isinstance(device, int):
             self._device_path = f"/dev/video{device}"
@@ -57,6 +83,24 @@ class UVCInterface:
             self._device_path = device
         else:
             raise ValueError(f"Device must be a video device path or number, not {device}.")
+
+    @property
+    def backend(self) -> ControlBackend:
+        if self._backend is None:
+            self._backend = ControlBackend(V4L2DeviceFile(self._device_path))
+        return self._backend
+
+    @property
+    def controls(self) -> dict[str, UVCControl]:
+        return dict(self._controls)
+
+    def close(self):
+        """
+        Closes the device file
+        """
+        if self._backend is not None:
+            self._backend.close()
+            self._backend = None
         
     def load_controls(self):
         """
@@ -67,114 +111,166 @@ class UVCInterface:
         # delete old supported controls
         self._controls.clear()
 
-        # get new controls and values
-        v4l_process = subprocess.Popen(
-            ["v4l2-ctl", "-d", self._device_path, "--list-ctrls-menu"],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT
-        )
-        v4l_process.wait
-        stdout, _ = v4l_process.communicate()
-        
-        v4l_output_lines = stdout.decode('UTF-8').splitlines()
-
-        for i, line in enumerate(v4l_output_lines):
-            # Skip menu legend lines which are denoted by a special prefix (usually 4 tabs)
-            if v4l_output_lines[i].startswith(MENU_LEGEND_LINE_PREFIX):
+        info: ControlInfo
+        for info in self.backend.query_controls():
+            datatype = CONTROL_DATATYPES.get(info.type)
+            if datatype is None:
+                print(f"Warning: UVC control '{info.name}' with unsupported type {info.type}, ignoring")
                 continue
 
-            # Skip Header lines and empty lines which don't start with spaces
-            if not v4l_output_lines[i].startswith(' '):
-                continue
-            
-            new_control = UVCControl()
-
-            # separate the info section from the parameters section
-            control_section_info, control_section_parameters = (p.strip() for p in line.split(":", 1))
-            # control_section_info == "brightness 0x00980900 (int)"
-            # control_section_parameters == "min=-64 max=64 step=1 default=0 value=0" [""]
-            
-            # split the info into the control name, ID and datatype and save the info
-            control_info = control_section_info.split()
-            #print(f"{control_info=}")  # ["brighness", "0x00980900", "(int)"]
-            new_control.name = control_info[0]
-            new_control.id = int(control_info[1], 16)
-            try:
-                new_control.datatype = {
-                    "(int)": int,
-                    "(bool)": bool,
-                    "(menu)": menu
-                }[control_info[2]]
-            except KeyError:
-                print(f"Warning: UVC control with unknown datatype: {control_info[2]}, ignoring")
-                continue
-            
-
-            # split the values section into the separate value parameters 
-            # som menu controls have additional human readable information appended to the end that is not interesting to us
-            # so we ignore any split results that don't contain an equals sign. We also ignore flags
-            control_parameters = {param.split("=", 1)[0]: int(param.split("=", 1)[1]) for param in (control_section_parameters.split()) if "=" in param and not "flags=" in param}
-            #print(f"{control_parameters=}") # {"min": -64, "max": 64, "step": 1, "default": 0, "value": 0}
-
-            # store all the parameters
-            for name, val in control_parameters.items():
-                setattr(new_control, name, val)
-
-            # if the parameter is a menu, parse all the menu options from the legend
-            if new_control.datatype is menu:
-                # initialize menu map
-                new_control.menu_val_to_name = {}
-                
-                legend_line_index = i + 1
-                # menu lines always start with four tabs, so if a line starts with a space
-                while True:
-                    legend_line: str = v4l_output_lines[legend_line_index]
-                    # menu lines always start with a prefix (4 tabs), so if a line doesn't start with that, we have reached the ned of the legend
-                    if not legend_line.startswith(MENU_LEGEND_LINE_PREFIX):
-                        break
-                    option_value, option_name = legend_line.split(":", 1)
-                    # save the option
-                    new_control.menu_val_to_name[int(option_value)] = option_name.strip()
-                    # next line
-                    legend_line_index += 1
-                
+            new_control = UVCControl(
+                name=info.name,
+                id=info.id,
+                datatype=datatype,
+                default=info.default,
+                value=info.default,
+                readable=info.readable,
+                writable=info.writable
+            )
+            # like v4l2-ctl, booleans have no range and only integers have a step
+            if datatype is not bool:
+                new_control.min = info.minimum
+                new_control.max = info.maximum
+            if datatype is int:
+                new_control.step = info.step
+            if datatype is menu:
+                new_control.menu_val_to_name = dict(info.menu)
                 # save the reverser map as well for performance
                 new_control.menu_name_to_val = invert_dict(new_control.menu_val_to_name)
             
             # save the control
             self._controls[new_control.name] = new_control
+
+        self.read_controls()
+
+    def read_controls(self, names: list[str] | None = None):
+        """
+        Reads the current values of controls from the device in one go
+
+        @param names names of the controls to read, all readable controls if None
+        """
+        controls = [self._control(name) for name in names] if names is not None else list(self._controls.values())
+        controls = [control for control in controls if control.readable]
+        values = self.backend.read_controls([control.id for control in controls])
+        for control in controls:
+            control.value = values[control.id]
+
+    def _control(self, name: str) -> UVCControl:
+        if name not in self._controls:
+            raise AttributeError(f"'{self._device_path}' has no UVC control '{name}'")
+        return self._controls[name]
+
+    def _validated_value(self, control: UVCControl, value: Any) -> int:
+        """
+        @returns the raw value to write for a control value, which may also be a menu option name
+        """
+        if isinstance(value, bool) or isinstance(value, int):
+            raw_value = int(value)
+        elif isinstance(value, str):
+            if control.datatype is not menu or control.menu_name_to_val is None:
+                raise TypeError(f"UVC control '{control.name}' is not a menu and cannot be set to '{value}'")
+            if value not in control.menu_name_to_val:
+                raise ValueError(f"'{value}' is not a valid menu option for UVC control '{control.name}' of camera '{self._device_path}'")
+            raw_value = control.menu_name_to_val[value]
+        else:
+            raise TypeError(f"UVC control cannot be assigned a value of type '{type(value).__name__}'")
+
+        # make sure the value is in allowed
+        if not control.writable:
+            raise ValueError(f"UVC control '{control.name}' of camera '{self._device_path}' is read only")
+        if control.datatype is int and control.min is not None and control.max is not None:
+            if raw_value < control.min or raw_value > control.max:
+                raise ValueError(f"UVC control '{control.name}' of camera '{self._device_path}' must be within {control.min} and {control.max}")
+        if control.datatype is bool:
+            if raw_value not in (0, 1):
+                raise ValueError(f"UVC control '{control.name}' of camera '{self._device_path}' must be boolean")
+        if control.datatype is menu:
+            if raw_value not in control.menu_val_to_name:
+                raise ValueError(f"UVC control '{control.name}' of camera '{self._device_path}' must be one of {control.menu_val_to_name}")
+        return raw_value
+
+    def set_controls(self, values: dict[str, Any]):
+        """
+        Writes multiple controls with a single ioctl. The controls are written in the order of the dict,
+        which matters for controls depending on others (e.g. auto_exposure before exposure_time_absolute).
+        All values are validated before anything is written.
+
+        @param values control values (or menu option names) by control name
+        """
+        controls = [self._control(name) for name in values.keys()]
+        raw_values = {control.id: self._validated_value(control, value) for control, value in zip(controls, values.values())}
+
+        try:
+            self.backend.write_controls(raw_values)
+        except OSError as e:
+            error_index = getattr(e, "error_idx", len(controls))
+            failed = f"'{controls[error_index].name}'" if error_index < len(controls) else str([c.name for c in controls])
+            raise RuntimeError(f"UVC control {failed} of camera '{self._device_path}' could not be written: {e}") from e
+
+        for control in controls:
+            control.value = raw_values[control.id]
         
-    def set_to_defaults(self):
+    def changed_controls(self, values: dict[str, Any]) -> dict[str, Any]:
         """
-        Sets all the UVC Parameters back to their default settings
+        Compares control values with the cached current values of the controls
+
+        @param values control values (or menu option names) by control name
+        @returns the values that differ from the current ones, auto modes first (see set_controls()).
+            Manual values governed by an auto mode that changes are always included, as the driver may have
+            changed them while the auto mode was active.
         """
-        for control in self._controls.values():
-            self._write_control(control, default=True)
+        ordered = ordered_controls(values)
+        changed = set()
+        for name, value in ordered.items():
+            control = self._control(name)
+            if self._validated_value(control, value) != control.value:
+                changed.add(name)
+        for name in list(changed):
+            changed.update(governed for governed in governed_controls(name) if governed in ordered)
+        return {name: value for name, value in ordered.items() if name in changed}
 
-    
-    def _write_control(self, control: UVCControl, default: bool = False):
-        """
-        Writes the current or default value of a UVCControl object to the camera using
-        the v4l2-ctl command.
-
-        @param control the control that should be written
-        @param default True to write the default value instead of the current value
-        """
-        value = control.default if default else control.value
-        v4l_process = subprocess.Popen(
-            ["v4l2-ctl", "-d", self._device_path, "-c", f"{control.name}={value}"]
-        )
-
-        match errcode := v4l_process.wait():
-            case 0:
-                control.value = value   # in case default was written, store it as the new value
-                return
-            case 1:
-                raise RuntimeError(f"v4l2-ctl: '{control.name}' is not a valid UVC control for camera '{self._device_path}'")
-            case 255:
-                raise RuntimeError(f"v4l2-ctl: UVC control '{control.name}' of camera '{self._device_path}' cannot be set to {value}")
-            case _:
-                raise RuntimeError(f"v4l2-ctl: Unknown error {errcode} while writing UVC control '{control.name}' of camera '{self._device_path}'")
+    def apply_controls(self, values: dict[str, Any], refresh: bool = False) -> dict[str, Any]:
+        """
+        Writes only the controls whose value changed, with a single ioctl and auto modes first
+
+        @param values control values (or menu option names) by control name
+        @param refresh True to read the current values from the device before comparing, e.g. if another
+            program might have changed them. Otherwise the cached values are used.
+        @returns the values that were written
+        """
+        if not self._controls:
+            self.load_controls()
+        elif refresh:
+            self.read_controls([name for name in values.keys() if name in self._controls])
+
+        changed = self.changed_controls(values)
+        if changed:
+            self.set_controls(changed)
+        return changed
+
+    def apply_profile(self, profile: ControlProfile, refresh: bool = False) -> dict[str, Any]:
+        """
+        Applies a control profile, writing only the controls that differ from the current values
+
+        @returns the values that were written
+        """
+        return self.apply_controls(profile.values, refresh)
+
+    def profile(self, name: str, names: list[str] | None = None) -> ControlProfile:
+        """
+        Creates a profile of the current control values, e.g. to save settings adjusted by hand
+
+        @param names names of the controls to include, all writable controls if None
+        """
+        controls = [self._control(name) for name in names] if names is not None else list(self._controls.values())
+        return ControlProfile(name, ordered_controls({control.name: control.value for control in controls if control.writable}))
+
+    def set_to_defaults(self):
+        """
+        Sets all the UVC Parameters back to their default settings. Controls that already have their
+        default value are not written.
+        """
+        self.apply_controls({control.name: control.default for control in self._controls.values() if control.writable})
 
     def __setattr__(self, __name: str, __value: Any) -> None:
         """
@@ -182,32 +278,7 @@ class UVCInterface:
         """
 
         if "_controls" in self.__dict__ and __name in self.__dict__["_controls"]:
-            target_control: UVCControl = self.__dict__["_controls"][__name]
-            old_value = target_control.value
-            if isinstance(__value, int):
-                target_control.value = __value
-            elif isinstance(__value, str):
-                if target_control.datatype is not menu or target_control.menu_name_to_val is None:
-                    raise TypeError(f"UVC control '{target_control.name}' is not a menu and cannot be set to '{__value}'")
-                if __value not in target_control.menu_name_to_val:
-                    raise ValueError(f"'{__value}' is not a valid menu option for UVC control '{target_control.name}' of camera '{self._device_path}'")
-                target_control.value = target_control.menu_name_to_val[__value]
-            else:
-                raise TypeError(f"UVC control cannot be assigned a value of type '{type(__value).__name__}'")
-
-            # make sure the value is in allowed
-            if target_control.datatype is int and target_control.min is not None and target_control.max is not None:
-                if target_control.value < target_control.min or target_control.value > target_control.max:
-                    raise ValueError(f"UVC control '{target_control.name}' of camera '{self._device_path}' must be within {target_control.min} and {target_control.max}")
-            if target_control.datatype is bool:
-                if target_control.value not in (0, 1):
-                    raise ValueError(f"UVC control '{target_control.name}' of camera '{self._device_path}' must be boolean")
-            if target_control.datatype is menu:
-                if target_control.value not in target_control.menu_val_to_name:
-                    raise ValueError(f"UVC control '{target_control.name}' of camera '{self._device_path}' must be one of {target_control.menu_val_to_name}")
-
-            # actually perform the write operation
-            self._write_control(target_control)
+            self.set_controls({__name: __value})
 
         else:
             super().__setattr__(__name, __value)
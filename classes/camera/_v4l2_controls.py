@@ -0,0 +1,365 @@
+"""
+Access to V4L2 (UVC) camera controls through ioctls instead of v4l2-ctl processes.
+
+All controls are enumerated with VIDIOC_QUERYCTRL/VIDIOC_QUERYMENU, and control values are read and written
+in batches with VIDIOC_G_EXT_CTRLS/VIDIOC_S_EXT_CTRLS, so changing any number of controls is a single ioctl.
+
+The device is accessed through a small interface (ioctl() and close()), so it can be replaced by
+FakeV4L2Device, which emulates the ioctls in memory for testing without a camera.
+
+Structures and constants from linux/videodev2.h:
+https://www.kernel.org/doc/html/latest/userspace-api/media/v4l/vidioc-queryctrl.html
+https://www.kernel.org/doc/html/latest/userspace-api/media/v4l/vidioc-g-ext-ctrls.html
+"""
+
+import ctypes
+import errno
+import fcntl
+import os
+import re
+from dataclasses import dataclass, field
+
+
+class v4l2_queryctrl(ctypes.Structure):
+    _fields_ = [
+        ("id", ctypes.c_uint32),
+        ("type", ctypes.c_uint32),
+        ("name", ctypes.c_char * 32),
+        ("minimum", ctypes.c_int32),
+        ("maximum", ctypes.c_int32),
+        ("step", ctypes.c_int32),
+        ("default_value", ctypes.c_int32),
+        ("flags", ctypes.c_uint32),
+        ("reserved", ctypes.c_uint32 * 2),
+    ]
+
+
+class _v4l2_querymenu_union(ctypes.Union):
+    _pack_ = 1
+    _fields_ = [
+        ("name", ctypes.c_char * 32),
+        ("value", ctypes.c_int64),
+    ]
+
+
+class v4l2_querymenu(ctypes.Structure):
+    _pack_ = 1
+    _anonymous_ = ("u",)
+    _fields_ = [
+        ("id", ctypes.c_uint32),
+        ("index", ctypes.c_uint32),
+        ("u", _v4l2_querymenu_union),
+        ("reserved", ctypes.c_uint32),
+    ]
+
+
+class _v4l2_ext_control_union(ctypes.Union):
+    _pack_ = 1
+    _fields_ = [
+        ("value", ctypes.c_int32),
+        ("value64", ctypes.c_int64),
+        ("ptr", ctypes.c_void_p),
+    ]
+
+
+class v4l2_ext_control(ctypes.Structure):
+    _pack_ = 1
+    _anonymous_ = ("u",)
+    _fields_ = [
+        ("id", ctypes.c_uint32),
+        ("size", ctypes.c_uint32),
+        ("reserved2", ctypes.c_uint32 * 1),
+        ("u", _v4l2_ext_control_union),
+    ]
+
+
+class v4l2_ext_controls(ctypes.Structure):
+    _fields_ = [
+        ("which", ctypes.c_uint32),
+        ("count", ctypes.c_uint32),
+        ("error_idx", ctypes.c_uint32),
+        ("request_fd", ctypes.c_int32),
+        ("reserved", ctypes.c_uint32 * 1),
+        ("controls", ctypes.POINTER(v4l2_ext_control)),
+    ]
+
+
+def _IOWR(nr: int, size: int) -> int:
+    # _IOC(_IOC_READ | _IOC_WRITE, 'V', nr, size)
+    return (3 << 30) | (size << 16) | (ord("V") << 8) | nr
+
+
+VIDIOC_QUERYCTRL = _IOWR(36, ctypes.sizeof(v4l2_queryctrl))
+VIDIOC_QUERYMENU = _IOWR(37, ctypes.sizeof(v4l2_querymenu))
+VIDIOC_G_EXT_CTRLS = _IOWR(71, ctypes.sizeof(v4l2_ext_controls))
+VIDIOC_S_EXT_CTRLS = _IOWR(72, ctypes.sizeof(v4l2_ext_controls))
+
+V4L2_CTRL_TYPE_INTEGER = 1
+V4L2_CTRL_TYPE_BOOLEAN = 2
+V4L2_CTRL_TYPE_MENU = 3
+V4L2_CTRL_TYPE_BUTTON = 4
+V4L2_CTRL_TYPE_CTRL_CLASS = 6
+V4L2_CTRL_TYPE_INTEGER_MENU = 9
+
+V4L2_CTRL_FLAG_DISABLED = 0x0001
+V4L2_CTRL_FLAG_READ_ONLY = 0x0004
+V4L2_CTRL_FLAG_INACTIVE = 0x0010
+V4L2_CTRL_FLAG_WRITE_ONLY = 0x0040
+V4L2_CTRL_FLAG_NEXT_CTRL = 0x80000000
+
+V4L2_CTRL_WHICH_CUR_VAL = 0
+
+
+def control_name(title: str) -> str:
+    """
+    Converts a control title like "Exposure Time, Absolute" to the name v4l2-ctl uses ("exposure_time_absolute")
+    """
+    return re.sub(r"[^a-z0-9]+", "_", title.lower()).strip("_")
+
+
+@dataclass
+class ControlInfo:
+    """
+    Description of a control as reported by VIDIOC_QUERYCTRL
+    """
+    id: int
+    name: str
+    type: int
+    minimum: int
+    maximum: int
+    step: int
+    default: int
+    flags: int
+    # menu index to option name for menu controls
+    menu: dict[int, str] | None = None
+
+    @property
+    def readable(self) -> bool:
+        return not self.flags & V4L2_CTRL_FLAG_WRITE_ONLY and self.type != V4L2_CTRL_TYPE_BUTTON
+
+    @property
+    def writable(self) -> bool:
+        return not self.flags & V4L2_CTRL_FLAG_READ_ONLY
+
+
+class V4L2DeviceFile:
+    """
+    A V4L2 device file that ioctls are performed on
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_NONBLOCK)
+
+    def ioctl(self, request: int, argument: ctypes.Structure):
+        fcntl.ioctl(self._fd, request, argument)
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class ControlBackend:
+    """
+    Reads and writes the controls of a V4L2 device with ioctls
+    """
+
+    def __init__(self, device: V4L2DeviceFile):
+        """
+        @param device the device to perform the ioctls on, e.g. a V4L2DeviceFile or a FakeV4L2Device
+        """
+        self._device = device
+
+    def query_controls(self) -> list[ControlInfo]:
+        """
+        Enumerates all enabled controls of the device
+        """
+        controls: list[ControlInfo] = []
+        query = v4l2_queryctrl()
+        query.id = V4L2_CTRL_FLAG_NEXT_CTRL
+        while True:
+            try:
+                self._device.ioctl(VIDIOC_QUERYCTRL, query)
+            except OSError as e:
+                # EINVAL marks the end of the control list
+                if e.errno == errno.EINVAL:
+                    break
+                raise
+
+            if not query.flags & V4L2_CTRL_FLAG_DISABLED and query.type != V4L2_CTRL_TYPE_CTRL_CLASS:
+                info = ControlInfo(
+                    query.id, control_name(query.name.decode("UTF-8", "replace")), query.type,
+                    query.minimum, query.maximum, query.step, query.default_value, query.flags
+                )
+                if query.type in (V4L2_CTRL_TYPE_MENU, V4L2_CTRL_TYPE_INTEGER_MENU):
+                    info.menu = self._query_menu(query)
+                controls.append(info)
+
+            query.id |= V4L2_CTRL_FLAG_NEXT_CTRL
+        return controls
+
+    def _query_menu(self, query: v4l2_queryctrl) -> dict[int, str]:
+        menu: dict[int, str] = {}
+        item = v4l2_querymenu()
+        item.id = query.id
+        for index in range(query.minimum, query.maximum + 1):
+            item.index = index
+            try:
+                self._device.ioctl(VIDIOC_QUERYMENU, item)
+            except OSError:
+                # menus may have gaps
+                continue
+            if query.type == V4L2_CTRL_TYPE_INTEGER_MENU:
+                menu[index] = str(item.value)
+            else:
+                menu[index] = item.name.decode("UTF-8", "replace")
+        return menu
+
+    @staticmethod
+    def _ext_controls(values: dict[int, int]) -> tuple[v4l2_ext_controls, ctypes.Array]:
+        array = (v4l2_ext_control * len(values))()
+        for control, (control_id, value) in zip(array, values.items()):
+            control.id = control_id
+            control.value = value
+        ext_controls = v4l2_ext_controls()
+        ext_controls.which = V4L2_CTRL_WHICH_CUR_VAL
+        ext_controls.count = len(values)
+        ext_controls.controls = ctypes.cast(array, ctypes.POINTER(v4l2_ext_control))
+        # the array has to be kept alive as long as the struct points to it
+        return ext_controls, array
+
+    def read_controls(self, control_ids: list[int]) -> dict[int, int]:
+        """
+        Reads the current values of multiple controls in one ioctl
+        """
+        if not control_ids:
+            return {}
+        ext_controls, array = self._ext_controls({control_id: 0 for control_id in control_ids})
+        self._device.ioctl(VIDIOC_G_EXT_CTRLS, ext_controls)
+        return {control.id: control.value for control in array}
+
+    def write_controls(self, values: dict[int, int]):
+        """
+        Writes multiple controls in one ioctl. The controls are applied in the order of the dict.
+
+        @raises OSError with the index of the failing control in the error_idx attribute
+        """
+        if not values:
+            return
+        ext_controls, array = self._ext_controls(values)
+        try:
+            self._device.ioctl(VIDIOC_S_EXT_CTRLS, ext_controls)
+        except OSError as e:
+            e.error_idx = ext_controls.error_idx
+            raise
+
+    def close(self):
+        self._device.close()
+
+
+@dataclass
+class FakeControl:
+    """
+    A control emulated by FakeV4L2Device
+    """
+    name: str
+    type: int = V4L2_CTRL_TYPE_INTEGER
+    minimum: int = 0
+    maximum: int = 255
+    step: int = 1
+    default: int = 0
+    flags: int = 0
+    menu: dict[int, str] = field(default_factory=dict)
+    value: int | None = None
+
+
+class FakeV4L2Device:
+    """
+    Emulates the control ioctls of a V4L2 device in memory, for testing without a camera.
+    Every ioctl is counted in ioctl_counts by request.
+    """
+
+    def __init__(self, controls: dict[int, FakeControl] | None = None):
+        """
+        @param controls the emulated controls by control ID
+        """
+        self.controls: dict[int, FakeControl] = dict(controls) if controls is not None else {}
+        for control in self.controls.values():
+            if control.value is None:
+                control.value = control.default
+        self.ioctl_counts: dict[int, int] = {}
+        self.closed = False
+
+    @classmethod
+    def webcam(cls) -> "FakeV4L2Device":
+        """
+        @returns a fake device with the typical controls of a UVC webcam
+        """
+        return cls({
+            0x00980900: FakeControl("Brightness", minimum=-64, maximum=64, default=0),
+            0x00980901: FakeControl("Contrast", minimum=0, maximum=64, default=32),
+            0x00980913: FakeControl("Gain", minimum=0, maximum=100, default=0),
+            0x0098090c: FakeControl("White Balance, Automatic", V4L2_CTRL_TYPE_BOOLEAN, 0, 1, 1, 1),
+            0x009a0901: FakeControl("Auto Exposure", V4L2_CTRL_TYPE_MENU, 0, 3, 1, 3, menu={1: "Manual Mode", 3: "Aperture Priority Mode"}),
+            0x009a0902: FakeControl("Exposure Time, Absolute", minimum=50, maximum=10000, default=300),
+        })
+
+    def _control(self, control_id: int) -> FakeControl:
+        if control_id not in self.controls:
+            raise OSError(errno.EINVAL, f"Invalid control {control_id:#x}")
+        return self.controls[control_id]
+
+    def ioctl(self, request: int, argument):
+        if self.closed:
+            raise OSError(errno.EBADF, "Device is closed")
+        self.ioctl_counts[request] = self.ioctl_counts.get(request, 0) + 1
+
+        if request == VIDIOC_QUERYCTRL:
+            control_id = argument.id
+            if control_id & V4L2_CTRL_FLAG_NEXT_CTRL:
+                following = sorted(i for i in self.controls if i > control_id & ~V4L2_CTRL_FLAG_NEXT_CTRL)
+                if not following:
+                    raise OSError(errno.EINVAL, "No more controls")
+                control_id = following[0]
+            control = self._control(control_id)
+            argument.id = control_id
+            argument.type = control.type
+            argument.name = control.name.encode("UTF-8")[:31]
+            argument.minimum = control.minimum
+            argument.maximum = control.maximum
+            argument.step = control.step
+            argument.default_value = control.default
+            argument.flags = control.flags
+
+        elif request == VIDIOC_QUERYMENU:
+            control = self._control(argument.id)
+            if argument.index not in control.menu:
+                raise OSError(errno.EINVAL, f"Invalid menu index {argument.index}")
+            argument.name = control.menu[argument.index].encode("UTF-8")[:31]
+
+        elif request in (VIDIOC_G_EXT_CTRLS, VIDIOC_S_EXT_CTRLS):
+            controls = argument.controls
+            # like the kernel, all controls are validated before any of them is written
+            for index in range(argument.count):
+                argument.error_idx = index
+                control = self._control(controls[index].id)
+                if request == VIDIOC_S_EXT_CTRLS:
+                    value = controls[index].value
+                    if control.flags & V4L2_CTRL_FLAG_READ_ONLY:
+                        raise OSError(errno.EACCES, f"Control '{control.name}' is read only")
+                    if value < control.minimum or value > control.maximum or (control.menu and value not in control.menu):
+                        raise OSError(errno.ERANGE, f"Value {value} is out of range for control '{control.name}'")
+            argument.error_idx = argument.count
+            for index in range(argument.count):
+                control = self.controls[controls[index].id]
+                if request == VIDIOC_S_EXT_CTRLS:
+                    control.value = controls[index].value
+                else:
+                    controls[index].value = control.value
+
+        else:
+            raise OSError(errno.ENOTTY, f"Unsupported ioctl {request:#x}")
+
+    def close(self):
+        self.closed = True
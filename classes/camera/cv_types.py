@@ -12,4 +12,7 @@ class VideoCapture:
         ...
 
     def isOpened() -> bool:
-        ...
\ No newline at end of file
+        ...
+
+    def release() -> None:
+        ...
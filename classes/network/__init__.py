@@ -0,0 +1,2 @@
+from ._frame_server import FrameServer, StreamConnection, DECODE_MODES
+from ._marker_protocol import encode_markers, encode_thumbnail, decode_markers, is_marker_message, ProtocolError
\ No newline at end of file
@@ -0,0 +1,430 @@
+"""
+Receives JPEG frame streams from any number of stream_source.py senders in one process.
+
+Every sender connects via TCP and sends frames as a 32 bit little endian length followed by the JPEG data.
+Connections are served by an asyncio event loop, so a slow sender never blocks the others, while decoding
+runs in a thread pool. Each connection only keeps the newest received frame: if frames arrive faster than
+they can be decoded, the stale ones are dropped instead of queueing up.
+
+Senders can also run the marker detection themselves and only send the results (see _marker_protocol.py).
+These are turned back into TrackingResults, optionally accompanied by low rate thumbnail frames.
+
+Frames are received with recv_into() into a few reusable buffers per connection and decoded straight
+from them, so receiving a frame doesn't allocate or copy anything. Consumers that only need grayscale
+or lower resolution images (like the marker detector) can have the frames decoded that way directly.
+"""
+
+import asyncio
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from ..camera import TrackingResult
+from ._marker_protocol import (
+    ProtocolError, is_marker_message, decode_header, decode_markers,
+    MESSAGE_MARKERS, MESSAGE_THUMBNAIL, MESSAGE_HEADER_SIZE, FRAME_INFO_SIZE
+)
+
+
+# frame length prefix
+HEADER_FORMAT = "<L"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+# frames larger than this are considered a protocol error
+MAX_FRAME_SIZE = 32 * 1024 * 1024
+# initial size of the receive buffers, they grow to the largest frame received
+INITIAL_BUFFER_SIZE = 256 * 1024
+
+# cv2.imdecode() flags by name, the reduced modes decode at half or quarter resolution which is much faster
+DECODE_MODES = {
+    "color": cv2.IMREAD_COLOR,
+    "gray": cv2.IMREAD_GRAYSCALE,
+    "color2": cv2.IMREAD_REDUCED_COLOR_2,
+    "color4": cv2.IMREAD_REDUCED_COLOR_4,
+    "gray2": cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    "gray4": cv2.IMREAD_REDUCED_GRAYSCALE_4,
+}
+# factor the image size is scaled by when decoding with the flags
+DECODE_SCALES = {
+    cv2.IMREAD_REDUCED_COLOR_2: 0.5,
+    cv2.IMREAD_REDUCED_COLOR_4: 0.25,
+    cv2.IMREAD_REDUCED_COLOR_8: 0.125,
+    cv2.IMREAD_REDUCED_GRAYSCALE_2: 0.5,
+    cv2.IMREAD_REDUCED_GRAYSCALE_4: 0.25,
+    cv2.IMREAD_REDUCED_GRAYSCALE_8: 0.125,
+}
+
+
+class StreamConnection:
+    """
+    State and statistics of one connected sender
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.connected_at = time.time()
+        self.connected = True
+
+        # reusable receive buffers. A connection needs at most three at a time: one being received into,
+        # one waiting for decoding and one being decoded.
+        self._free_buffers: list[bytearray] = []
+        # newest encoded frame (buffer, JPEG data in the buffer) waiting for decoding, older ones are replaced
+        self._pending: tuple[bytearray, memoryview] | None = None
+        # encoded frame currently being decoded
+        self._decoding: tuple[bytearray, memoryview] | None = None
+        # newest decoded frame
+        self._frame: np.ndarray | None = None
+        self._frame_sequence: int = 0
+        self._frame_timestamp: float = 0.0
+        # newest marker results of senders that detect markers themselves
+        self._result: TrackingResult | None = None
+        self._lock = threading.Lock()
+
+        # statistics
+        self.frames_received: int = 0
+        self.results_received: int = 0
+        self.frames_decoded: int = 0
+        self.frames_dropped: int = 0
+        self.decode_errors: int = 0
+        self.bytes_received: int = 0
+        # counters at the time of the last statistics() call for rate calculation
+        self._last_stats_time = time.perf_counter()
+        self._last_stats_frames = 0
+        self._last_stats_decoded = 0
+        self._last_stats_bytes = 0
+
+    @property
+    def queue_depth(self) -> int:
+        """
+        number of received frames that are not decoded yet (at most one pending plus one being decoded)
+        """
+        return int(self._pending is not None) + int(self._decoding is not None)
+
+    def _take_buffer(self, size: int) -> bytearray:
+        """
+        @returns a free receive buffer of at least the requested size
+        """
+        buffer = self._free_buffers.pop() if self._free_buffers else bytearray(INITIAL_BUFFER_SIZE)
+        if len(buffer) < size:
+            # buffers can't be resized while a memoryview of them exists, so replace it
+            buffer = bytearray(max(size, 2 * len(buffer)))
+        return buffer
+
+    def _return_buffer(self, buffer: bytearray):
+        self._free_buffers.append(buffer)
+
+    def latest_frame(self) -> tuple[int, float, np.ndarray | None]:
+        """
+        @returns (sequence, receive timestamp, frame) of the newest decoded frame. The sequence
+            counts decoded frames and is 0 as long as there is none.
+        """
+        with self._lock:
+            return self._frame_sequence, self._frame_timestamp, self._frame
+
+    def latest_result(self) -> TrackingResult | None:
+        """
+        @returns the newest marker result of a sender that detects markers itself, None if there was none yet
+        """
+        with self._lock:
+            return self._result
+
+    def statistics(self) -> dict[str, float]:
+        """
+        @returns rates since the previous call and totals of this connection
+        """
+        now = time.perf_counter()
+        elapsed = max(now - self._last_stats_time, 1e-9)
+        stats = {
+            "fps": (self.frames_received - self._last_stats_frames) / elapsed,
+            "decoded_fps": (self.frames_decoded - self._last_stats_decoded) / elapsed,
+            "bytes_per_second": (self.bytes_received - self._last_stats_bytes) / elapsed,
+            "queue_depth": self.queue_depth,
+            "frames_received": self.frames_received,
+            "results_received": self.results_received,
+            "frames_decoded": self.frames_decoded,
+            "frames_dropped": self.frames_dropped,
+            "decode_errors": self.decode_errors,
+            "connected": self.connected,
+        }
+        self._last_stats_time = now
+        self._last_stats_frames = self.frames_received
+        self._last_stats_decoded = self.frames_decoded
+        self._last_stats_bytes = self.bytes_received
+        return stats
+
+
+class FrameServer:
+    """
+    Asyncio TCP server that ingests the frame streams of many senders concurrently.
+
+    It can either be awaited from an existing event loop (serve()) or run its own event loop
+    in a background thread (start()/stop()), which allows displaying the frames from the main thread.
+    """
+
+    def __init__(self, host: str = "0.0.0.0", port: int = 8000, decode_workers: int = 4, decode_flags: int = cv2.IMREAD_COLOR):
+        """
+        @param host address to listen on
+        @param port TCP port to listen on
+        @param decode_workers number of threads decoding frames
+        @param decode_flags cv2.imdecode() flags the frames are decoded with (see DECODE_MODES), e.g.
+            cv2.IMREAD_REDUCED_GRAYSCALE_2 to get half resolution grayscale frames for the marker detector
+        """
+        self._host = host
+        self._port = port
+        self._decode_flags = decode_flags
+        self._executor = ThreadPoolExecutor(decode_workers, thread_name_prefix="frame-decode")
+        self._connections: dict[str, StreamConnection] = {}
+        self._transports: set[asyncio.Transport] = set()
+        self._server: asyncio.base_events.Server | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._thread: threading.Thread | None = None
+        self._started = threading.Event()
+
+    @property
+    def connections(self) -> dict[str, StreamConnection]:
+        """
+        all connections by name ("host:port" of the sender), including disconnected ones
+        """
+        return dict(self._connections)
+
+    @property
+    def port(self) -> int:
+        """
+        the port the server listens on, which is useful if it was started with port 0
+        """
+        if self._server is not None and self._server.sockets:
+            return self._server.sockets[0].getsockname()[1]
+        return self._port
+
+    @property
+    def decode_scale(self) -> float:
+        """
+        factor the decoded frames are scaled by relative to the sent frames
+        """
+        return DECODE_SCALES.get(self._decode_flags, 1.0)
+
+    def latest_frames(self) -> dict[str, tuple[int, float, np.ndarray]]:
+        """
+        @returns the newest decoded frame of every connection that has one, see StreamConnection.latest_frame()
+        """
+        frames = {}
+        for name, connection in list(self._connections.items()):
+            sequence, timestamp, frame = connection.latest_frame()
+            if frame is not None:
+                frames[name] = (sequence, timestamp, frame)
+        return frames
+
+    def latest_results(self) -> dict[str, TrackingResult]:
+        """
+        @returns the newest marker result of every connection that sends marker results
+        """
+        results = {}
+        for name, connection in list(self._connections.items()):
+            result = connection.latest_result()
+            if result is not None:
+                results[name] = result
+        return results
+
+    def statistics(self) -> dict[str, dict[str, float]]:
+        """
+        @returns the statistics of every connection, see StreamConnection.statistics()
+        """
+        return {name: connection.statistics() for name, connection in list(self._connections.items())}
+
+    # == decoding ==
+
+    def _decode(self, data: memoryview) -> np.ndarray | None:
+        # decode directly from the receive buffer without copying it
+        return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), self._decode_flags)
+
+    def _receive(self, connection: StreamConnection, buffer: bytearray, size: int):
+        """
+        Handles a received message, which is either a JPEG frame or a marker protocol message
+        """
+        data = memoryview(buffer)[:size]
+        if not is_marker_message(data):
+            connection.frames_received += 1
+            self._submit(connection, buffer, data)
+            return
+
+        try:
+            message_type = decode_header(data)[0]
+            if message_type == MESSAGE_MARKERS:
+                # marker results are tiny, so they are decoded right away
+                result = decode_markers(data)
+                with connection._lock:
+                    connection._result = result
+                connection.results_received += 1
+            elif message_type == MESSAGE_THUMBNAIL:
+                connection.frames_received += 1
+                self._submit(connection, buffer, data[MESSAGE_HEADER_SIZE + FRAME_INFO_SIZE:])
+                return
+            else:
+                print(f"Warning: stream '{connection.name}' sent a message of unknown type {message_type}")
+        except ProtocolError as e:
+            print(f"Warning: stream '{connection.name}' sent an invalid message: {e}")
+        connection._return_buffer(buffer)
+
+    def _submit(self, connection: StreamConnection, buffer: bytearray, jpeg: memoryview):
+        """
+        Hands a received JPEG to the decoder. If the connection's previous frame is still being decoded,
+        the frame waits in the connection's pending slot, replacing any older frame waiting there.
+        """
+        if connection._decoding is not None:
+            if connection._pending is not None:
+                connection.frames_dropped += 1
+                connection._return_buffer(connection._pending[0])
+            connection._pending = (buffer, jpeg)
+            return
+
+        connection._decoding = (buffer, jpeg)
+        receive_time = time.time()
+        future = self._loop.run_in_executor(self._executor, self._decode, jpeg)
+        future.add_done_callback(lambda f: self._decoded(connection, f, receive_time))
+
+    def _decoded(self, connection: StreamConnection, future: asyncio.Future, receive_time: float):
+        # called on the event loop
+        connection._return_buffer(connection._decoding[0])
+        connection._decoding = None
+        frame = None if future.cancelled() or future.exception() is not None else future.result()
+        if frame is None:
+            connection.decode_errors += 1
+        else:
+            with connection._lock:
+                connection._frame = frame
+                connection._frame_sequence += 1
+                connection._frame_timestamp = receive_time
+            connection.frames_decoded += 1
+
+        if connection._pending is not None:
+            (buffer, jpeg), connection._pending = connection._pending, None
+            self._submit(connection, buffer, jpeg)
+
+    # == networking ==
+
+    def _connection_made(self, transport: asyncio.Transport) -> StreamConnection:
+        peer = transport.get_extra_info("peername")
+        name = f"{peer[0]}:{peer[1]}" if peer else f"connection {len(self._connections)}"
+        connection = StreamConnection(name)
+        self._connections[name] = connection
+        self._transports.add(transport)
+        print(f"[INFO] Stream '{name}' connected")
+        return connection
+
+    def _connection_lost(self, connection: StreamConnection, transport: asyncio.Transport, error: Exception | None):
+        connection.connected = False
+        self._transports.discard(transport)
+        if error is not None:
+            print(f"Warning: stream '{connection.name}' failed: {error}")
+        print(f"[INFO] Stream '{connection.name}' disconnected")
+
+    async def serve(self):
+        """
+        Runs the server on the current event loop until it is cancelled or stop() is called
+        """
+        self._loop = asyncio.get_running_loop()
+        self._server = await self._loop.create_server(lambda: _FrameProtocol(self), self._host, self._port)
+        self._started.set()
+        async with self._server:
+            try:
+                await self._server.serve_forever()
+            except asyncio.CancelledError:
+                pass
+
+    def start(self):
+        """
+        Runs the server in a background thread with its own event loop
+        """
+        if self._thread is not None:
+            raise RuntimeError("Frame server is already running")
+        self._started.clear()
+        self._thread = threading.Thread(target=asyncio.run, args=(self.serve(),), name="frame-server", daemon=True)
+        self._thread.start()
+        if not self._started.wait(5):
+            raise RuntimeError(f"Frame server could not be started on {self._host}:{self._port}")
+
+    def _close(self):
+        # called on the event loop
+        self._server.close()
+        for transport in list(self._transports):
+            transport.close()
+
+    def stop(self):
+        """
+        Stops the server, closes all connections and stops the decoder threads
+        """
+        if self._loop is not None and self._server is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._close)
+        if self._thread is not None:
+            self._thread.join(5)
+            self._thread = None
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+class _FrameProtocol(asyncio.BufferedProtocol):
+    """
+    Receives the length prefixed frames of one connection. The event loop reads the socket directly
+    into the buffers provided by get_buffer(), which are the header buffer and the connection's
+    reusable frame buffers.
+    """
+
+    def __init__(self, server: FrameServer):
+        self._server = server
+        self._connection: StreamConnection | None = None
+        self._transport: asyncio.Transport | None = None
+        self._header = bytearray(HEADER_SIZE)
+        # buffer currently received into, the header buffer while receiving a header
+        self._target: bytearray = self._header
+        self._target_size: int = HEADER_SIZE
+        self._received: int = 0
+
+    def connection_made(self, transport: asyncio.Transport):
+        self._transport = transport
+        self._connection = self._server._connection_made(transport)
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        # only ask for the rest of the current header or frame, so frames never need to be split up
+        return memoryview(self._target)[self._received:self._target_size]
+
+    def buffer_updated(self, nbytes: int):
+        self._received += nbytes
+        self._connection.bytes_received += nbytes
+        if self._received < self._target_size:
+            return
+
+        if self._target is self._header:
+            (frame_size,) = struct.unpack(HEADER_FORMAT, self._header)
+            if frame_size > MAX_FRAME_SIZE:
+                print(f"Warning: stream '{self._connection.name}' sent a frame of {frame_size} bytes, closing connection")
+                self._transport.close()
+                return
+            if frame_size == 0:
+                # empty frames carry nothing to decode
+                self._received = 0
+                return
+            self._target = self._connection._take_buffer(frame_size)
+            self._target_size = frame_size
+        else:
+            self._server._receive(self._connection, self._target, self._target_size)
+            self._target = self._header
+            self._target_size = HEADER_SIZE
+        self._received = 0
+
+    def eof_received(self) -> bool:
+        # the sender closed the connection
+        return False
+
+    def connection_lost(self, error: Exception | None):
+        # a frame buffer that was only partially received can be reused
+        if self._target is not self._header:
+            self._connection._return_buffer(self._target)
+            self._target = self._header
+        self._server._connection_lost(self._connection, self._transport, error)
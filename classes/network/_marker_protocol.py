@@ -0,0 +1,145 @@
+"""
+Compact binary messages for sending marker detection results instead of frames.
+
+Messages are sent with the same 32 bit length prefix as the JPEG frames of stream_source.py. Their payload
+starts with a magic number that can't be the start of a JPEG (which always starts with 0xFF 0xD8), so
+receivers can handle both on the same connection.
+
+Marker message:     header, then one record per marker (see WIRE_MARKER_DTYPE / WIRE_MARKER_POSE_DTYPE)
+Thumbnail message:  header (marker count 0), then a JPEG of a downscaled frame for monitoring
+
+All values are little endian. A marker message with 10 markers and poses is 8 + 24 + 10 * 60 = 632 bytes.
+"""
+
+import struct
+import numpy as np
+from ..camera import TrackingResult, MARKER_DTYPE
+
+
+MAGIC = b"AT"
+PROTOCOL_VERSION = 1
+
+MESSAGE_MARKERS = 1
+MESSAGE_THUMBNAIL = 2
+
+# message header flags
+FLAG_POSES = 1
+
+# magic, version, message type, flags, marker count
+MESSAGE_HEADER_FORMAT = "<2sBBHH"
+MESSAGE_HEADER_SIZE = struct.calcsize(MESSAGE_HEADER_FORMAT)
+# frame sequence number, capture timestamp, frame width, frame height
+FRAME_INFO_FORMAT = "<QdII"
+FRAME_INFO_SIZE = struct.calcsize(FRAME_INFO_FORMAT)
+
+WIRE_MARKER_DTYPE = np.dtype([
+    ("id", "<u4"),
+    ("corners", "<f4", (4, 2)),     # (tl, tr, br, bl) order
+])
+WIRE_MARKER_POSE_DTYPE = np.dtype([
+    ("id", "<u4"),
+    ("corners", "<f4", (4, 2)),
+    ("rvec", "<f4", (3,)),
+    ("tvec", "<f4", (3,)),
+])
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+def is_marker_message(data: bytes | memoryview) -> bool:
+    """
+    @returns whether a received payload is a message of this protocol rather than a JPEG frame
+    """
+    return len(data) >= MESSAGE_HEADER_SIZE and bytes(data[:2]) == MAGIC
+
+
+def _header(message_type: int, flags: int, marker_count: int, sequence: int, timestamp: float, frame_size: tuple[int, int]) -> bytes:
+    return (
+        struct.pack(MESSAGE_HEADER_FORMAT, MAGIC, PROTOCOL_VERSION, message_type, flags, marker_count)
+        + struct.pack(FRAME_INFO_FORMAT, sequence, timestamp, frame_size[0], frame_size[1])
+    )
+
+
+def encode_markers(result: TrackingResult, frame_size: tuple[int, int] = (0, 0), with_poses: bool = True) -> bytes:
+    """
+    Encodes the markers of a tracking result
+
+    @param result the tracking result to send
+    @param frame_size (width, height) of the frame the markers were detected in
+    @param with_poses True to include the marker poses. Markers without a valid pose are sent with zero vectors.
+    """
+    rows = result.markers
+    records = np.zeros(len(rows), dtype=WIRE_MARKER_POSE_DTYPE if with_poses else WIRE_MARKER_DTYPE)
+    records["id"] = rows["id"]
+    records["corners"] = rows["corners"]
+    flags = 0
+    if with_poses:
+        flags |= FLAG_POSES
+        valid = rows["pose_valid"]
+        records["rvec"][valid] = rows["rvec"][valid]
+        records["tvec"][valid] = rows["tvec"][valid]
+    return _header(MESSAGE_MARKERS, flags, len(rows), result.sequence, result.timestamp, frame_size) + records.tobytes()
+
+
+def encode_thumbnail(sequence: int, timestamp: float, jpeg: bytes, frame_size: tuple[int, int] = (0, 0)) -> bytes:
+    """
+    Encodes a JPEG thumbnail of a frame
+
+    @param frame_size (width, height) of the full frame the thumbnail was made from
+    """
+    return _header(MESSAGE_THUMBNAIL, 0, 0, sequence, timestamp, frame_size) + bytes(jpeg)
+
+
+def decode_header(data: bytes | memoryview) -> tuple[int, int, int, int, float, tuple[int, int]]:
+    """
+    @returns (message type, flags, marker count, sequence, timestamp, (frame width, frame height))
+    """
+    if len(data) < MESSAGE_HEADER_SIZE + FRAME_INFO_SIZE:
+        raise ProtocolError(f"Message of {len(data)} bytes is too short")
+    magic, version, message_type, flags, marker_count = struct.unpack_from(MESSAGE_HEADER_FORMAT, data)
+    if magic != MAGIC:
+        raise ProtocolError("Message does not start with the protocol magic")
+    if version != PROTOCOL_VERSION:
+        raise ProtocolError(f"Unsupported protocol version {version}, expected {PROTOCOL_VERSION}")
+    sequence, timestamp, width, height = struct.unpack_from(FRAME_INFO_FORMAT, data, MESSAGE_HEADER_SIZE)
+    return message_type, flags, marker_count, sequence, timestamp, (width, height)
+
+
+def decode_markers(data: bytes | memoryview) -> TrackingResult:
+    """
+    Decodes a marker message into a tracking result like the ones TrackingStream produces (without frames)
+    """
+    message_type, flags, marker_count, sequence, timestamp, _ = decode_header(data)
+    if message_type != MESSAGE_MARKERS:
+        raise ProtocolError(f"Message of type {message_type} is not a marker message")
+
+    record_dtype = WIRE_MARKER_POSE_DTYPE if flags & FLAG_POSES else WIRE_MARKER_DTYPE
+    offset = MESSAGE_HEADER_SIZE + FRAME_INFO_SIZE
+    if len(data) != offset + marker_count * record_dtype.itemsize:
+        raise ProtocolError(f"Marker message of {len(data)} bytes does not contain {marker_count} markers")
+    records = np.frombuffer(data, dtype=record_dtype, count=marker_count, offset=offset)
+
+    rows = np.zeros(marker_count, dtype=MARKER_DTYPE)
+    rows["id"] = records["id"]
+    rows["corners"] = records["corners"]
+    rows["center"] = records["corners"].mean(axis=1)
+    rows["timestamp"] = timestamp
+    rows["visible"] = True
+    if flags & FLAG_POSES:
+        rows["rvec"] = records["rvec"]
+        rows["tvec"] = records["tvec"]
+        # markers without a pose are sent with zero vectors, which is no valid pose as the marker would be in the camera
+        rows["pose_valid"] = np.any(records["tvec"] != 0, axis=1)
+    return TrackingResult(sequence, timestamp, rows)
+
+
+def thumbnail_jpeg(data: bytes | memoryview) -> memoryview:
+    """
+    @returns the JPEG data of a thumbnail message without copying it
+    """
+    message_type = decode_header(data)[0]
+    if message_type != MESSAGE_THUMBNAIL:
+        raise ProtocolError(f"Message of type {message_type} is not a thumbnail message")
+    return memoryview(data)[MESSAGE_HEADER_SIZE + FRAME_INFO_SIZE:]
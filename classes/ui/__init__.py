@@ -1 +1,10 @@
-from ._main_window import MainWindow
\ No newline at end of file
+
+# the UI depends on customtkinter and tkinter, which take a while to import and need a display,
+# so the UI classes are only imported once they are used
+
+
+def __getattr__(name: str):
+    if name == "MainWindow":
+        from ._main_window import MainWindow
+        return MainWindow
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1 +1,4 @@
-from ._vector import Vec2
\ No newline at end of file
+from ._vector import Vec2
+from ._stage_timer import StageTimer
+from ._assignment import linear_sum_assignment
+from ._backoff import backoff_delay
\ No newline at end of file
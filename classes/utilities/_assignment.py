@@ -0,0 +1,86 @@
+"""
+Optimal assignment (Hungarian algorithm) for matching tracked objects to detections.
+
+Based on the O(n^3) shortest augmenting path formulation described here:
+https://cp-algorithms.com/graph/hungarian-algorithm.html
+The scan over all columns is vectorized with NumPy, so only the outer loops run in Python.
+"""
+
+import numpy as np
+
+
+def linear_sum_assignment(cost: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Solves the rectangular linear sum assignment problem: Every row is assigned to at most one column
+    (and vice versa) so that as many rows/columns as possible are assigned and the total cost is minimal.
+    Same interface as scipy.optimize.linear_sum_assignment.
+
+    @param cost NxM cost matrix. All costs must be finite, use a large value for forbidden assignments.
+    @returns (row_indices, column_indices) of the assignments, sorted by row index
+    """
+    cost = np.asarray(cost, dtype=np.float64)
+    if cost.ndim != 2:
+        raise ValueError(f"Cost matrix must be two dimensional, not {cost.ndim} dimensional")
+    if not np.all(np.isfinite(cost)):
+        raise ValueError("Cost matrix must only contain finite values")
+
+    # the algorithm requires at least as many columns as rows
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    n, m = cost.shape
+
+    if n == 0:
+        empty = np.empty(0, dtype=np.intp)
+        return empty, empty
+
+    # potentials of rows (u) and columns (v), 1 based with index 0 as virtual start column
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    # row assigned to each column (0 = unassigned)
+    assigned_row = np.zeros(m + 1, dtype=np.intp)
+    # previous column on the augmenting path
+    way = np.zeros(m + 1, dtype=np.intp)
+
+    for row in range(1, n + 1):
+        assigned_row[0] = row
+        column = 0
+        min_slack = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+
+        # search for an augmenting path starting at the new row
+        while True:
+            used[column] = True
+            current_row = assigned_row[column]
+            free = ~used[1:]
+
+            slack = cost[current_row - 1] - u[current_row] - v[1:]
+            improved = free & (slack < min_slack[1:])
+            min_slack[1:][improved] = slack[improved]
+            way[1:][improved] = column
+
+            free_slack = np.where(free, min_slack[1:], np.inf)
+            next_column = int(np.argmin(free_slack)) + 1
+            delta = free_slack[next_column - 1]
+
+            u[assigned_row[used]] += delta
+            v[used] -= delta
+            min_slack[1:][free] -= delta
+
+            column = next_column
+            if assigned_row[column] == 0:
+                break
+
+        # flip the assignments along the augmenting path
+        while column != 0:
+            previous_column = way[column]
+            assigned_row[column] = assigned_row[previous_column]
+            column = previous_column
+
+    columns = np.flatnonzero(assigned_row[1:])
+    rows = assigned_row[1:][columns] - 1
+
+    if transposed:
+        rows, columns = columns, rows
+    order = np.argsort(rows)
+    return rows[order], columns[order]
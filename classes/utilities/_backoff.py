@@ -0,0 +1,15 @@
+def backoff_delay(failures: int, start_after: int = 3, initial: float = 0.01, maximum: float = 0.5) -> float:
+    """
+    Time to wait before retrying something that has failed a number of times in a row, e.g. reading a frame.
+    The first few failures are retried immediately, then the delay doubles with every failure up to a maximum.
+
+    @param failures number of consecutive failures so far
+    @param start_after number of failures that are retried without waiting
+    @param initial delay in seconds after the first failure that is waited for
+    @param maximum longest delay in seconds
+    @returns the delay in seconds, 0 to retry immediately
+    """
+    if failures < start_after:
+        return 0.0
+    # the exponent is capped, so long failure streaks can't overflow the float
+    return min(initial * 2 ** min(failures - start_after, 32), maximum)
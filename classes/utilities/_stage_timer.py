@@ -0,0 +1,115 @@
+
+import json
+import time
+import numpy as np
+
+
+class StageTimer:
+    """
+    Low overhead timing of the stages of a processing loop.
+    The durations of the most recent samples of every stage are kept in a fixed size ring buffer,
+    from which percentiles can be calculated on request.
+
+    Usage:
+        timer.start()
+        read_frame()
+        timer.lap("read")
+        process_frame()
+        timer.lap("process")
+    """
+
+    def __init__(self, window: int = 1024, enabled: bool = True):
+        """
+        @param window number of recent samples per stage to calculate statistics from
+        @param enabled False to turn all timing calls into no-ops
+        """
+        self.enabled = enabled
+        self._window = window
+        self._samples: dict[str, np.ndarray] = {}
+        # total number of samples recorded per stage (also used to find the next ring buffer position)
+        self._counts: dict[str, int] = {}
+        self._last_lap: float = time.perf_counter()
+
+    def start(self):
+        """
+        Starts timing the first stage
+        """
+        self._last_lap = time.perf_counter()
+
+    def lap(self, stage: str):
+        """
+        Records the time since the last lap (or start) as the duration of a stage
+        and starts timing the next stage.
+        """
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self.record(stage, now - self._last_lap)
+        self._last_lap = now
+
+    def record(self, stage: str, duration: float):
+        """
+        Records a duration in seconds for a stage
+        """
+        if not self.enabled:
+            return
+        samples = self._samples.get(stage)
+        if samples is None:
+            samples = self._samples[stage] = np.zeros(self._window, dtype=np.float64)
+            self._counts[stage] = 0
+        samples[self._counts[stage] % self._window] = duration
+        self._counts[stage] += 1
+
+    def reset(self):
+        """
+        Deletes all recorded samples
+        """
+        self._samples.clear()
+        self._counts.clear()
+
+    @property
+    def stages(self) -> list[str]:
+        """
+        the names of all stages in the order they were first recorded
+        """
+        return list(self._samples.keys())
+
+    def _recent(self, stage: str) -> np.ndarray:
+        return self._samples[stage][:min(self._counts[stage], self._window)]
+
+    def percentiles(self, stage: str, percentiles: tuple[float, ...] = (50, 95, 99)) -> tuple[float, ...]:
+        """
+        @returns the requested percentiles of the recent durations of a stage in seconds
+        """
+        if stage not in self._samples:
+            raise KeyError(f"No timing samples for stage '{stage}'")
+        return tuple(float(p) for p in np.percentile(self._recent(stage), percentiles))
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        """
+        @returns statistics of the recent durations of every stage in milliseconds:
+            {stage: {"count", "mean", "p50", "p95", "p99", "max"}}
+        """
+        result: dict[str, dict[str, float]] = {}
+        for stage in self._samples:
+            recent = self._recent(stage) * 1000
+            p50, p95, p99 = np.percentile(recent, (50, 95, 99))
+            result[stage] = {
+                "count": self._counts[stage],
+                "mean": float(recent.mean()),
+                "p50": float(p50),
+                "p95": float(p95),
+                "p99": float(p99),
+                "max": float(recent.max())
+            }
+        return result
+
+    def to_json(self) -> str:
+        return json.dumps(self.summary(), indent=4)
+
+    def dump(self, file: str):
+        """
+        Writes the summary to a JSON file
+        """
+        with open(file, "w") as f:
+            f.write(self.to_json())
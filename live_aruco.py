@@ -6,8 +6,9 @@ import argparse
 import imutils
 import cv2
 import sys
+import time
 from classes.utilities import Vec2
-from classes.camera import Marker
+from classes.camera import Marker, TrajectoryStore, draw_trajectory
 import numpy as np
 
 
@@ -41,8 +42,8 @@ markers: dict[int, Marker] = {}
 
 
 tracked_id: int = 0
-points: list[Vec2] = []
 trace_length = 100
+trajectories = TrajectoryStore(trace_length)
 
 
 
@@ -77,6 +78,10 @@ def processDetectedMarkers(frame, corners, ids):
             center = Vec2.between(topLeft, bottomRight)
             cv2.circle(frame, center.icart, 4, (0, 0, 255), -1)
                 
+            if markerID == tracked_id:
+                heading = np.arctan2(topRight.y - topLeft.y, topRight.x - topLeft.x)
+                trajectories.append([markerID], time.time(), np.array([center.cart]), [heading])
+
             if markerID not in markers:
                 markers[markerID] = Marker(markerID)
             else:
@@ -111,7 +116,7 @@ def processRejectedMarkers(frame, corners):
             markerID: int = None
 
             for id, marker in markers.items():
-                if marker.maybe_move(center):
+                if marker.maybe_move((topLeft, topRight, bottomLeft, bottomRight)):
                     markerID = id
                     break
 
@@ -188,11 +193,8 @@ def main(args: dict[str, any]):
         processRejectedMarkers(frame, rejected)
 
         # draw the path
-        if len(points) > 0:
-            last_point = points[0]
-            for point in points:
-                cv2.line(frame, last_point.icart, point.icart, (0, 127, 255), 2)
-                last_point = point
+        if tracked_id in trajectories:
+            draw_trajectory(frame, trajectories.points(tracked_id))
 
         cv2.imshow("frame", frame)
         #cv2.imshow("framebw", framebw)
@@ -3,18 +3,40 @@
 # Based on information from: https://pyframesearch.com/2020/12/21/detecting-aruco-markers-with-opencv-and-python/
 
 import argparse
+import functools
+import time
 import cv2
 import sys
 import numpy as np
 
-from classes.camera import ArucoDetector, CameraDevice, CameraParams, TrackingStream, ARUCO_DICTS
-from classes.ui import MainWindow
+from classes.camera import ArucoDetector, CameraDevice, CameraParams, TrackingStream, ARUCO_DICTS, StreamScheduler, StreamConfig
+from classes.camera import UVCInterface, ControlProfile
 from classes.utilities import Vec2
 
 
-params_matteo = CameraParams().load("calibration/data_046d_0825/20230529_214338/params_20230529_221724.pickle")
-params_signitzer = CameraParams().load("calibration/data_046d_081b/20230529_222038/params_20230529_222038.pickle")
-params_laptop_matteo = CameraParams().load("calibration/data_0408_5343/20230604_215358/params_20230604_215358.pickle")
+# the calibrations are only loaded when they are used, so importing this module stays fast
+CALIBRATION_FILES = {
+    "matteo": "calibration/data_046d_0825/20230529_214338/params_20230529_221724.npz",
+    "signitzer": "calibration/data_046d_081b/20230529_222038/params_20230529_222038.npz",
+    "laptop_matteo": "calibration/data_0408_5343/20230604_215358/params_20230604_215358.npz",
+}
+
+
+@functools.cache
+def load_calibration(name: str) -> CameraParams:
+    return CameraParams().load(CALIBRATION_FILES[name])
+
+
+def apply_control_profile(camera: CameraDevice, name: str):
+    """
+    Applies a saved UVC control profile (see ControlProfile) to a camera, only writing the controls that differ
+    """
+    interface = UVCInterface(camera.video_index)
+    try:
+        changed = interface.apply_profile(ControlProfile.for_camera(camera.identifier, name))
+    finally:
+        interface.close()
+    print(f"[INFO] Control profile '{name}' applied to {camera}, {len(changed)} controls written")
 
 
 def sharpen_image(image: np.ndarray) -> np.ndarray:
@@ -33,6 +55,8 @@ def sharpen_image(image: np.ndarray) -> np.ndarray:
 
 
 def main(args: dict[str, any]) -> int:
+    start_time = time.perf_counter()
+
     type_arg = ARUCO_DICTS.get(args["type"], None)
     if type_arg is None:
         type_arg = ARUCO_DICTS["DICT_4X4_50"]
@@ -47,116 +71,68 @@ def main(args: dict[str, any]) -> int:
     print("vid1: ", video_arg1)
     print("vid2: ", video_arg2)
 
+    if args["profile"] is not None:
+        for camera in (video_arg1, video_arg2):
+            if camera is not None:
+                apply_control_profile(camera, args["profile"])
+
 
     # start window thread
+    from classes.ui import MainWindow
     app_window = MainWindow()
 
-    stream1 = TrackingStream(video_arg1, camera_params=params_laptop_matteo)
-    stream1._configure_source_area(np.float32(
-        [
-            [468, 392],
-            [133, 394],
-            [195, 233],
-            [415, 233]
-        ]
-    ))
-    #stream2 = TrackingStream(video_arg2)
+    configs = [
+        StreamConfig(
+            video_arg1,
+            camera_params=load_calibration("laptop_matteo"),
+            aruco_dict=type_arg,
+            source_corners=np.float32(
+                [
+                    [468, 392],
+                    [133, 394],
+                    [195, 233],
+                    [415, 233]
+                ]
+            )
+        )
+    ]
+    if video_arg2 is not None:
+        configs.append(StreamConfig(video_arg2, camera_params=load_calibration("signitzer"), aruco_dict=type_arg))
 
-    while (True):
-        # frame1: cv2.Mat
-        # frame2: cv2.Mat
-
-        # # read a frame from camera 1
-        # if vid1 is not None:
-        #     _, frame1 = vid1.read()
-        #     if frame1 is None:
-        #         continue
-        # # read a frame from camera 2
-        # if vid2 is not None:
-        #     _, frame2 = vid2.read()
-        #     if frame2 is None:
-        #         continue
+    # run all streams in parallel, each on its own cores
+    scheduler = StreamScheduler(configs)
+    scheduler.start()
 
+    first_frame_shown = False
+    exit_code = 0
+    while (True):
         # exit key
         if cv2.waitKey(1) & 0xFF == ord("q"):
             break
-        
-        #frame = imutils.resize(frame, height=900)
-
-        # camera calibration according to previously recorded values
-        # for now we are assuming that camera 1 is Matteo's camera (C270) and
-        # camera 2 is Signitzer's camera (C310)
-        """
-        if vid1 is not None:
-            h1, w1 = frame1.shape[:2]
-            newmatrix1, roi1 = cv2.getOptimalNewCameraMatrix(
-                params_matteo.matrix, 
-                params_matteo.distortion,
-                (w1, h1), 0, (w1, h1)
-            )
-            frame1 = cv2.undistort(
-                frame1,
-                params_matteo.matrix,
-                params_matteo.distortion,
-                None, newmatrix1
-            )
-        if vid2 is not None:
-            h2, w2 = frame2.shape[:2]
-            newmatrix2, roi2 = cv2.getOptimalNewCameraMatrix(
-                params_signitzer.matrix, 
-                params_signitzer.distortion,
-                (w2, h2), 0, (w2, h2)
-            )
-            frame2 = cv2.undistort(
-                frame2,
-                params_signitzer.matrix,
-                params_signitzer.distortion,
-                None, newmatrix2
-            )
-        """
-
-        # framebw = cv2.cvtColor(frame1, cv2.COLOR_BGR2GRAY)
-        # #_, framebw = cv2.threshold(framebw, 127, 255, cv2.THRESH_BINARY)
-        # #framebw = cv2.fastNlMeansDenoising(framebw, None, 30, 7, 21)
-        # framebw = sharpen_image(framebw)
-
-        # #detect markers
-        # detector.detect(framebw)
-        # detector.draw_markers_on_frame(frame1)
-
-        # if vid1 is not None:
-        #     # Geometrical transformation: https://docs.opencv.org/4.x/da/d54/group__imgproc__transform.html
-        #     warped = cv2.warpPerspective(frame1, transform_matrix, (800, 400), flags=cv2.INTER_LINEAR)
-
-        #     for corner in orig_corners:
-        #         cv2.drawMarker(frame1, corner.icart, (0, 128, 255), thickness=2)
 
-        #     # Transform a point: https://stackoverflow.com/questions/31147438/how-to-undo-a-perspective-transform-for-a-single-point-in-opencv
-        #     transformed_corners: np.ndarray = cv2.perspectiveTransform(np.array([[v.icart for v in orig_corners]], dtype=np.float32), transform_matrix)
-        #     for corner in transformed_corners[0]:
-        #         cv2.drawMarker(warped, np.int32(corner), (0, 255, 0), thickness=2)
-
-
-        #     cv2.imshow("Camera 1", frame1)
-        #     cv2.imshow("Warped Camera 1", warped)
-
-        # if vid2 is not None:
-        #     cv2.imshow("Camera 2", frame2)
-        # #app_window.update_video(frame1)
-
-        frame1 = stream1.update()
-        #frame2 = stream2.update()
-        #both = np.concatenate((frame1, frame2), axis=1)
-        cv2.imshow("Camera 1", frame1)
-        #cv2.imshow("Camera 2", frame2)
-        #cv2.imshow("Both", both)
+        # show the newest frame of every stream
+        newest_frames: dict[int, np.ndarray] = {}
+        try:
+            results = scheduler.collect(timeout=0.01)
+        except RuntimeError as e:
+            print(f"[ERROR] {e}")
+            exit_code = 1
+            break
+        for result in results:
+            if result.frame is not None:
+                newest_frames[result.stream_index] = result.frame
+        for stream_index, frame in newest_frames.items():
+            cv2.imshow(f"Camera {stream_index + 1}", frame)
+        if newest_frames and not first_frame_shown:
+            first_frame_shown = True
+            print(f"[INFO] First frame after {time.perf_counter() - start_time:.3f} s")
 
         if app_window.update():
             break
         
-    
+    scheduler.stop()
     cv2.destroyAllWindows()
-    return 0
+    return exit_code
 
 
 def get_args():
@@ -167,6 +143,8 @@ def get_args():
                     help="Video ID for live tracking")
     ap.add_argument("-t", "--type", required=False,
                     help="type (aka. dictionary) of ArUco tag to detect")
+    ap.add_argument("-p", "--profile", required=False,
+                    help="name of the UVC control profile to apply to the cameras before streaming")
     return vars(ap.parse_args())
 
 
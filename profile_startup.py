@@ -0,0 +1,152 @@
+#! /usr/local/bin/python3
+
+"""
+Measures how long the tracker takes to start, which matters whenever a robot reboots the tracker.
+
+The report contains:
+- an import time breakdown (like python -X importtime) of the modules the tracker needs,
+  measured in a fresh interpreter so nothing is cached
+- the time of every startup phase up to the first frame and the first frame with a tracked marker
+
+Example:
+python3 profile_startup.py -v 0 -c calibration/data_046d_0825/20230529_214338/params_20230529_221724.npz
+python3 profile_startup.py --replay recording.avi
+"""
+
+# only the standard library is imported before the measurement starts
+import time
+START_TIME = time.perf_counter()
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+
+def import_times(modules: list[str]) -> list[dict]:
+    """
+    Imports modules in a fresh interpreter with -X importtime
+
+    @returns one entry per imported module with its own and cumulative import time in milliseconds,
+        in import order
+    """
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + ", ".join(modules)],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True
+    )
+    if process.returncode != 0:
+        raise RuntimeError(f"Importing {modules} failed:\n{process.stderr}")
+
+    entries = []
+    for line in process.stderr.splitlines():
+        # "import time:       self [us] |    cumulative | imported package"
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_time, cumulative_time, name = line.removeprefix("import time:").split("|")
+        entries.append({
+            "module": name.strip(),
+            # the indentation shows how deep in the import tree a module was imported
+            "depth": (len(name) - len(name.lstrip()) - 1) // 2,
+            "self_ms": int(self_time) / 1000,
+            "cumulative_ms": int(cumulative_time) / 1000
+        })
+    return entries
+
+
+def startup_phases(args: dict[str, any]) -> dict[str, float]:
+    """
+    Runs the startup of a tracking stream and measures when each phase is done,
+    in seconds since this script was started
+    """
+    phases: dict[str, float] = {}
+
+    def phase_done(name: str):
+        phases[name] = time.perf_counter() - START_TIME
+
+    from classes.camera import CameraDevice, CameraParams, TrackingStream, ReplaySource, ARUCO_DICTS, PACING_FAST
+    phase_done("import")
+
+    camera_params = CameraParams()
+    if args["calibration"] is not None:
+        camera_params.load(args["calibration"])
+    phase_done("calibration")
+
+    if args["replay"] is not None:
+        source = ReplaySource(args["replay"], PACING_FAST)
+    else:
+        source = CameraDevice.by_video_index(args["video"])
+        phase_done("enumeration")
+
+    stream = TrackingStream(source, camera_params, ARUCO_DICTS[args["type"]], debug_window=False, headless=True)
+    phase_done("stream_setup")
+
+    try:
+        for _ in range(args["max_frames"]):
+            result = stream.update()
+            if result is None:
+                continue
+            if "first_frame" not in phases:
+                phase_done("first_frame")
+            if len(result.markers) > 0:
+                phase_done("first_tracked_frame")
+                break
+    finally:
+        stream.release()
+    return phases
+
+
+def main(args: dict[str, any]) -> int:
+    phases = startup_phases(args)
+    imports = import_times(args["modules"])
+
+    print("[INFO] Startup phases (seconds since start):")
+    for name, seconds in phases.items():
+        print(f"    {name:<20} {seconds:8.3f}")
+    if "first_tracked_frame" not in phases:
+        print(f"[WARNING] No marker was tracked in the first {args['max_frames']} frames")
+
+    total_ms = sum(entry["self_ms"] for entry in imports)
+    print(f"[INFO] Importing {', '.join(args['modules'])} takes {total_ms:.1f} ms, slowest modules (cumulative):")
+    top_level = sorted(imports, key=lambda entry: entry["cumulative_ms"], reverse=True)[:args["top"]]
+    for entry in top_level:
+        print(f"    {entry['module']:<45} {entry['cumulative_ms']:8.1f} ms (self {entry['self_ms']:.1f} ms)")
+
+    if args["output"] is not None:
+        with open(args["output"], "w") as f:
+            json.dump({
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "phases": phases,
+                "import_total_ms": total_ms,
+                "imports": imports
+            }, f, indent=4)
+        print(f"[INFO] Report written to '{args['output']}'")
+    return 0
+
+
+def get_args():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-v", "--video", type=int, default=0,
+                    help="video index of the camera to start")
+    ap.add_argument("--replay", required=False,
+                    help="video file, image directory or frame dump to start from instead of a camera")
+    ap.add_argument("-c", "--calibration", required=False,
+                    help="camera calibration file to load")
+    ap.add_argument("-t", "--type", default="DICT_4X4_50",
+                    help="type (aka. dictionary) of ArUco tag to detect")
+    ap.add_argument("-f", "--max-frames", type=int, default=100,
+                    help="maximum number of frames to wait for the first tracked marker")
+    ap.add_argument("-m", "--modules", nargs="+", default=["main"],
+                    help="modules whose import time is broken down")
+    ap.add_argument("--top", type=int, default=15,
+                    help="number of slowest modules to list")
+    ap.add_argument("-o", "--output", required=False,
+                    help="file to write the JSON report to")
+    return vars(ap.parse_args())
+
+
+if __name__ == "__main__":
+    sys.exit(main(get_args()))
@@ -1,29 +1,68 @@
-import io
-import socket
-import struct
+#! /usr/local/bin/python3
+
+"""
+Receives the JPEG streams of any number of stream_source.py senders and shows every stream in its own window.
+The network handling and decoding run in the background (see FrameServer), so only displaying happens here.
+
+Example:
+python3 stream_sink.py -p 8000
+"""
+
+import argparse
+import sys
+import time
 import cv2
-import numpy as np
-server_socket = socket.socket()
-server_socket.bind(('0.0.0.0', 8000))
-server_socket.listen(0)
-connection = server_socket.accept()[0].makefile('rwb')
-
-
-try:
-    while True:
-        # Read the length of the image as a 32-bit unsigned int
-        image_len = struct.unpack('<L', connection.read(struct.calcsize('<L')))[0]
-        # Construct a stream to hold the image data and read the image data from the connection
-        image_stream = io.BytesIO()
-        image_stream.write(connection.read(image_len))
-        # Rewind the stream and convert the image data to a NumPy array
-        image_stream.seek(0)
-        image_array = np.frombuffer(image_stream.getvalue(), dtype=np.uint8)
-        # Decode the image and display it
-        image = cv2.imdecode(image_array, cv2.IMREAD_COLOR)
-
-        cv2.imshow('Image', image)
-
-finally:
-    connection.close()
-    server_socket.close()
\ No newline at end of file
+from classes.network import FrameServer, DECODE_MODES
+
+
+def main(args: dict[str, any]) -> int:
+    server = FrameServer(args["host"], args["port"], decode_workers=args["workers"], decode_flags=DECODE_MODES[args["decode"]])
+    server.start()
+    print(f"[INFO] Waiting for streams on {args['host']}:{server.port}")
+
+    shown_sequences: dict[str, int] = {}
+    last_report = time.perf_counter()
+    try:
+        while True:
+            # only show frames that weren't shown yet
+            for name, (sequence, _, frame) in server.latest_frames().items():
+                if shown_sequences.get(name) != sequence:
+                    shown_sequences[name] = sequence
+                    cv2.imshow(name, frame)
+
+            if time.perf_counter() - last_report >= args["report_interval"]:
+                last_report = time.perf_counter()
+                for name, stats in server.statistics().items():
+                    if not stats["connected"]:
+                        continue
+                    print(
+                        f"[STATS] {name}: {stats['fps']:.1f} fps received, {stats['decoded_fps']:.1f} fps decoded, "
+                        f"{stats['bytes_per_second'] / 1024:.0f} KiB/s, queue depth {stats['queue_depth']}, "
+                        f"{stats['frames_dropped']} dropped, {stats['results_received']} marker results"
+                    )
+
+            if cv2.waitKey(1) & 0xFF == ord("q"):
+                break
+    finally:
+        server.stop()
+        cv2.destroyAllWindows()
+    return 0
+
+
+def get_args():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default="0.0.0.0",
+                    help="address to listen on")
+    ap.add_argument("-p", "--port", type=int, default=8000,
+                    help="TCP port to listen on")
+    ap.add_argument("-w", "--workers", type=int, default=4,
+                    help="number of frame decoding threads")
+    ap.add_argument("-d", "--decode", choices=list(DECODE_MODES.keys()), default="color",
+                    help="how to decode the frames, the gray and reduced (2 = half, 4 = quarter resolution) modes are faster")
+    ap.add_argument("-r", "--report-interval", type=float, default=5.0,
+                    help="seconds between statistics reports")
+    return vars(ap.parse_args())
+
+
+if __name__ == "__main__":
+    sys.exit(main(get_args()))
@@ -1,43 +1,148 @@
+#! /usr/local/bin/python3
+
+"""
+Streams a camera to a stream_sink.py receiver.
+
+In "jpeg" mode, every frame is sent as a JPEG from a Raspberry Pi camera.
+In "markers" mode, the markers are detected right here and only the marker corners (and poses, if a calibration
+is provided) are sent in a compact binary format, which needs a tiny fraction of the bandwidth and no JPEG
+encoding/decoding. Downscaled thumbnail frames can be sent in addition at a low rate for monitoring.
+
+Example:
+python3 stream_source.py --host 192.168.4.106 -m markers -c calibration/<camera>/<date>/params_<date>.npz --thumbnail-interval 1
+"""
+
+import argparse
 import io
 import socket
 import struct
+import sys
 import time
-import picamera2
+import cv2
+
+
+HEADER_FORMAT = "<L"
+
+
+def send_message(client_socket: socket.socket, payload: bytes):
+    # length prefix and payload in one call, so small marker messages go out in one packet
+    client_socket.sendall(struct.pack(HEADER_FORMAT, len(payload)) + payload)
+
+
+def stream_jpeg(client_socket: socket.socket, args: dict[str, any]):
+    import picamera2
+
+    # Make a file-like object out of the connection
+    connection = client_socket.makefile('rwb')
+    try:
+        with picamera2.PiCamera() as camera:
+            camera.resolution = (640, 480)
+            camera.framerate = 24
+            time.sleep(2) # Let camera warm up
+            stream = io.BytesIO()
+
+            for _ in camera.capture_continuous(stream, 'jpeg', use_video_port=True):
+                # Send the image length and data over the network
+                connection.write(struct.pack(HEADER_FORMAT, stream.tell()))
+                connection.flush()
+                stream.seek(0)
+                connection.write(stream.read())
+                stream.seek(0)
+                stream.truncate()
+
+                time.sleep(0.01)
+    finally:
+        connection.close()
+
+
+def stream_markers(client_socket: socket.socket, args: dict[str, any]):
+    from classes.camera import ArucoDetector, PoseEstimator, CameraParams, TrackingResult, ARUCO_DICTS, sharpen_image
+    from classes.network import encode_markers, encode_thumbnail
+
+    camera_params = CameraParams()
+    if args["calibration"] is not None:
+        camera_params.load(args["calibration"])
+    detector = ArucoDetector(ARUCO_DICTS[args["type"]], camera_params)
+    pose_estimator = PoseEstimator(camera_params, default_marker_size=args["marker_size"])
+    with_poses = camera_params.matrix is not None
+
+    capture = cv2.VideoCapture(args["video"])
+    capture.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
+    capture.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
+    frame_size = (int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)), int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+
+    sequence = 0
+    last_thumbnail = 0.0
+    frame = None
+    try:
+        while True:
+            status, frame = capture.read(frame)
+            timestamp = time.time()
+            if not status:
+                print("[ERROR] Could not read from camera")
+                break
 
-# Connect a client socket to my laptop's IP address and port 8000
-client_socket = socket.socket()
-client_socket.connect(('192.168.4.106', 8000))
+            frame_bw = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            # same preprocessing as TrackingStream.update(), so both detect the same markers
+            if not args["no_sharpen"]:
+                frame_bw = sharpen_image(frame_bw)
+            detector.detect(frame_bw, timestamp)
+            pose_estimator.estimate(detector.marker_table)
+            result = TrackingResult(sequence, timestamp, detector.marker_table.visible_rows)
+            send_message(client_socket, encode_markers(result, frame_size, with_poses))
 
-# Make a file-like object out of the connection
-connection = client_socket.makefile('rwb')
+            if args["thumbnail_interval"] > 0 and timestamp - last_thumbnail >= args["thumbnail_interval"]:
+                last_thumbnail = timestamp
+                thumbnail = cv2.resize(frame, None, fx=args["thumbnail_scale"], fy=args["thumbnail_scale"], interpolation=cv2.INTER_AREA)
+                _, jpeg = cv2.imencode(".jpg", thumbnail, [cv2.IMWRITE_JPEG_QUALITY, 70])
+                send_message(client_socket, encode_thumbnail(sequence, timestamp, jpeg.tobytes(), frame_size))
 
+            sequence += 1
+    finally:
+        capture.release()
 
-try:
-    with picamera2.PiCamera() as camera:
-        camera.resolution = (640, 480)
-        camera.framerate = 24
-        time.sleep(2) # Let camera warm up
-        start = time.time()
-        stream = io.BytesIO()
 
-        for _ in camera.capture_continuous(stream, 'jpeg', use_video_port=True):
-            # Send the image length and data over the network
-            connection.write(struct.pack('<L', stream.tell()))
-            connection.flush()
-            stream.seek(0)
-            connection.write(stream.read())
-            stream.seek(0)
-            stream.truncate()
+def main(args: dict[str, any]) -> int:
+    # Connect a client socket to the receiver
+    client_socket = socket.socket()
+    client_socket.connect((args["host"], args["port"]))
+    client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
 
-            time.sleep(0.01)
+    try:
+        if args["mode"] == "markers":
+            stream_markers(client_socket, args)
+        else:
+            stream_jpeg(client_socket, args)
+    finally:
+        client_socket.close()
+        time.sleep(1)
+    return 1
 
-except Exception:
-    raise
 
-finally:
-    connection.close()
-    client_socket.close()
+def get_args():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default="192.168.4.106",
+                    help="address of the receiver")
+    ap.add_argument("-p", "--port", type=int, default=8000,
+                    help="TCP port of the receiver")
+    ap.add_argument("-m", "--mode", choices=["jpeg", "markers"], default="jpeg",
+                    help="send JPEG frames or detect markers locally and only send the results")
+    ap.add_argument("-v", "--video", type=int, default=0,
+                    help="video device index to detect markers on (markers mode)")
+    ap.add_argument("-t", "--type", default="DICT_4X4_50",
+                    help="type (aka. dictionary) of ArUco tag to detect (markers mode)")
+    ap.add_argument("-c", "--calibration", required=False,
+                    help="camera calibration file, marker poses are only sent if provided (markers mode)")
+    ap.add_argument("-s", "--marker-size", type=float, default=0.053,
+                    help="marker side length in meters for pose estimation (markers mode)")
+    ap.add_argument("--no-sharpen", action="store_true",
+                    help="detect markers on the unsharpened frames, which saves time on slow devices but may miss markers TrackingStream would detect (markers mode)")
+    ap.add_argument("--thumbnail-interval", type=float, default=0,
+                    help="seconds between thumbnail frames, 0 to send none (markers mode)")
+    ap.add_argument("--thumbnail-scale", type=float, default=0.25,
+                    help="size of the thumbnails relative to the frames (markers mode)")
+    return vars(ap.parse_args())
 
-    time.sleep(1)
 
-    exit(1)
\ No newline at end of file
+if __name__ == "__main__":
+    sys.exit(main(get_args()))
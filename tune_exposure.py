@@ -0,0 +1,96 @@
+#! /usr/local/bin/python3
+
+"""
+Tunes the exposure time and gain of a camera for marker detection (see ExposureTuner) and optionally saves
+the result as a control profile of the camera, which main.py can apply with --profile.
+
+With --replay, a simulated camera renders the replayed frames with the tuned exposure instead, so the tuner
+can be tried without hardware.
+
+Example:
+python3 tune_exposure.py -v 0 --save-profile tracking
+python3 tune_exposure.py --replay recording.avi --motion-speed 600
+"""
+
+import argparse
+import sys
+
+from classes.camera import (
+    CameraDevice, CameraParams, TrackingStream, ReplaySource, SimulatedCamera, UVCInterface, ControlBackend,
+    ExposureTuner, ARUCO_DICTS, PACING_FAST
+)
+
+
+def main(args: dict[str, any]) -> int:
+    camera: CameraDevice | None = None
+    if args["replay"] is not None:
+        source = SimulatedCamera(ReplaySource(args["replay"], PACING_FAST, loop=True), motion_speed=args["motion_speed"])
+        interface = UVCInterface(0, ControlBackend(source.device))
+    else:
+        camera = CameraDevice.by_video_index(args["video"])
+        source = camera
+        interface = UVCInterface(camera.video_index)
+
+    camera_params = CameraParams()
+    if args["calibration"] is not None:
+        camera_params.load(args["calibration"])
+
+    tuner = ExposureTuner(interface, target_recall=args["target_recall"], window=args["window"])
+    stream = TrackingStream(source, camera_params, ARUCO_DICTS[args["type"]], debug_window=False, headless=True, exposure_tuner=tuner)
+
+    try:
+        decisions = 0
+        for _ in range(args["max_frames"]):
+            stream.update()
+            for exposure, gain, stats, action in tuner.history[decisions:]:
+                sharpness = f"{stats.sharpness:.2f}" if stats.sharpness is not None else "-"
+                print(f"[INFO] exposure {exposure:5d}, gain {gain:3d}: {stats.markers:4.1f} markers, {stats.rejected:4.1f} rejected, "
+                      f"sharpness {sharpness}, brightness {stats.brightness:5.1f}, clipped {stats.clipped_low:.3f}/{stats.clipped_high:.3f} -> {action}")
+            decisions = len(tuner.history)
+            if tuner.converged:
+                break
+    finally:
+        stream.release()
+
+    if not tuner.converged:
+        print(f"[ERROR] Exposure did not converge within {args['max_frames']} frames")
+        return 1
+    print(f"[INFO] Converged to exposure {tuner.exposure} and gain {tuner.gain}")
+
+    if args["save_profile"] is not None:
+        if camera is None:
+            print("[ERROR] Profiles can only be saved for real cameras")
+            return 1
+        names = [name for name in ("auto_exposure", "exposure_auto", "exposure_dynamic_framerate", "exposure_auto_priority",
+                                   "exposure_time_absolute", "exposure_absolute", "gain") if name in interface.controls]
+        file = interface.profile(args["save_profile"], names).save_for_camera(camera.identifier)
+        print(f"[INFO] Control profile written to '{file}'")
+    interface.close()
+    return 0
+
+
+def get_args():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-v", "--video", type=int, default=0,
+                    help="video index of the camera to tune")
+    ap.add_argument("--replay", required=False,
+                    help="video file, image directory or frame dump to tune a simulated camera on instead")
+    ap.add_argument("--motion-speed", type=float, default=400.0,
+                    help="speed of the simulated motion in pixels per second (--replay only)")
+    ap.add_argument("-c", "--calibration", required=False,
+                    help="camera calibration file to load")
+    ap.add_argument("-t", "--type", default="DICT_4X4_50",
+                    help="type (aka. dictionary) of ArUco tag to detect")
+    ap.add_argument("-r", "--target-recall", type=float, default=0.9,
+                    help="fraction of the markers that must still be decoded at the chosen exposure time")
+    ap.add_argument("-w", "--window", type=int, default=15,
+                    help="number of frames to average the statistics over per decision")
+    ap.add_argument("-f", "--max-frames", type=int, default=2000,
+                    help="maximum number of frames to tune for")
+    ap.add_argument("-s", "--save-profile", required=False,
+                    help="name of the control profile to save the tuned controls as")
+    return vars(ap.parse_args())
+
+
+if __name__ == "__main__":
+    sys.exit(main(get_args()))